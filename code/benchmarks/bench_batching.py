@@ -0,0 +1,89 @@
+"""
+Epoch time of the classifier training loop with per-sample DataLoaders and with in-memory TensorLoaders
+
+Usage: python bench_batching.py [-n <n_events>] [-b <n_batches>] [-e <n_epochs>]
+
+Times one epoch (training + validation) over a synthetic SM and EFT dataset, once with the previous
+``random_split`` + ``DataLoader`` pipeline and once with :class:`ml4eft.core.classifier.TensorLoader`, and reports how
+much of the epoch is spent on data handling alone.
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import torch
+import torch.utils.data as data
+
+from ml4eft.core import classifier
+
+FEATURES = ['f{}'.format(i) for i in range(8)]
+
+
+def make_datasets(n_events, val_ratio=0.2):
+    rng = np.random.default_rng(0)
+    datasets = []
+    for hypothesis in [0, 1]:
+        df = pd.DataFrame(rng.normal(size=(n_events, len(FEATURES))), columns=FEATURES)
+        datasets.append(classifier.EventDataset(df, xsec=1.0, path='synthetic', n_dat=n_events, features=FEATURES,
+                                                hypothesis=hypothesis))
+    n_val = int(val_ratio * n_events)
+    return datasets, n_events - n_val, n_val
+
+
+def dataloader_split(datasets, n_train, n_val, n_batches):
+    split = [data.random_split(dataset, [n_train, n_val]) for dataset in datasets]
+    train = [data.DataLoader(s[0], batch_size=int(n_train / n_batches), shuffle=True) for s in split]
+    val = [data.DataLoader(s[1], batch_size=int(n_val / n_batches), shuffle=False) for s in split]
+    return train, val
+
+
+def tensorloader_split(datasets, n_train, n_val, n_batches):
+    split = []
+    for dataset in datasets:
+        indices = torch.randperm(len(dataset))
+        split.append([dataset.subset(indices[:n_train]), dataset.subset(indices[n_train:])])
+    train = [classifier.TensorLoader(s[0], batch_size=int(n_train / n_batches), shuffle=True) for s in split]
+    val = [classifier.TensorLoader(s[1], batch_size=int(n_val / n_batches), shuffle=False) for s in split]
+    return train, val
+
+
+def epoch(model, optimizer, train_loader, val_loader, train=True):
+    with torch.no_grad():
+        for minibatch in zip(*val_loader):
+            for event, weight, label in minibatch:
+                if train:
+                    model(event.float())
+
+    for minibatch in zip(*train_loader):
+        if not train:
+            continue
+        loss = torch.zeros(1)
+        for event, weight, label in minibatch:
+            output = model(event.float())
+            loss += torch.mean(- (1 - label) * weight * torch.log(1 - output) - label * weight * torch.log(output))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--n_events", type=int, default=500000, help="number of SM and of EFT events")
+    parser.add_argument("-b", "--n_batches", type=int, default=200, help="number of minibatches per epoch")
+    parser.add_argument("-e", "--n_epochs", type=int, default=3, help="number of epochs to average over")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    datasets, n_train, n_val = make_datasets(args.n_events)
+    model = classifier.Classifier([len(FEATURES), 100, 100, 100, 1], 10)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+
+    for name, split in [('DataLoader', dataloader_split), ('TensorLoader', tensorloader_split)]:
+        train_loader, val_loader = split(datasets, n_train, n_val, args.n_batches)
+        for train, label in [(False, 'data only'), (True, 'full epoch')]:
+            t_start = time.perf_counter()
+            for _ in range(args.n_epochs):
+                epoch(model, optimizer, train_loader, val_loader, train=train)
+            t_epoch = (time.perf_counter() - t_start) / args.n_epochs
+            print("{:<14s} {:<12s} {:8.2f} s / epoch".format(name, label, t_epoch))
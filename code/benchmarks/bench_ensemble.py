@@ -0,0 +1,82 @@
+"""
+Training time of replicas of the classifier, one by one and as a single batched ensemble
+
+Usage: python bench_ensemble.py [-r <n_replicas>] [-n <n_events>] [-b <n_batches>] [-e <n_epochs>]
+
+Trains ``n_replicas`` classifiers on synthetic SM and EFT samples, once sequentially as
+:class:`ml4eft.core.classifier.Fitter` does per replica, and once with :class:`ml4eft.core.ensemble.EnsembleClassifier`,
+and reports the time per epoch of all replicas together.
+"""
+
+import argparse
+import time
+import torch
+from torch.utils.data import TensorDataset
+
+from ml4eft.core import classifier, ensemble
+
+N_FEATURES = 8
+ARCHITECTURE = [N_FEATURES, 100, 100, 100, 1]
+
+
+def loss_fn(output, label, weight):
+    loss = - (1 - label) * weight * torch.log(1 - output) - label * weight * torch.log(output)
+    return loss.mean(dim=(-2, -1))
+
+
+def make_data(n_replicas, n_events):
+    data = []
+    for hypothesis in [0, 1]:
+        events = torch.randn(n_replicas, n_events, N_FEATURES)
+        weights = torch.ones(n_replicas, n_events, 1)
+        labels = torch.full((n_replicas, n_events, 1), float(hypothesis))
+        data.append((events, weights, labels))
+    return data
+
+
+def sequential(data, n_batches, n_epochs):
+    n_replicas = data[0][0].shape[0]
+    for replica in range(n_replicas):
+        model = classifier.Classifier(ARCHITECTURE, 10)
+        optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+        loaders = [classifier.TensorLoader(TensorDataset(*(t[replica] for t in tensors)),
+                                           batch_size=int(tensors[0].shape[1] / n_batches), shuffle=True)
+                   for tensors in data]
+        for _ in range(n_epochs):
+            for minibatch in zip(*loaders):
+                loss = sum(loss_fn(model(event), label, weight) for event, weight, label in minibatch)
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+
+
+def batched(data, n_batches, n_epochs):
+    n_replicas = data[0][0].shape[0]
+    model = ensemble.EnsembleClassifier(ARCHITECTURE, 10, n_replicas)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-3)
+    loaders = [ensemble.EnsembleLoader(tensors, batch_size=int(tensors[0].shape[1] / n_batches), shuffle=True)
+               for tensors in data]
+    for _ in range(n_epochs):
+        for minibatch in zip(*loaders):
+            loss = sum(loss_fn(model(event), label, weight) for event, weight, label in minibatch)
+            optimizer.zero_grad()
+            loss.sum().backward()
+            optimizer.step()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--n_replicas", type=int, default=25, help="number of replicas")
+    parser.add_argument("-n", "--n_events", type=int, default=20000, help="number of SM and of EFT events per replica")
+    parser.add_argument("-b", "--n_batches", type=int, default=20, help="number of minibatches per epoch")
+    parser.add_argument("-e", "--n_epochs", type=int, default=3, help="number of epochs to average over")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    data = make_data(args.n_replicas, args.n_events)
+
+    for name, train in [('sequential', sequential), ('ensemble', batched)]:
+        t_start = time.perf_counter()
+        train(data, args.n_batches, args.n_epochs)
+        t_epoch = (time.perf_counter() - t_start) / args.n_epochs
+        print("{:<12s} {:8.2f} s / epoch for {} replicas".format(name, t_epoch, args.n_replicas))
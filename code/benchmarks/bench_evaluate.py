@@ -0,0 +1,67 @@
+"""
+Time to evaluate all replicas of all EFT ratio functions one network at a time and as stacked, batched networks
+
+Usage: python bench_evaluate.py [-n <n_events>] [-f <n_functions>] [-r <n_replicas>] [-s <scaler_type>]
+
+Builds ``n_functions x n_replicas`` randomly initialised classifiers with fitted scalers and evaluates them on
+``n_events`` synthetic events, once with a forward pass per network, as ``Analyse.evaluate_models`` did, and with
+:class:`ml4eft.core.ensemble.EnsembleEvaluator`, with the layers of all networks evaluated network by network (the
+default on CPU) and in one batched matrix multiplication. Reports the largest difference to the forward passes.
+"""
+
+import argparse
+import time
+import numpy as np
+import torch
+
+from ml4eft.core import classifier, scalers
+from ml4eft.core.ensemble import EnsembleEvaluator
+
+ARCHITECTURE = [8, 100, 100, 100, 1]
+
+
+def make_models(n_functions, n_replicas, scaler_type, events):
+    models, models_scalers = [], []
+    for i in range(n_functions):
+        models.append([classifier.Classifier(ARCHITECTURE, c=(-1) ** i * (i + 1)) for _ in range(n_replicas)])
+        models_scalers.append([scalers.make_scaler(scaler_type).fit(events[torch.randperm(len(events))[:10000]])
+                               for _ in range(n_replicas)])
+    return models, models_scalers
+
+
+def evaluate_loop(models, models_scalers, events):
+    out = []
+    with torch.no_grad():
+        for replicas, replica_scalers in zip(models, models_scalers):
+            out.append(np.vstack([model.n_alpha(scaler(events).float()).numpy().flatten()
+                                  for model, scaler in zip(replicas, replica_scalers)]))
+    return np.stack(out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--n_events", type=int, default=100000, help="number of events")
+    parser.add_argument("-f", "--n_functions", type=int, default=44, help="number of ratio functions")
+    parser.add_argument("-r", "--n_replicas", type=int, default=25, help="number of replicas per function")
+    parser.add_argument("-s", "--scaler_type", default='robust', help="robust, standardise or quantile")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    events = torch.exp(torch.randn(args.n_events, ARCHITECTURE[0], dtype=torch.float64))
+    models, models_scalers = make_models(args.n_functions, args.n_replicas, args.scaler_type, events)
+
+    t_start = time.perf_counter()
+    out_loop = evaluate_loop(models, models_scalers, events)
+    t_loop = time.perf_counter() - t_start
+
+    print("{} networks on {} events".format(args.n_functions * args.n_replicas, args.n_events))
+    print("{:<32s} {:8.2f} s".format("forward pass per network", t_loop))
+
+    for batched, label in [(False, "evaluator, network by network"), (True, "evaluator, batched layers")]:
+        t_start = time.perf_counter()
+        evaluator = EnsembleEvaluator(models, models_scalers, batched=batched)
+        t_build = time.perf_counter() - t_start
+        out = evaluator.evaluate(events)
+        t_eval = time.perf_counter() - t_start - t_build
+        print("{:<32s} {:8.2f} s (+ {:.2f} s to stack the networks), max difference {:.2e}".format(
+            label, t_eval, t_build, np.abs(out_loop - out).max()))
@@ -0,0 +1,101 @@
+"""
+Peak memory and time of the median over replicas, from all replica outputs and reduced while evaluating in chunks
+
+Usage: python bench_evaluate_reduced.py [-n <n_events>] [-f <n_functions>] [-r <n_replicas>]
+
+Loads ``n_functions x n_replicas`` randomly initialised classifiers with fitted scalers into an
+:class:`ml4eft.analyse.analyse.Analyse` and computes the median over the replicas of every ratio function on
+``n_events`` events, once by evaluating all replicas and reducing afterwards, as ``Optimize`` did, and once with
+``evaluate_models(df, reduction='median')``. Reports the wall time and the peak growth of the resident memory.
+"""
+
+import argparse
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import torch
+
+from ml4eft.analyse.analyse import Analyse
+from ml4eft.core import classifier, scalers
+
+FEATURES = ['f{}'.format(i) for i in range(8)]
+ARCHITECTURE = [len(FEATURES), 32, 32, 1]
+
+
+def make_analyser(n_functions, n_replicas, events):
+    analyser = Analyse({})
+    analyser.model_dict = {'lin': {}}
+    run_card = {'features': FEATURES, 'architecture': ARCHITECTURE}
+    for i in range(n_functions):
+        analyser.model_dict['lin']['c{}'.format(i)] = {
+            'models': np.array([classifier.Classifier(ARCHITECTURE, 10) for _ in range(n_replicas)]),
+            'idx': np.arange(n_replicas),
+            'scalers': np.array([scalers.make_scaler('robust').fit(events[:10000]) for _ in range(n_replicas)]),
+            'run_card': run_card,
+            'rep_paths': np.array(['mc_run_{}'.format(rep) for rep in range(n_replicas)])}
+
+    analyser.model_df = pd.DataFrame.from_dict({('lin', c_name): entry for c_name, entry in
+                                                analyser.model_dict['lin'].items()}, orient='index')
+    analyser.evaluators = analyser.build_evaluators()
+    return analyser
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(func):
+    # sample the resident memory on a thread, tracemalloc does not see the allocations made by torch
+    baseline = rss()
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.005):
+            peak[0] = max(peak[0], rss())
+
+    thread = threading.Thread(target=sample)
+    thread.start()
+    t_start = time.perf_counter()
+    result = func()
+    t_eval = time.perf_counter() - t_start
+    done.set()
+    thread.join()
+    return result, t_eval, (max(peak[0], rss()) - baseline) / 1024 ** 2
+
+
+def reduce_after(analyser, df):
+    analyser.evaluate_models(df)
+    analyser.reduce_replicas('median')
+    return analyser.nn_stack
+
+
+def reduce_while(analyser, df):
+    analyser.evaluate_models(df, reduction='median')
+    return analyser.nn_stack
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--n_events", type=int, default=1000000, help="number of events")
+    parser.add_argument("-f", "--n_functions", type=int, default=10, help="number of ratio functions")
+    parser.add_argument("-r", "--n_replicas", type=int, default=25, help="number of replicas per function")
+    args = parser.parse_args()
+
+    df = pd.DataFrame(np.exp(np.random.default_rng(0).normal(size=(args.n_events, len(FEATURES)))), columns=FEATURES)
+    events = torch.tensor(df.values)
+
+    print("{} ratio functions x {} replicas on {} events".format(args.n_functions, args.n_replicas, args.n_events))
+    results = []
+    for func, label in [(reduce_while, "reduced while evaluating"), (reduce_after, "all replicas, then reduced")]:
+        torch.manual_seed(0)
+        analyser = make_analyser(args.n_functions, args.n_replicas, events)
+        stack, t_eval, peak = measure(lambda: func(analyser, df))
+        results.append(stack)
+        print("{:<28s} {:8.2f} s, peak memory growth {:8.1f} MB".format(label, t_eval, peak))
+        del analyser
+
+    print("max difference {:.2e}".format(np.abs(results[0] - results[1]).max()))
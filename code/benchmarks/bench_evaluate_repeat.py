@@ -0,0 +1,78 @@
+"""
+Cost of repeated calls to ``Analyse.evaluate_models``, with and without deep-copying the loaded models
+
+Usage: python bench_evaluate_repeat.py [-n <n_events>] [-f <n_functions>] [-r <n_replicas>] [-c <n_calls>]
+
+Loads ``n_functions x n_replicas`` randomly initialised classifiers with fitted scalers into an
+:class:`ml4eft.analyse.analyse.Analyse` and evaluates them ``n_calls`` times on ``n_events`` events, as the animation
+and heatmap workflows do. ``evaluate_models`` used to start with ``copy.deepcopy(self.model_dict)``, whose cost per call
+is reported next to that of the current ``evaluate_models``, together with the memory it took.
+"""
+
+import argparse
+import copy
+import time
+import numpy as np
+import pandas as pd
+import torch
+
+from ml4eft.analyse.analyse import Analyse
+from ml4eft.core import classifier, scalers
+
+FEATURES = ['f{}'.format(i) for i in range(8)]
+ARCHITECTURE = [len(FEATURES), 100, 100, 100, 1]
+
+
+def make_analyser(n_functions, n_replicas, events):
+    analyser = Analyse({})
+    analyser.model_dict = {'lin': {}}
+    run_card = {'features': FEATURES, 'architecture': ARCHITECTURE}
+    for i in range(n_functions):
+        analyser.model_dict['lin']['c{}'.format(i)] = {
+            'models': np.array([classifier.Classifier(ARCHITECTURE, 10) for _ in range(n_replicas)]),
+            'idx': np.arange(n_replicas),
+            'scalers': np.array([scalers.make_scaler('robust').fit(events) for _ in range(n_replicas)]),
+            'run_card': run_card,
+            'rep_paths': np.array(['mc_run_{}'.format(rep) for rep in range(n_replicas)])}
+
+    analyser.model_df = pd.DataFrame.from_dict({('lin', c_name): entry for c_name, entry in
+                                                analyser.model_dict['lin'].items()}, orient='index')
+    analyser.evaluators = analyser.build_evaluators()
+    return analyser
+
+
+def model_bytes(model_dict):
+    n_bytes = 0
+    for dict_fo in model_dict.values():
+        for entry in dict_fo.values():
+            for module in list(entry['models']) + list(entry['scalers']):
+                n_bytes += sum(t.numel() * t.element_size() for t in module.state_dict().values())
+    return n_bytes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--n_events", type=int, default=10000, help="number of events")
+    parser.add_argument("-f", "--n_functions", type=int, default=44, help="number of ratio functions")
+    parser.add_argument("-r", "--n_replicas", type=int, default=25, help="number of replicas per function")
+    parser.add_argument("-c", "--n_calls", type=int, default=3, help="number of calls to average over")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    df = pd.DataFrame(np.exp(np.random.default_rng(0).normal(size=(args.n_events, len(FEATURES)))), columns=FEATURES)
+    analyser = make_analyser(args.n_functions, args.n_replicas, torch.tensor(df.values))
+
+    t_start = time.perf_counter()
+    for _ in range(args.n_calls):
+        copy.deepcopy(analyser.model_dict)
+    t_copy = (time.perf_counter() - t_start) / args.n_calls
+
+    t_start = time.perf_counter()
+    for _ in range(args.n_calls):
+        analyser.evaluate_models(df)
+    t_eval = (time.perf_counter() - t_start) / args.n_calls
+
+    print("{} networks on {} events, per call:".format(args.n_functions * args.n_replicas, args.n_events))
+    print("evaluate_models           {:8.3f} s".format(t_eval))
+    print("deep copy of model_dict   {:8.3f} s, {:.1f} MB of parameters copied (no longer done)".format(
+        t_copy, model_bytes(analyser.model_dict) / 1024 ** 2))
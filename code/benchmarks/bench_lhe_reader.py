@@ -0,0 +1,82 @@
+"""
+Benchmark of the streaming LHE reader against pylhe.read_lhe
+
+Usage: python bench_lhe_reader.py [-p <path_to_lhe>] [-n <n_events>]
+
+Without a path, a synthetic gzipped LHE file with ``n_events`` 2 -> 6 events is written to a temporary directory.
+"""
+
+import argparse
+import gzip
+import os
+import tempfile
+import time
+import numpy as np
+import pylhe
+
+from ml4eft.preproc import lhe_reader
+from ml4eft.preproc import lhe_stream
+
+
+def write_synthetic_lhe(path, n_events, seed=0):
+    rng = np.random.default_rng(seed)
+    pid = [21, 21, 11, -11, 5, -5, 12, -12]
+    status = [-1, -1, 1, 1, 1, 1, 1, 1]
+    with gzip.open(path, 'wt') as f:
+        f.write('<LesHouchesEvents version="3.0">\n<header>\n</header>\n<init>\n')
+        f.write('2212 2212 7.000000e+03 7.000000e+03 0 0 247000 247000 -4 1\n')
+        f.write('6.000000e-01 1.000000e-03 6.000000e-01 1\n</init>\n')
+        for _ in range(n_events):
+            p = rng.normal(0, 100, (len(pid), 3))
+            e = np.sqrt((p ** 2).sum(axis=1) + 1.0)
+            f.write('<event>\n {} 1 +6.0000000e-01 1.00000000e+02 7.81859000e-03 1.18000000e-01\n'.format(len(pid)))
+            for i in range(len(pid)):
+                f.write(' {:>8d} {:2d} 0 0 0 0 {:+.10e} {:+.10e} {:+.10e} {:.10e} {:.10e} 0.0000e+00 9.0000e+00\n'.format(
+                    pid[i], status[i], p[i, 0], p[i, 1], p[i, 2], e[i], 1.0))
+            f.write('</event>\n')
+        f.write('</LesHouchesEvents>\n')
+
+
+def run_pylhe(path):
+    pt = []
+    for event in pylhe.read_lhe(path):
+        for part in event.particles:
+            if part.id in [11, 13]:
+                pt.append(lhe_reader.Kinematics(part).get_pt())
+    return np.array(pt)
+
+
+def run_stream(path):
+    pt = []
+    for batch in lhe_stream.read_lhe_batches(path):
+        rows = np.arange(len(batch))
+        idx_l1 = np.argmax(np.isin(batch.pid, [11, 13]), axis=1)
+        pt.append(batch.momenta[rows, idx_l1].get_pt())
+    return np.concatenate(pt)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--path", required=False, type=str, help="path to (gzipped) LHE file")
+    parser.add_argument("-n", "--n_events", required=False, type=int, default=100000,
+                        help="number of synthetic events")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.path
+        if path is None:
+            path = os.path.join(tmp, 'events.lhe.gz')
+            write_synthetic_lhe(path, args.n_events)
+
+        t0 = time.perf_counter()
+        pt_stream = run_stream(path)
+        t1 = time.perf_counter()
+        pt_pylhe = run_pylhe(path)
+        t2 = time.perf_counter()
+
+    n = len(pt_stream)
+    print("events:             {}".format(n))
+    print("pylhe.read_lhe:     {:.2f} s ({:.0f} events/s)".format(t2 - t1, n / (t2 - t1)))
+    print("read_lhe_batches:   {:.2f} s ({:.0f} events/s)".format(t1 - t0, n / (t1 - t0)))
+    print("speed-up:           {:.1f}x".format((t2 - t1) / (t1 - t0)))
+    print("max |delta pT|:     {:.3e} GeV".format(np.max(np.abs(pt_stream - pt_pylhe))))
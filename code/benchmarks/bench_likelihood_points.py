@@ -0,0 +1,58 @@
+"""
+Throughput of the Neural Network likelihood ratio at many EFT points, one point at a time and in one batched call
+
+Usage: python bench_likelihood_points.py [-n <n_events>] [-c <n_coeffs>] [-r <n_replicas>] [-p <n_points>]
+
+Fills :class:`ml4eft.analyse.analyse.Analyse` with random outputs of the linear and quadratic ratio functions of
+``n_coeffs`` coefficients on ``n_events`` events and computes the log-likelihood ratio summed over the events at
+``n_points`` random points, with a call to ``likelihood_ratio_nn`` per point, as in a Python loop over points, and with
+one call to ``likelihood_ratio_nn_batch``. Reports the points per second and the largest difference.
+"""
+
+import argparse
+import itertools
+import time
+import numpy as np
+
+from ml4eft.analyse.analyse import Analyse
+
+
+def make_analyser(n_coeffs, n_replicas, n_events):
+    coeffs = ['c{}'.format(i) for i in range(n_coeffs)]
+    analyser = Analyse({})
+    analyser.model_dict = {'lin': {c_name: {'models': np.arange(n_replicas)} for c_name in coeffs},
+                           'quad': {'{}_{}'.format(c1, c2): {'models': np.arange(n_replicas)}
+                                    for c1, c2 in itertools.combinations_with_replacement(coeffs, 2)}}
+    functions = [(order, c_name) for order in ['lin', 'quad'] for c_name in analyser.model_dict[order]]
+
+    # ratio functions are small corrections to the SM
+    stack = 0.01 * np.random.default_rng(0).normal(size=(len(functions), n_replicas, n_events))
+    analyser.set_evaluated(stack.astype(np.float32), functions)
+    return analyser
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--n_events", type=int, default=50000, help="number of events")
+    parser.add_argument("-c", "--n_coeffs", type=int, default=8, help="number of EFT coefficients")
+    parser.add_argument("-r", "--n_replicas", type=int, default=1, help="number of replicas, 1 for the median")
+    parser.add_argument("-p", "--n_points", type=int, default=2000, help="number of EFT points")
+    args = parser.parse_args()
+
+    analyser = make_analyser(args.n_coeffs, args.n_replicas, args.n_events)
+    points = np.random.default_rng(1).uniform(-1, 1, size=(args.n_points, args.n_coeffs))
+
+    t_start = time.perf_counter()
+    log_r_loop = np.stack([np.log(analyser.likelihood_ratio_nn(dict(zip(analyser.nn_coeffs, point)))).sum(axis=-1)
+                           for point in points])
+    t_loop = time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    log_r = analyser.likelihood_ratio_nn_batch(points, log_sum=True)
+    t_batch = time.perf_counter() - t_start
+
+    print("{} points, {} ratio functions, {} replicas, {} events".format(
+        args.n_points, len(analyser.nn_functions), args.n_replicas, args.n_events))
+    print("{:<24s} {:10.0f} points/s".format("likelihood_ratio_nn", args.n_points / t_loop))
+    print("{:<24s} {:10.0f} points/s, max relative difference {:.1e}".format(
+        "likelihood_ratio_nn_batch", args.n_points / t_batch, np.abs(log_r / log_r_loop - 1).max()))
@@ -0,0 +1,84 @@
+"""
+Peak memory of loading a training sample, before and after column projection and sampling pushdown
+
+Usage: python bench_load_data.py [-n <n_events>] [-c <n_columns>] [-d <n_dat>]
+
+Writes a synthetic replica both as a pickled DataFrame and as an event store, and loads ``n_dat`` events of two
+features from it in a fresh process per method, reporting the peak resident memory of each.
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from ml4eft.preproc import event_store, ingest
+
+FEATURES = ['f0', 'f1']
+
+
+def load_baseline(path, n_dat):
+    # previous PreProcessing.load_data: unpickle everything, drop the xsec row, sample, keep the features later
+    df_full = pd.read_pickle(path, compression="infer")
+    df = df_full.iloc[1:, :]
+    xsec = df_full.iloc[0, 0]
+    return df.sample(n_dat)[FEATURES], xsec
+
+
+def load_pushdown(path, n_dat, dtype=None):
+    return event_store.sample_events(path, n_dat, FEATURES, dtype)
+
+
+def write(path, n_events, n_columns):
+    rng = np.random.default_rng(0)
+    events = pd.DataFrame(rng.normal(size=(n_events, n_columns)), columns=['f{}'.format(i) for i in range(n_columns)])
+    os.makedirs(os.path.join(path, 'pickled'))
+    ingest.save_events(events, 1.0, os.path.join(path, 'pickled', 'events_0.pkl.gz'))
+    event_store.write_event_store(os.path.join(path, 'store', 'events_0'), events, 1.0)
+
+
+def run(mode, path, n_dat):
+    t0 = time.perf_counter()
+    if mode == 'baseline':
+        df, _ = load_baseline(os.path.join(path, 'pickled', 'events_0.pkl.gz'), n_dat)
+    elif mode == 'pushdown_pkl':
+        df, _ = load_pushdown(os.path.join(path, 'pickled', 'events_0.pkl.gz'), n_dat)
+    elif mode == 'pushdown_store':
+        df, _ = load_pushdown(os.path.join(path, 'store', 'events_0'), n_dat)
+    elif mode == 'pushdown_store_f32':
+        df, _ = load_pushdown(os.path.join(path, 'store', 'events_0'), n_dat, 'float32')
+    t1 = time.perf_counter()
+    print("{:<20s} peak RSS {:8.1f} MB   time {:6.2f} s   sample {}".format(
+        mode, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, t1 - t0, df.shape))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--n_events", type=int, default=2000000, help="number of events in the replica")
+    parser.add_argument("-c", "--n_columns", type=int, default=40, help="number of kinematic columns")
+    parser.add_argument("-d", "--n_dat", type=int, default=200000, help="number of events to sample")
+    parser.add_argument("--mode", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--path", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == 'write':
+        write(args.path, args.n_events, args.n_columns)
+        sys.exit()
+    elif args.mode is not None:
+        run(args.mode, args.path, args.n_dat)
+        sys.exit()
+
+    # every step runs in its own process, the peak RSS of a parent is inherited by its children on Linux
+    with tempfile.TemporaryDirectory() as tmp:
+        path = tmp
+        subprocess.run([sys.executable, __file__, '--mode', 'write', '--path', path, '-n', str(args.n_events),
+                        '-c', str(args.n_columns)], check=True)
+
+        for mode in ['baseline', 'pushdown_pkl', 'pushdown_store', 'pushdown_store_f32']:
+            subprocess.run([sys.executable, __file__, '--mode', mode, '--path', path, '-d', str(args.n_dat)],
+                           check=True)
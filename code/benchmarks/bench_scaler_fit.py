@@ -0,0 +1,102 @@
+"""
+Time, memory and accuracy of fitting the feature scalers in one pass over chunks, compared to the exact fit
+
+Usage: python bench_scaler_fit.py [-n <n_events>] [-f <n_features>] [-c <chunk_size>]
+
+Fits each scaler of :mod:`ml4eft.core.scalers` on skewed synthetic features, once exactly on all events at once and
+once with ``partial_fit`` over chunks, and reports the wall time and the peak growth of the resident memory during
+the fit. The accuracy of the streaming fit is reported as the largest difference in the fitted parameters and,
+for the quantiles, as the largest error in rank (the fraction of events below the estimated quantile minus the
+target fraction).
+"""
+
+import argparse
+import os
+import threading
+import time
+import numpy as np
+import torch
+
+from ml4eft.core import scalers
+
+
+def make_events(n_events, n_features, seed=0):
+    rng = np.random.default_rng(seed)
+    columns = [rng.exponential(100, n_events), rng.normal(size=n_events), rng.lognormal(5, 1, n_events)]
+    return np.column_stack([columns[i % len(columns)] for i in range(n_features)])
+
+
+def rank_error(events, q, estimate):
+    events_sorted = np.sort(events, axis=0)
+    errors = []
+    for i in range(events.shape[1]):
+        ranks = np.searchsorted(events_sorted[:, i], estimate[:, i]) / len(events)
+        errors.append(np.abs(ranks - q).max())
+    return max(errors)
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(func):
+    # sample the resident memory on a thread, tracemalloc does not see the allocations made by torch
+    baseline = rss()
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.005):
+            peak[0] = max(peak[0], rss())
+
+    thread = threading.Thread(target=sample)
+    thread.start()
+    t_start = time.perf_counter()
+    result = func()
+    t_fit = time.perf_counter() - t_start
+    done.set()
+    thread.join()
+    return result, t_fit, (max(peak[0], rss()) - baseline) / 1024 ** 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--n_events", type=int, default=10000000, help="number of events")
+    parser.add_argument("-f", "--n_features", type=int, default=3, help="number of features")
+    parser.add_argument("-c", "--chunk_size", type=int, default=1000000, help="number of events per chunk")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    events = make_events(args.n_events, args.n_features)
+
+    def streaming(scaler):
+        for start in range(0, len(events), args.chunk_size):
+            scaler.partial_fit(events[start:start + args.chunk_size])
+        # the fitted parameters are computed from the sketch when they are first used
+        scaler.state_dict()
+        return scaler
+
+    for name, make in [('robust', lambda: scalers.RobustScaler((5, 95))),
+                       ('standardise', scalers.StandardScaler),
+                       ('quantile', lambda: scalers.QuantileTransformer(subsample=None))]:
+        exact, t_exact, mem_exact = measure(lambda: make().fit(torch.from_numpy(events)))
+        stream, t_stream, mem_stream = measure(lambda: streaming(make()))
+
+        print("{:<12s} exact {:6.2f} s {:8.1f} MB, streaming {:6.2f} s {:8.1f} MB".format(
+            name, t_exact, mem_exact, t_stream, mem_stream))
+
+        # differences in units of the standard deviation of each feature, as the medians can be close to zero
+        std = events.std(axis=0)
+        for (key, value), (_, value_stream) in zip(exact.state_dict().items(), stream.state_dict().items()):
+            diff = (np.abs(value.numpy() - value_stream.numpy()) / std).max()
+            print("    {:<10s} max difference {:.2e} std".format(key, diff))
+
+        if name == 'quantile':
+            q = exact.references.numpy()[1:-1]
+            print("    rank error exact {:.2e}, streaming {:.2e}".format(
+                rank_error(events, q, exact.quantiles.numpy()[1:-1]),
+                rank_error(events, q, stream.quantiles.numpy()[1:-1])))
+            sub = scalers.QuantileTransformer().fit(torch.from_numpy(events))
+            print("    rank error with the default 10k subsample {:.2e}".format(
+                rank_error(events, q, sub.quantiles.numpy()[1:-1])))
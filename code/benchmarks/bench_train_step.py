@@ -0,0 +1,67 @@
+"""
+Throughput of the classifier training step in eager mode and with the accelerated training step
+
+Usage: python bench_train_step.py [-n <batch_size>] [-s <n_steps>] [-c <c_train>]
+
+Times forward, loss, backward and optimizer step on one mini-batch of synthetic events, once as in
+:meth:`ml4eft.core.classifier.Fitter.training_loop` by default (float64 events converted every step, eager
+:meth:`ml4eft.core.classifier.Fitter.loss_fn`) and once per option of :class:`ml4eft.core.classifier.ClassifierLoss`,
+and reports the number of events per second.
+"""
+
+import argparse
+import time
+import torch
+
+from ml4eft.core import classifier
+
+N_FEATURES = 8
+ARCHITECTURE = [N_FEATURES, 100, 100, 100, 1]
+
+
+def eager_step(model):
+    def step(event, weight, label):
+        output = model(event.float())
+        loss = - (1 - label) * weight * torch.log(1 - output) - label * weight * torch.log(output)
+        return torch.mean(loss, dim=0)
+    return step
+
+
+def run(step, optimizer, batch, n_steps, autocast=False):
+    for i in range(n_steps + 5):  # the first steps are warm-up, e.g. compilation
+        if i == 5:
+            t_start = time.perf_counter()
+        with torch.autocast('cpu', dtype=torch.bfloat16, enabled=autocast):
+            loss = step(*batch)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    return n_steps * len(batch[0]) / (time.perf_counter() - t_start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--batch_size", type=int, default=20000, help="number of events per mini-batch")
+    parser.add_argument("-s", "--n_steps", type=int, default=50, help="number of steps to average over")
+    parser.add_argument("-c", "--c_train", type=float, default=10, help="value of the coefficient in the training")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    events = torch.randn(args.batch_size, N_FEATURES, dtype=torch.float64)
+    weights = torch.ones(args.batch_size, 1)
+    labels = (torch.rand(args.batch_size, 1) > 0.5).float()
+
+    model = classifier.Classifier(ARCHITECTURE, args.c_train)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    loss = classifier.ClassifierLoss(model, 'CE')
+    compiled = torch.compile(loss)
+
+    cases = [('eager, float64 events', eager_step(model), events, False),
+             ('eager, float32 events', eager_step(model), events.float(), False),
+             ('ClassifierLoss', loss, events.float(), False),
+             ('compiled', compiled, events.float(), False),
+             ('compiled, bfloat16', compiled, events.float(), True)]
+
+    for name, step, x, autocast in cases:
+        rate = run(step, optimizer, (x, weights, labels), args.n_steps, autocast)
+        print("{:<24s} {:12.0f} events / s".format(name, rate))
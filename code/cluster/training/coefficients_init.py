@@ -0,0 +1,12 @@
+import sys
+import ml4eft.core.classifier as classifier
+
+path_to_json = sys.argv[1]
+nn_rep = sys.argv[2]
+coeffs = sys.argv[3].split(',') if len(sys.argv) > 3 else None
+
+# model directory
+output_path = '../models/example_models'
+
+# launch the fits of all coefficients, sharing the sm data
+fitter = classifier.MultiFitter(path_to_json, [int(nn_rep)], output_path, c_names=coeffs)
@@ -0,0 +1,13 @@
+import sys
+import ml4eft.core.ensemble as ensemble
+
+path_to_json = sys.argv[1]
+coeff = sys.argv[2]
+n_reps = int(sys.argv[3])
+first_rep = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+
+# model directory
+output_path = '../models/example_models'
+
+# launch the fits of all replicas at once
+fitter = ensemble.EnsembleFitter(path_to_json, range(first_rep, first_rep + n_reps), coeff, output_path)
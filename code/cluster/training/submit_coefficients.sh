@@ -0,0 +1,39 @@
+#!/bin/bash
+
+PY='/data/theorie/jthoeve/miniconda3/envs/ml4eft/bin/python'
+
+function submit_job () {
+
+  RUN_CARD=$1
+  REP=$2
+  COEFFS=$3
+
+  # create bash file to submit
+  COMMAND=$PWD'/launch_rep_'$REP'.sh'
+
+  # write launch command
+  LAUNCH='export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/data/theorie/jthoeve/miniconda3/lib;'$PY' '$PWD'/coefficients_init.py '$RUN_CARD' '$REP' '$COEFFS
+
+  echo $LAUNCH >> $COMMAND
+  chmod +x $COMMAND
+  chmod +x $PWD'/coefficients_init.py'
+
+  # submission, one job trains all coefficients of a replica
+  qsub -q smefit -W group_list=smefit -l nodes=1:ppn=1 -l pvmem=4000mb $COMMAND
+  rm $COMMAND
+
+}
+
+# SETUP
+
+MCREPS=25
+
+# tt -> llvlvlbb
+
+RUN_CARD="example_train_run_card.json"
+
+COEFFS="ctGRe,ctj8,ctGRe_ctGRe,ctGRe_ctj8,ctj8_ctj8"
+
+for ((rep=0; rep < $MCREPS; rep++)); do
+  submit_job $RUN_CARD $rep $COEFFS
+done
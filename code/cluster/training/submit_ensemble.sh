@@ -0,0 +1,41 @@
+#!/bin/bash
+
+PY='/data/theorie/jthoeve/miniconda3/envs/ml4eft/bin/python'
+
+function submit_job () {
+
+  RUN_CARD=$1
+  COEFF=$2
+  NREPS=$3
+
+  # create bash file to submit
+  COMMAND=$PWD'/launch_ensemble_'$COEFF'.sh'
+
+  # write launch command
+  LAUNCH='export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/data/theorie/jthoeve/miniconda3/lib;'$PY' '$PWD'/ensemble_init.py '$RUN_CARD' '$COEFF' '$NREPS
+
+  echo $LAUNCH >> $COMMAND
+  chmod +x $COMMAND
+  chmod +x $PWD'/ensemble_init.py'
+
+  # submission, one job trains all replicas of a coefficient
+  qsub -q smefit -W group_list=smefit -l nodes=1:ppn=$NCORES -l pvmem=4000mb $COMMAND
+  rm $COMMAND
+
+}
+
+# SETUP
+
+MCREPS=25
+NCORES=8
+
+# tt -> llvlvlbb
+
+RUN_CARD="example_train_run_card.json"
+
+coeff=( "ctGRe" "ctj8" "ctGRe_ctGRe" "ctGRe_ctj8" "ctj8_ctj8")
+
+for c in "${coeff[@]}"
+do
+  submit_job $RUN_CARD $c $MCREPS
+done
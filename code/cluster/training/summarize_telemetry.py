@@ -0,0 +1,13 @@
+import sys
+import pandas as pd
+import ml4eft.core.telemetry as telemetry
+
+# directory with the model_* directories, e.g. ../models/example_models/2022/12/15
+model_path = sys.argv[1]
+
+summary = telemetry.summarize(model_path)
+
+with pd.option_context('display.max_columns', None, 'display.width', None):
+    print(summary.to_string(index=False))
+
+print("Total core-hours: {:.2f}".format(summary['core_hours'].sum()))
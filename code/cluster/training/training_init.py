@@ -4,9 +4,10 @@ import ml4eft.core.classifier as classifier
 path_to_json = sys.argv[1]
 nn_rep = sys.argv[2]
 coeff = sys.argv[3]
+resume = len(sys.argv) > 4 and sys.argv[4] == 'resume'
 
 # model directory
 output_path = '../models/example_models'
 
-# launch fit
-fitter = classifier.Fitter(path_to_json, int(nn_rep), coeff, output_path)
\ No newline at end of file
+# launch fit, continue from the latest checkpoint when resuming
+fitter = classifier.Fitter(path_to_json, int(nn_rep), coeff, output_path, resume=resume)
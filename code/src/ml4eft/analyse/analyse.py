@@ -14,18 +14,19 @@ from matplotlib import animation
 from matplotlib.ticker import NullFormatter
 import os, sys
 import pickle
-import joblib
 import json
 import pandas as pd
 from sklearn.cluster import KMeans
 from scipy import integrate
 import logging
-import itertools
 
 # import own pacakges
 from ml4eft.core import classifier as classifier
+from ml4eft.core.scalers import load_scaler
 from ml4eft.core.truth import tt_prod
 from ..preproc import constants
+from ..preproc import event_store
+from ..preproc.event_cache import event_cache
 
 mz = constants.mz  # z boson mass [TeV]
 mh = constants.mh
@@ -98,7 +99,16 @@ class Analyse:
         self.path_to_models = path_to_models
         self.order = order
         self.model_df = None
+        self.models_evaluated = None
         self.models_evaluated_df = None
+        # dense outputs of the evaluated models, see evaluate_models
+        self.nn_stack = None
+        self.nn_functions = None
+        self.nn_coeffs = None
+        self.nn_index = None
+        self.nn_pairs = None
+        self.nn_replicas = None
+        self.evaluators = None
         self.coeff_truth = None
         self.all = True
 
@@ -126,6 +136,10 @@ class Analyse:
         """
         event_paths = [os.path.join(root_path, mc_run) for mc_run in
                        os.listdir(root_path) if mc_run.startswith('events_')]
+
+        # list each replica once when it is stored both as a pickled DataFrame and as an event store
+        event_paths = [path for path in event_paths
+                       if event_store.resolve_event_path(path) == path]
         return event_paths
 
     @staticmethod
@@ -194,14 +208,22 @@ class Analyse:
         return df
 
     @staticmethod
-    def load_events(event_path):
+    def load_events(event_path, columns=None, cache=True):
         """
         Loads a event DataFrame and splits it into the events and the inclusive cross section
 
+        Loads go through the process-wide :data:`ml4eft.preproc.event_cache.event_cache` by default, so repeated
+        loads of an unchanged file are served from memory.
+
         Parameters
         ----------
         event_path: str
-            Path to the DataFrame (including the xsec as first row)
+            Path to the DataFrame (including the xsec as first row) or to an
+            :class:`ml4eft.preproc.event_store.EventStore`, which is detected automatically
+        columns: array_like, optional
+            Features to load, all features by default
+        cache: bool, optional
+            Set to ``False`` to bypass the event cache
 
         Returns
         -------
@@ -210,11 +232,9 @@ class Analyse:
         xsec: float
             Inclusive cross-section of the events
         """
-        event_df = pd.read_pickle(event_path)
-        events = event_df.iloc[1:, :]
-        xsec = event_df.iloc[0, 0]
-
-        return events, xsec
+        if cache:
+            return event_cache.load(event_path, columns)
+        return event_store.load_events(event_path, columns)
 
     @staticmethod
     def load_loss(path_to_loss):
@@ -348,7 +368,7 @@ class Analyse:
                 continue
 
             run_card = self.load_run_card(path_to_run_card)
-            scaler = joblib.load(path_to_scaler)
+            scaler = load_scaler(path_to_scaler)
 
             model_name = os.path.basename(model_path)
             c_name = model_name.split('model_')[1]
@@ -442,10 +462,52 @@ class Analyse:
                                                 for j in self.model_dict[i].keys()},
                                                orient='index')
 
-    def evaluate_models(self, df, rep=None, epoch=-1):
+        self.evaluators = self.build_evaluators()
+
+    def build_evaluators(self):
+        """
+        Stacks the loaded models of all ratio functions that take the same features into batched networks
+
+        Returns
+        -------
+        dict
+            Maps the features to the list of ``(order, c_name)`` of the ratio functions and their
+            :class:`ml4eft.core.ensemble.EnsembleEvaluator`
+        """
+        # imported here, as ml4eft.core.ensemble imports the classifier module, which imports this module
+        from ml4eft.core.ensemble import EnsembleEvaluator
+
+        functions = {}
+        for order, dict_fo in self.model_dict.items():
+            for c_name, dict_c in dict_fo.items():
+                functions.setdefault(tuple(dict_c['run_card']['features']), []).append((order, c_name))
+
+        evaluators = {}
+        for features, keys in functions.items():
+            models = [self.model_dict[order][c_name]['models'] for order, c_name in keys]
+            scalers = [self.model_dict[order][c_name]['scalers'] for order, c_name in keys]
+            evaluators[features] = (keys, EnsembleEvaluator(models, scalers))
+        return evaluators
+
+    def evaluate_models(self, df, rep=None, epoch=-1, reduction=None, max_elements=2 ** 24):
         """
         Evaluates the loaded models on a Pandas DataFrame ``df``
 
+        The outputs of all ratio functions are stored in one dense float32 array ``nn_stack`` of shape
+        ``(n_functions, n_replicas, n_events)``, with the linear functions first, followed by the quadratic ones, in the
+        order of ``nn_functions``. Replicas beyond the number of loaded replicas of a function are NaN. The coefficients
+        are indexed by ``nn_index``, and ``nn_pairs`` holds the indices of the two coefficients that multiply each
+        function in the EFT expansion, where index ``len(nn_coeffs)`` stands for the constant 1 of the linear terms.
+        The likelihood ratio combines the first ``nn_replicas`` replicas, which all ratio functions have.
+
+        ``models_evaluated``, as ``{order: {c_name: (n_replicas, n_events) ndarray}}``, and ``models_evaluated_df``,
+        which has the layout of ``model_df`` with the outputs in place of the models, are views of ``nn_stack``. The
+        loaded models themselves are not copied or modified.
+
+        With ``reduction``, the events are evaluated in chunks and the outputs of every chunk are reduced over the
+        replicas right away, such that only the reduced outputs are kept, in place of the replicas along the second
+        axis of ``nn_stack``. The memory needed is then set by ``max_elements`` rather than by the number of replicas.
+
         Parameters
         ----------
         df: pd.DataFrame
@@ -455,7 +517,19 @@ class Analyse:
             Set to ``None`` by default in which case all available replicas are included.
         epoch: int, optional
             Epoch number to load. Set to the best model by default.
+        reduction: str, callable or array_like, optional
+            Reduction over the replicas, see :meth:`reduce_replicas`. All replicas are kept by default
+        max_elements: int, optional
+            Number of outputs evaluated per chunk of events when ``reduction`` is set
 
+        Examples
+        --------
+        Keep the median and the 68% interval over the replicas only
+
+        >>> analyser.evaluate_models(df, reduction=[16, 50, 84])
+        >>> analyser.models_evaluated_df['models']
+        lin   c1            [[0.04865187, 0.05306722, 0.05491338, 0.03827...
+        ...
         """
 
         # load models if not done already
@@ -464,26 +538,144 @@ class Analyse:
         if self.model_df is None:
             self.build_model_dict(rep, epoch)
 
-        models_evaluated = copy.deepcopy(self.model_dict)
+        functions = [(order, c_name) for order in ['lin', 'quad'] for c_name in self.model_dict.get(order, {})]
+        n_replicas = max(len(self.model_dict[order][c_name]['models']) for order, c_name in functions)
+        n_rows = n_replicas if reduction is None else len(np.atleast_1d(self.reduce(np.zeros((1, 1)), reduction)))
+        stack = np.full((len(functions), n_rows, len(df)), np.nan, dtype=np.float32)
+        row = {key: k for k, key in enumerate(functions)}
 
-        for order, dict_fo in self.model_dict.items():
-            for c_name, dict_c in dict_fo.items():
-                models = dict_c['models']
+        # all replicas of all ratio functions with the same features are evaluated at once
+        for features, (keys, evaluator) in self.evaluators.items():
+            events = torch.tensor(df[list(features)].values, dtype=torch.float64)
+
+            if reduction is None:
+                chunk_size = max(len(events), 1)
+            else:
+                chunk_size = max(1, max_elements // max(evaluator.n_functions * evaluator.n_replicas, 1))
 
-                for i, model in enumerate(models):
-                    features = dict_c['run_card']['features']
-                    features_scaled = dict_c['scalers'][i].transform(df[features])
-                    with torch.no_grad():
-                        model_ev = model.n_alpha(torch.tensor(features_scaled).float()).numpy().flatten()
-                    models_evaluated[order][c_name]['models'][i] = model_ev
+            for start in range(0, len(events), chunk_size):
+                stop = min(start + chunk_size, len(events))
+                nn_out = evaluator.evaluate(events[start:stop])
 
-                models_evaluated[order][c_name]['models'] = np.vstack(models_evaluated[order][c_name]['models'])
+                for i, (order, c_name) in enumerate(keys):
+                    n_models = len(self.model_dict[order][c_name]['models'])
+                    if reduction is None:
+                        stack[row[order, c_name], :n_models, start:stop] = nn_out[i, :n_models]
+                    else:
+                        stack[row[order, c_name], :, start:stop] = self.reduce(nn_out[i, :n_models], reduction)
+
+        self.set_evaluated(stack, functions, reduced=reduction is not None)
+
+    def set_evaluated(self, stack, functions, reduced=False):
+        """
+        Stores the outputs of the ratio functions and builds the coefficient indices and the views on them
 
-        self.models_evaluated_df = pd.DataFrame.from_dict({(i, j): models_evaluated[i][j]
-                                                           for i in models_evaluated.keys()
-                                                           for j in models_evaluated[i].keys()},
+        Parameters
+        ----------
+        stack: numpy.ndarray
+            ``(n_functions, n_replicas, n_events)`` outputs, see :meth:`evaluate_models`
+        functions: array_like
+            ``(order, c_name)`` of the ratio functions along the first axis of ``stack``
+        reduced: bool, optional
+            Whether ``stack`` holds reductions over the replicas, see :meth:`reduce_replicas`
+        """
+        self.nn_stack = stack
+        self.nn_functions = list(functions)
+
+        # replicas are combined by position, so only those that every ratio function has enter the likelihood ratio
+        n_models = [len(self.model_dict[order][c_name]['models']) for order, c_name in self.nn_functions]
+        self.nn_replicas = stack.shape[1] if reduced else min(n_models, default=0)
+        if not reduced and self.nn_replicas < stack.shape[1]:
+            logging.warning("The ratio functions have between {} and {} replicas, only the first {} enter the "
+                            "likelihood ratio".format(self.nn_replicas, stack.shape[1], self.nn_replicas))
+
+        self.nn_coeffs = []
+        for order, c_name in self.nn_functions:
+            for c in c_name.split('_'):
+                if c not in self.nn_coeffs:
+                    self.nn_coeffs.append(c)
+        self.nn_index = {c: i for i, c in enumerate(self.nn_coeffs)}
+
+        n_coeffs = len(self.nn_coeffs)
+        self.nn_pairs = np.array([[self.nn_index[c] for c in c_name.split('_')] + [n_coeffs] * (order == 'lin')
+                                  for order, c_name in self.nn_functions], dtype=np.int64).reshape(-1, 2)
+
+        views = {}
+        for k, (order, c_name) in enumerate(self.nn_functions):
+            if reduced:
+                views.setdefault(order, {})[c_name] = stack[k, 0] if stack.shape[1] == 1 else stack[k]
+            else:
+                views.setdefault(order, {})[c_name] = stack[k, :len(self.model_dict[order][c_name]['models'])]
+        self.models_evaluated = views
+
+        # shallow copies of the model entries, sharing everything but the models with model_dict
+        self.models_evaluated_df = pd.DataFrame.from_dict({(i, j): dict(self.model_dict[i][j],
+                                                                        models=self.models_evaluated[i][j])
+                                                           for i in self.models_evaluated.keys()
+                                                           for j in self.models_evaluated[i].keys()},
                                                           orient='index')
 
+    @staticmethod
+    def reduce(outputs, reduction):
+        """
+        Reduces the outputs of the replicas of a ratio function
+
+        Parameters
+        ----------
+        outputs: numpy.ndarray
+            ``(n_replicas, n_events)`` outputs
+        reduction: str, callable or array_like
+            ``median``, ``mean``, a reduction with an ``axis`` argument such as ``numpy.median``, or the percentiles
+            to compute
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(n_events, )`` reduced outputs, or ``(n_percentiles, n_events)`` when ``reduction`` is array_like
+        """
+        if isinstance(reduction, str):
+            reduction = {'median': np.median, 'mean': np.mean}[reduction]
+        if callable(reduction):
+            return reduction(outputs, axis=0)
+        return np.percentile(outputs, reduction, axis=0)
+
+    def reduce_replicas(self, reduction=np.median):
+        """
+        Replaces the evaluated outputs of every ratio function by a reduction over its replicas
+
+        Afterwards, ``models_evaluated`` and ``models_evaluated_df`` hold ``(n_events, )`` arrays, or
+        ``(n_percentiles, n_events)`` arrays for percentiles, and :meth:`likelihood_ratio_nn` returns a row per
+        reduction. :meth:`evaluate_models` can reduce while evaluating instead, without keeping all replicas in memory.
+
+        Parameters
+        ----------
+        reduction: str, callable or array_like, optional
+            Reduction over the replicas, see :meth:`reduce`. The median by default
+        """
+        n_rows = len(np.atleast_1d(self.reduce(np.zeros((1, 1)), reduction)))
+        stack = np.empty((len(self.nn_functions), n_rows, self.nn_stack.shape[-1]), dtype=np.float32)
+        for k, (order, c_name) in enumerate(self.nn_functions):
+            stack[k] = self.reduce(self.models_evaluated[order][c_name], reduction)
+        self.set_evaluated(stack, self.nn_functions, reduced=True)
+
+    def coefficient_vector(self, c):
+        """
+        Converts an EFT point to the products of coefficients that multiply the ratio functions in ``nn_stack``
+
+        Parameters
+        ----------
+        c: dict
+            Of the form {'c1': value, 'c2': value, ...}, coefficients that are not given are set to zero
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(n_functions, )`` float32 weights, ``c1`` for a linear function ``c1`` and ``c1 * c2`` for a quadratic
+            function ``c1_c2``
+        """
+        c_vec = np.array([c.get(c_name, 0.0) for c_name in self.nn_coeffs] + [1.0])
+        return (c_vec[self.nn_pairs[:, 0]] * c_vec[self.nn_pairs[:, 1]]).astype(np.float32)
+
     def coeff_function_truth(self, df, c_name, features, process, order):
         """
         Evaluates the analytic EFT ratio functions :math:`r_{\sigma}^{(i)}` and :math:`r_{\sigma}^{(i,j)}`
@@ -760,31 +952,100 @@ class Analyse:
         Returns
         -------
         ratio: array_like
-            likelihood ratio as ``(N,M) ndarray`` with ``N`` and ``M`` the number of replicas and events respectively
+            likelihood ratio as ``(N,M) ndarray`` with ``N`` and ``M`` the number of replicas and events respectively,
+            where ``N`` is ``nn_replicas``
         """
         # update evaluated models for a new df
         if df is not None:
             self.evaluate_models(df, epoch=epoch)
 
-        ratio = 1
+        ratio = 1 + np.einsum('f,frn->rn', self.coefficient_vector(c), self.nn_stack[:, :self.nn_replicas])
+
+        return ratio
+
+    def likelihood_ratio_nn_batch(self, points, coeffs=None, log_sum=False, df=None, epoch=-1, max_elements=2 ** 24):
+        """
+        Computes the Neural Network parameterised likelihood ratio at many EFT points at once
+
+        The products of coefficients of all points are multiplied with the outputs in ``nn_stack`` in blocks of points
+        and events, such that no intermediate array has more than ``max_elements`` elements.
 
-        if 'lin' in self.models_evaluated_df.index:
-            lin_models = self.models_evaluated_df['models'].loc["lin"]
-            for c_name, c_val in c.items():
-                if c_name in lin_models:
-                    ratio += c_val * lin_models[c_name]
+        Parameters
+        ----------
+        points: array_like
+            ``(n_points, n_coeffs)`` EFT points
+        coeffs: array_like, optional
+            Names of the coefficients along the columns of ``points``, ``nn_coeffs`` by default. Coefficients that are
+            not given are set to zero, and those without ratio functions are ignored
+        log_sum: bool, optional
+            Return the log-likelihood ratio summed over the events instead of the likelihood ratio per event
+        df: pandas.DataFrame, optional
+            In case the loaded models have not been evaluated yet, one can pass ``df`` to evaluate the neural networks
+        epoch: int, optional
+            Specify an epoch if necessary, takes the best model by default
+        max_elements: int, optional
+            Number of elements of the largest intermediate array
 
-        if 'quad' in self.models_evaluated_df.index:
-            quad_models = self.models_evaluated_df['models'].loc["quad"]
+        Returns
+        -------
+        numpy.ndarray
+            ``(n_points, n_replicas, n_events)`` float32 likelihood ratios, or ``(n_points, n_replicas)`` float64 sums
+            of the log-likelihood ratios over the events when ``log_sum`` is set, with ``n_replicas`` the
+            ``nn_replicas`` that all ratio functions have
 
-            for (c1, c2) in itertools.product(c.keys(), repeat=2):
-                c_name = '{}_{}'.format(c1, c2)
-                if c_name in quad_models:
-                    ratio += c[c1] * c[c2] * quad_models['{}_{}'.format(c1, c2)]
+        Examples
+        --------
+        Scan the summed log-likelihood ratio of the median replica on a grid in ``(c1, c2)``
 
-        ratio = np.vstack(ratio)
+        >>> analyser.evaluate_models(df)
+        >>> analyser.reduce_replicas(np.median)
+        >>> c1, c2 = np.meshgrid(np.linspace(-1, 1, 100), np.linspace(-1, 1, 100))
+        >>> log_r = analyser.likelihood_ratio_nn_batch(np.column_stack([c1.ravel(), c2.ravel()]), ['c1', 'c2'],
+        ...                                            log_sum=True)
+        """
+        # update evaluated models for a new df
+        if df is not None:
+            self.evaluate_models(df, epoch=epoch)
 
-        return ratio
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        coeffs = self.nn_coeffs if coeffs is None else list(coeffs)
+
+        # points in the coefficients of nn_stack, followed by the constant 1 of the linear terms
+        c_points = np.zeros((len(points), len(self.nn_coeffs) + 1))
+        c_points[:, -1] = 1.0
+        for j, c_name in enumerate(coeffs):
+            if c_name in self.nn_index:
+                c_points[:, self.nn_index[c_name]] = points[:, j]
+        weights = (c_points[:, self.nn_pairs[:, 0]] * c_points[:, self.nn_pairs[:, 1]]).astype(np.float32)
+
+        n_functions, _, n_events = self.nn_stack.shape
+        n_replicas = self.nn_replicas
+        n_points = len(points)
+        block_size = max(1, min(n_points, max_elements // max(n_replicas * n_events, 1)))
+        # both the copied chunk of outputs and the block of ratios have at most max_elements elements
+        chunk_size = max(1, min(n_events, max_elements // max(max(block_size, n_functions) * n_replicas, 1)))
+
+        if log_sum:
+            out = np.zeros((n_points, n_replicas))
+        else:
+            out = np.empty((n_points, n_replicas, n_events), dtype=np.float32)
+
+        for start in range(0, n_events, chunk_size):
+            stop = min(start + chunk_size, n_events)
+            outputs = self.nn_stack[:, :n_replicas, start:stop].reshape(n_functions, -1)
+
+            for first in range(0, n_points, block_size):
+                last = min(first + block_size, n_points)
+                ratio = weights[first:last] @ outputs
+                ratio += 1
+                ratio = ratio.reshape(last - first, n_replicas, stop - start)
+
+                if log_sum:
+                    out[first:last] += np.log(ratio, out=ratio).sum(axis=-1, dtype=np.float64)
+                else:
+                    out[first:last, :, start:stop] = ratio
+
+        return out
 
     def decision_function_nn(self, c, df=None, epoch=-1):
         """
@@ -22,6 +22,8 @@ mt = constants.mt
 class Animate:
     """
     Post-training animator that animates the evolution of models during training
+
+    Needs the per-epoch models, so the models should be trained with ``"checkpoint_stride": 1`` in the run card.
     """
 
     def __init__(self, c, frames):
@@ -0,0 +1,528 @@
+"""
+Module with a persistent sorted-column index to histogram events for arbitrary bin edges without reloading them
+"""
+
+import logging
+import os
+import numpy as np
+
+from ml4eft.preproc import event_store
+
+
+def index_path(event_path):
+    """
+    Returns the path of the bin index that belongs to a replica event file
+
+    Parameters
+    ----------
+    event_path: str
+        Path to an event file, e.g. ``tt_sm/events_0.pkl.gz`` or the event store ``tt_sm/events_0``
+
+    Returns
+    -------
+    str
+        Path to the bin index, e.g. ``tt_sm/bin_index_0.npz``
+    """
+    event_dir, name = os.path.split(event_store.store_path(event_path))
+    return os.path.join(event_dir, 'bin_index_{}.npz'.format(name[len('events_'):]))
+
+
+def _mtime(event_path):
+    path = event_store.resolve_event_path(event_path)
+    if event_store.is_event_store(path):
+        path = os.path.join(path, event_store.HEADER)
+    return os.path.getmtime(path)
+
+
+class SparseHistogram:
+    """
+    N-dimensional histogram that only stores its occupied bins, in coordinate (COO) format
+
+    The occupied bins are identified by their flat (C-order) bin number ``keys`` in a grid of shape ``shape``, with
+    ``values`` the content of those bins. Histograms on the same grid can be added, subtracted and scaled; the result
+    lives on the union of the occupied bins.
+    """
+
+    # make numpy scalars defer to the operators below instead of building object arrays
+    __array_ufunc__ = None
+
+    def __init__(self, keys, values, shape):
+        """
+        SparseHistogram constructor
+
+        Parameters
+        ----------
+        keys: numpy.ndarray
+            ``(n_occupied,)`` sorted, unique flat bin numbers
+        values: numpy.ndarray
+            ``(n_occupied,)`` bin contents
+        shape: tuple
+            Number of bins along every kinematic
+        """
+        self.keys = keys
+        self.values = values
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_flat(cls, flat, shape, weights=None):
+        """
+        Counts events per bin from their flat bin numbers
+
+        Parameters
+        ----------
+        flat: numpy.ndarray
+            ``(n_events,)`` flat bin number of every event inside the grid
+        shape: tuple
+            Number of bins along every kinematic
+        weights: numpy.ndarray, optional
+            ``(n_events,)`` event weights, unit weights by default
+
+        Returns
+        -------
+        :class:`ml4eft.core.binning.SparseHistogram`
+            Histogram of the events
+        """
+        if weights is None:
+            keys, values = np.unique(flat, return_counts=True)
+        else:
+            keys, inverse = np.unique(flat, return_inverse=True)
+            values = np.bincount(inverse, weights=weights, minlength=len(keys))
+        return cls(keys, values, shape)
+
+    @classmethod
+    def from_dense(cls, n_i):
+        """
+        Converts a dense histogram into a sparse one
+        """
+        keys = np.flatnonzero(n_i)
+        return cls(keys, n_i.ravel()[keys], n_i.shape)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def coords(self):
+        """
+        Bin indices of the occupied bins along every kinematic, a tuple of ``(n_occupied,)`` arrays
+        """
+        return np.unravel_index(self.keys, self.shape)
+
+    def todense(self):
+        """
+        Returns the histogram as a dense array of shape ``shape``
+        """
+        n_i = np.zeros(int(np.prod(self.shape)), dtype=self.values.dtype)
+        n_i[self.keys] = self.values
+        return n_i.reshape(self.shape)
+
+    def align(self, keys):
+        """
+        Returns the bin contents at the flat bin numbers ``keys``, zero for unoccupied bins
+
+        Parameters
+        ----------
+        keys: numpy.ndarray
+            Sorted flat bin numbers
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(len(keys),)`` bin contents
+        """
+        out = np.zeros(len(keys), dtype=self.values.dtype)
+        if len(self.keys) > 0:
+            pos = np.searchsorted(self.keys, keys).clip(max=len(self.keys) - 1)
+            found = self.keys[pos] == keys
+            out[found] = self.values[pos[found]]
+        return out
+
+    def sum(self, *args, **kwargs):
+        return self.values.sum()
+
+    def _binary(self, other, op):
+        if not isinstance(other, SparseHistogram):
+            return SparseHistogram(self.keys, op(self.values, other), self.shape)
+        if other.shape != self.shape:
+            raise ValueError("Histograms with shapes {} and {} cannot be combined".format(self.shape, other.shape))
+        keys = np.union1d(self.keys, other.keys)
+        return SparseHistogram(keys, op(self.align(keys), other.align(keys)), self.shape)
+
+    def __add__(self, other):
+        return self._binary(other, np.add)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self._binary(other, np.subtract)
+
+    def __mul__(self, other):
+        return self._binary(other, np.multiply)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        return self._binary(other, np.true_divide)
+
+    def __repr__(self):
+        return "SparseHistogram(shape={}, occupied={})".format(self.shape, len(self))
+
+
+def union_keys(histograms):
+    """
+    Returns the sorted union of the occupied bins of a list of :class:`SparseHistogram`
+    """
+    return np.unique(np.concatenate([hist.keys for hist in histograms]))
+
+
+def histogram(events, bins, weights=None, sparse=False, mask=None):
+    """
+    Histograms events in one or more kinematics with the edge conventions of ``numpy.histogram``
+
+    Parameters
+    ----------
+    events: pandas.DataFrame
+        Events, one column per kinematic
+    bins: dict
+        Bin edges per kinematic (keys)
+    weights: array_like, optional
+        ``(n_events,)`` event weights, unit weights by default
+    sparse: bool, optional
+        Return a :class:`SparseHistogram` with the occupied bins only, which never allocates the full grid
+    mask: numpy.ndarray, optional
+        ``(n_events,)`` boolean mask of the events to histogram, e.g. the events that pass the cuts
+
+    Returns
+    -------
+    numpy.ndarray or :class:`ml4eft.core.binning.SparseHistogram`
+        Event counts with one axis per kinematic in ``bins``
+    """
+    # only the binned columns are masked, the DataFrame itself is never filtered
+    sample = [np.asarray(events[kin]) if mask is None else np.asarray(events[kin])[mask] for kin in bins.keys()]
+    if weights is not None and mask is not None:
+        weights = np.asarray(weights)[mask]
+
+    if not sparse:
+        n_i, _ = np.histogramdd(sample, bins=list(bins.values()), weights=weights)
+        return n_i if weights is not None else n_i.astype(np.int64)
+
+    shape = tuple(len(edges) - 1 for edges in bins.values())
+    flat = np.zeros(len(sample[0]), dtype=np.int64)
+    inside = np.ones(len(sample[0]), dtype=bool)
+    for x, edges, n_bins in zip(sample, bins.values(), shape):
+        bin_kin = np.searchsorted(edges, x, side='right') - 1
+
+        # the last bin includes its right edge
+        bin_kin[x == edges[-1]] = n_bins - 1
+        inside &= (bin_kin >= 0) & (bin_kin < n_bins)
+        flat = flat * n_bins + bin_kin
+
+    weights = None if weights is None else np.asarray(weights)[inside]
+    return SparseHistogram.from_flat(flat[inside], shape, weights)
+
+
+class BinIndex:
+    """
+    Sorted copy of the feature columns of a replica, with the rank of each event in every column
+
+    Counting events between two edges then only needs a ``searchsorted`` in the sorted column and a difference of
+    (cumulative) counts, so re-binning costs :math:`\\mathcal{O}(n_{\\rm bins}\\log N)` in one dimension instead of a
+    pass over the events. In more dimensions, the per-column bin numbers follow from the ranks by a lookup table
+    built from the same ``searchsorted`` positions, followed by a single ``bincount``; no sorting or histogramming of
+    the raw values is needed. The counts agree exactly with ``numpy.histogram`` and ``numpy.histogram2d``: bins are
+    half-open, except for the last one that includes its right edge.
+    """
+
+    def __init__(self, sorted_columns, ranks, xsec, weights=None, mtime=None):
+        """
+        BinIndex constructor, see :meth:`from_events` to build an index from a DataFrame
+
+        Parameters
+        ----------
+        sorted_columns: dict
+            Sorted ``(N,)`` values per feature (keys)
+        ranks: dict
+            ``(N,)`` position of each event in the sorted column, per feature (keys)
+        xsec: float
+            Inclusive cross-section of the replica
+        weights: numpy.ndarray, optional
+            ``(N,)`` event weights in the original event order, unit weights by default
+        mtime: float, optional
+            Modification time of the event file the index is built from
+        """
+        self.sorted_columns = sorted_columns
+        self.ranks = ranks
+        self.xsec = xsec
+        self.weights = weights
+        self.mtime = mtime
+
+        self.features = list(sorted_columns.keys())
+        self.n_tot = len(next(iter(sorted_columns.values())))
+        self.w_tot = self.n_tot if weights is None else np.sum(weights)
+
+        # cumulative weights in the sorted order of each feature, built lazily
+        self._cum_weights = {}
+
+    def __len__(self):
+        return self.n_tot
+
+    def __getitem__(self, kin):
+        """
+        Returns a feature column in the original event order, e.g. to evaluate cuts on the index
+        """
+        return self.sorted_columns[kin][self.ranks[kin]]
+
+    @classmethod
+    def from_events(cls, events, xsec, features=None, weights=None, mtime=None):
+        """
+        Builds the index of a replica
+
+        Parameters
+        ----------
+        events: pandas.DataFrame
+            Events, one column per feature
+        xsec: float
+            Inclusive cross-section of the events
+        features: array_like, optional
+            Features to index, all columns by default
+        weights: array_like or str, optional
+            ``(N,)`` event weights, or the name of the column that holds them. Unit weights by default.
+        mtime: float, optional
+            Modification time of the event file
+
+        Returns
+        -------
+        :class:`ml4eft.core.binning.BinIndex`
+            Index of the events
+        """
+        if features is None:
+            features = [kin for kin in events.columns if not (isinstance(weights, str) and kin == weights)]
+        if isinstance(weights, str):
+            weights = events[weights].values
+
+        sorted_columns, ranks = {}, {}
+        for kin in features:
+            x = events[kin].values
+            order = np.argsort(x, kind='stable')
+            rank = np.empty(len(order), dtype=np.int32 if len(order) < 2 ** 31 else np.int64)
+            rank[order] = np.arange(len(order))
+            sorted_columns[kin] = x[order]
+            ranks[kin] = rank
+
+        weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+        return cls(sorted_columns, ranks, xsec, weights, mtime)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index written by :meth:`save`
+
+        Parameters
+        ----------
+        path: str
+            Path to the ``.npz`` file
+
+        Returns
+        -------
+        :class:`ml4eft.core.binning.BinIndex`
+            Loaded index
+        """
+        with np.load(path) as data:
+            features = list(data['features'])
+            sorted_columns = {kin: data['sorted_{}'.format(kin)] for kin in features}
+            ranks = {kin: data['rank_{}'.format(kin)] for kin in features}
+            weights = data['weights'] if 'weights' in data.files else None
+            return cls(sorted_columns, ranks, float(data['xsec']), weights, float(data['mtime']))
+
+    def save(self, path):
+        """
+        Writes the index to an uncompressed ``.npz`` file
+
+        Parameters
+        ----------
+        path: str
+            Output path, see :func:`index_path`
+        """
+        arrays = {'features': np.array(self.features), 'xsec': self.xsec,
+                  'mtime': np.nan if self.mtime is None else self.mtime}
+        for kin in self.features:
+            arrays['sorted_{}'.format(kin)] = self.sorted_columns[kin]
+            arrays['rank_{}'.format(kin)] = self.ranks[kin]
+        if self.weights is not None:
+            arrays['weights'] = self.weights
+
+        # np.savez appends .npz to paths without it, write to a temporary file first to never leave a partial index
+        tmp_path = path[:-len('.npz')] + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    def _positions(self, kin, edges):
+        """
+        Returns the positions of the bin edges in the sorted column, following the conventions of ``numpy.histogram``
+        """
+        x_sorted = self.sorted_columns[kin]
+        edges = np.asarray(edges, dtype=np.float64)
+        pos = np.searchsorted(x_sorted, edges, side='left')
+        pos[-1] = np.searchsorted(x_sorted, edges[-1], side='right')
+        return pos
+
+    def counts(self, bins, sparse=False, mask=None):
+        """
+        Returns the (weighted) number of events per bin
+
+        Parameters
+        ----------
+        bins: dict
+            Bin edges per feature (keys)
+        sparse: bool, optional
+            Return a :class:`SparseHistogram` with the occupied bins only
+        mask: numpy.ndarray, optional
+            ``(N,)`` boolean mask of the events to count, e.g. the events that pass the cuts
+
+        Returns
+        -------
+        numpy.ndarray or :class:`ml4eft.core.binning.SparseHistogram`
+            Event counts with one axis per feature in ``bins``, equal to ``numpy.histogram(dd)``
+        """
+        missing = [kin for kin in bins.keys() if kin not in self.sorted_columns]
+        if missing:
+            raise KeyError("Features {} are not indexed, available features are {}".format(missing, self.features))
+
+        if len(bins) == 1 and not sparse and mask is None:
+            (kin, edges), = bins.items()
+            pos = self._positions(kin, edges)
+            if self.weights is None:
+                return np.diff(pos)
+
+            if kin not in self._cum_weights:
+                w_sorted = np.empty_like(self.weights)
+                w_sorted[self.ranks[kin]] = self.weights
+                self._cum_weights[kin] = np.concatenate(([0.0], np.cumsum(w_sorted)))
+            return np.diff(self._cum_weights[kin][pos])
+
+        # bin number per rank for every feature, -1 outside the edges, combined into a flat bin number per event.
+        # The lookup tables use the smallest integer type that fits, which keeps the random-access gather cheap.
+        shape = tuple(len(edges) - 1 for edges in bins.values())
+        flat = np.zeros(self.n_tot, dtype=np.int64)
+        inside = np.ones(self.n_tot, dtype=bool) if mask is None else mask.copy()
+        for (kin, edges), n_bins in zip(bins.items(), shape):
+            pos = self._positions(kin, edges)
+            lut = np.full(self.n_tot, -1, dtype=np.min_scalar_type(-n_bins))
+            lut[pos[0]:pos[-1]] = np.repeat(np.arange(n_bins), np.diff(pos))
+            bin_kin = lut[self.ranks[kin]]
+            inside &= bin_kin >= 0
+            flat = flat * n_bins + bin_kin
+
+        weights = None if self.weights is None else self.weights[inside]
+        if sparse:
+            return SparseHistogram.from_flat(flat[inside], shape, weights)
+
+        n_i = np.bincount(flat[inside], weights=weights, minlength=int(np.prod(shape)))
+        return n_i.reshape(shape)
+
+    def xsec_per_bin(self, bins, sparse=False, mask=None):
+        """
+        Returns the cross-section per bin
+
+        Parameters
+        ----------
+        bins: dict
+            Bin edges per feature (keys)
+        sparse: bool, optional
+            Return a :class:`SparseHistogram` with the occupied bins only
+        mask: numpy.ndarray, optional
+            ``(N,)`` boolean mask of the events to count, the cross-section is still normalised to all events
+
+        Returns
+        -------
+        numpy.ndarray or :class:`ml4eft.core.binning.SparseHistogram`
+            Cross-section per bin with one axis per feature in ``bins``
+        """
+        return self.counts(bins, sparse, mask) / self.w_tot * self.xsec
+
+
+def build_bin_index(event_path, features=None, weights=None):
+    """
+    Builds and saves the bin index of a replica event file next to it
+
+    Parameters
+    ----------
+    event_path: str
+        Path to the event store or the pickled DataFrame
+    features: array_like, optional
+        Features to index, all features by default
+    weights: str, optional
+        Name of the column with event weights, unit weights by default
+
+    Returns
+    -------
+    str
+        Path to the written index
+    """
+    columns = None if features is None or weights is None else list(features) + [weights]
+    events, xsec = event_store.load_events(event_path, columns)
+    index = BinIndex.from_events(events, xsec, features, weights, mtime=_mtime(event_path))
+
+    path = index_path(event_path)
+    index.save(path)
+    logging.info("Wrote bin index of {} to {}".format(event_path, path))
+    return path
+
+
+def load_bin_index(event_path):
+    """
+    Loads the bin index of a replica event file if it exists and is not older than the events
+
+    Parameters
+    ----------
+    event_path: str
+        Path to the event store or the pickled DataFrame
+
+    Returns
+    -------
+    :class:`ml4eft.core.binning.BinIndex` or None
+        Index of the events, ``None`` when there is no valid index
+    """
+    path = index_path(event_path)
+    if not os.path.isfile(path):
+        return None
+
+    index = BinIndex.load(path)
+    if not index.mtime >= _mtime(event_path):
+        logging.info("Ignoring bin index {}, the events have changed since it was built".format(path))
+        return None
+    return index
+
+
+def build_tree(root, features=None, weights=None):
+    """
+    Builds the bin index of every replica event file below ``root``
+
+    Parameters
+    ----------
+    root: str
+        Root directory, e.g. ``training_data/tt_llvlvlbb``
+    features: array_like, optional
+        Features to index, all features by default
+    weights: str, optional
+        Name of the column with event weights, unit weights by default
+
+    Returns
+    -------
+    list
+        Paths to the written indices
+
+    Examples
+    --------
+    >>> build_tree('training_data/tt_llvlvlbb', features=['pt_ll', 'eta_l1', 'm_ll'])
+    """
+    written = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        names = [name for name in filenames + dirnames if name.startswith('events_')]
+        for name in sorted(names):
+            event_path = os.path.join(dirpath, name)
+            if event_store.resolve_event_path(event_path) != event_path:
+                continue
+            if os.path.isdir(event_path) and not event_store.is_event_store(event_path):
+                continue
+            written.append(build_bin_index(event_path, features, weights))
+    return written
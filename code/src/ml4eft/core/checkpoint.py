@@ -0,0 +1,217 @@
+"""
+Module to keep track of model states during training and to write checkpoints and losses in the background
+"""
+
+import collections
+import glob
+import os
+import queue
+import random
+import threading
+import time
+import numpy as np
+import torch
+
+# training state to resume from, the model states it refers to, and the event sample and data split it belongs to
+CHECKPOINT = 'checkpoint.pt'
+STATE = 'state_{}.pt'
+SPLIT = 'split.pt'
+
+
+def snapshot(model):
+    """
+    Returns a copy of the parameters of ``model`` that is not affected by further training
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        Model
+
+    Returns
+    -------
+    dict
+        Copy of ``model.state_dict()``
+    """
+    return {key: value.detach().clone() for key, value in model.state_dict().items()}
+
+
+class StateBuffer:
+    """
+    Ring buffer with the model states at the start of the last ``size`` epochs
+
+    Keeps the states needed to go back to the early-stopping point in memory, instead of reading them back from the
+    per-epoch files.
+    """
+
+    def __init__(self, size):
+        """
+        StateBuffer constructor
+
+        Parameters
+        ----------
+        size: int
+            Number of epochs to keep, ``patience + 1`` to be able to go back ``patience`` epochs
+        """
+        self.states = collections.OrderedDict()
+        self.size = size
+
+    def append(self, epoch, state_dict):
+        """
+        Adds the state at the start of ``epoch``, dropping the oldest state when the buffer is full
+        """
+        self.states[epoch] = state_dict
+        while len(self.states) > self.size:
+            self.states.popitem(last=False)
+
+    def __getitem__(self, epoch):
+        return self.states[epoch]
+
+
+class CheckpointWriter:
+    """
+    Writes model states and losses to disk on a background thread, in the order in which they are submitted
+
+    Errors raised while writing are re-raised by :meth:`close`, or by the next submission. The time spent writing is
+    accumulated in ``busy``.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.error = None
+        self.busy = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            func, args = task
+            t_start = time.perf_counter()
+            try:
+                func(*args)
+            except Exception as error:
+                self.error = error
+            self.busy += time.perf_counter() - t_start
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, func, *args):
+        """
+        Calls ``func(*args)`` on the writer thread
+        """
+        self._check()
+        self.queue.put((func, args))
+
+    def save(self, state_dict, path):
+        """
+        Saves ``state_dict`` to ``path``, ``state_dict`` should not be modified afterwards, see :func:`snapshot`
+        """
+        self.submit(save, state_dict, path)
+
+    def append_loss(self, path, loss):
+        """
+        Appends ``loss`` to the loss file at ``path``, in the same format as ``numpy.savetxt``
+        """
+        self.submit(_append_loss, path, loss)
+
+    def close(self):
+        """
+        Waits until everything is written and stops the writer thread
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def save(obj, path):
+    """
+    Saves ``obj`` with ``torch.save`` through a temporary file, such that ``path`` is never left half-written
+    """
+    tmp_path = path + '.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    """
+    Loads a checkpoint written by :func:`save`
+    """
+    return torch.load(path, weights_only=False)
+
+
+def find_checkpoint(output_dir, c_name, mc_run):
+    """
+    Returns the replica directory with the most recent checkpoint of a model
+
+    Parameters
+    ----------
+    output_dir: str
+        Path to where the models are stored, i.e. without the date directories
+    c_name: str
+        EFT coefficient of the model
+    mc_run: int
+        Replica number
+
+    Returns
+    -------
+    str or None
+        Path to the replica directory, ending with a separator, or ``None`` if there is no checkpoint
+    """
+    paths = glob.glob(os.path.join(output_dir, '*', '*', '*', 'model_{}'.format(c_name), 'mc_run_{}'.format(mc_run),
+                                   CHECKPOINT))
+    if not paths:
+        return None
+
+    # the date directories are zero-padded, so the latest date sorts last
+    return os.path.dirname(sorted(paths)[-1]) + os.sep
+
+
+def remove_states(mc_path, keep=()):
+    """
+    Removes the model state files written for checkpoints in ``mc_path``, except those of the epochs in ``keep``
+
+    Parameters
+    ----------
+    mc_path: str
+        Replica directory, ending with a separator
+    keep: array_like, optional
+        Epochs whose states are still referenced by the checkpoint
+    """
+    keep = set(keep)
+    prefix, suffix = STATE.split('{}')
+    for path in glob.glob(mc_path + STATE.format('*')):
+        epoch = os.path.basename(path)[len(prefix):-len(suffix)]
+        if epoch.isdigit() and int(epoch) not in keep:
+            os.remove(path)
+
+
+def rng_state():
+    """
+    Returns the state of the torch, numpy and python random number generators
+    """
+    return {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(), 'python': random.getstate()}
+
+
+def set_rng_state(state):
+    """
+    Restores the random number generators to a state returned by :func:`rng_state`
+    """
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['python'])
+
+
+def _append_loss(path, loss):
+    with open(path, 'a') as f:
+        np.savetxt(f, np.atleast_1d(loss))
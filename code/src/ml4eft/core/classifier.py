@@ -9,20 +9,24 @@ import torch
 import torch.utils.data as data
 import torch.optim as optim
 import numpy as np
+import copy
 import datetime
 import json
 import os
 import time
+import resource
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from joblib import dump, load
 
 from matplotlib import pyplot as plt
 from matplotlib import rc
 from torch import nn
 from sklearn.model_selection import train_test_split
-import shutil
 import ml4eft.analyse.analyse as analyse
-from sklearn.preprocessing import StandardScaler, RobustScaler, QuantileTransformer
+from ml4eft.core import checkpoint, scalers, streaming, telemetry
+from ml4eft.preproc import event_store
+from ml4eft.preproc.cuts import CutFlow
 import joblib
 import sys
 
@@ -145,12 +149,70 @@ class Classifier(nn.Module):
         return g
 
 
+class ClassifierLoss(nn.Module):
+    """
+    Forward pass and loss of a :class:`Classifier` in one module, such that both can be scripted or compiled into a
+    single graph
+
+    The losses are expressed in terms of :math:`u = c\\,NN(x)` rather than the decision function
+    :math:`g = 1 / (2 + u)`, which avoids the round-trip through :math:`\\log(1 - g)`:
+
+    * CE: :math:`w\\,[\\log(2 + u) - (1 - y)\\log(1 + u)]`
+    * QC: :math:`w\\,[(1 - y) + y\\,(1 + u)^2] / (2 + u)^2`
+    """
+
+    def __init__(self, model, loss_type):
+        """
+        ClassifierLoss constructor
+
+        Parameters
+        ----------
+        model: :class:`Classifier`
+            Classifier, its parameters are shared with this module
+        loss_type: str
+            ``CE`` for cross-entropy or ``QC`` for quadratic cost
+        """
+        super().__init__()
+        layers = list(model.n_alpha.layers)
+
+        # the constraint is applied in full precision, as 1 + u is of order 1e-6 near the boundary
+        self.mlp = nn.Sequential(*layers[:-1])
+        self.constraint = layers[-1]
+        self.c = float(model.c)
+        self.quadratic_cost = loss_type == 'QC'
+
+    def forward(self, events, weights, labels):
+        """
+        Computes the loss of a mini-batch
+
+        Parameters
+        ----------
+        events: torch.Tensor
+            ``(N, n_features)`` events
+        weights: torch.Tensor
+            ``(N, 1)`` event weights
+        labels: torch.Tensor
+            ``(N, 1)`` classification labels
+
+        Returns
+        -------
+        torch.Tensor
+            Average loss of the mini-batch, as :meth:`Fitter.loss_fn`
+        """
+        u = self.c * self.constraint(self.mlp(events).float())
+        if self.quadratic_cost:
+            loss = weights * ((1 - labels) + labels * (1 + u) ** 2) / (2 + u) ** 2
+        else:
+            loss = weights * (torch.log1p(1 + u) - (1 - labels) * torch.log1p(u))
+        return torch.mean(loss, dim=0)
+
+
 class PreProcessing():
     """
     A feature preprocessor and data loader
     """
 
-    def __init__(self, fitter, path):
+    def __init__(self, fitter, path, sm_sample=None, rows=None):
         """
 
         Parameters
@@ -160,41 +222,56 @@ class PreProcessing():
         path: dict
             Dictionary with paths to the SM and EFT dataset, e.g:
             :code:`{'sm': <path_to_sm_dataset>, 'eft': <path_to_eft_dataset>}`
+        sm_sample: tuple, optional
+            Already loaded SM events, cross-section and sampled rows, as returned by :func:`load_sm_sample`. The SM
+            dataset is then not read again.
+        rows: dict, optional
+            Positions of the SM and EFT events to load instead of drawing new samples, e.g. :code:`preproc.rows` of
+            an earlier :class:`PreProcessing`
         """
 
         self.path = path
 
-        if fitter.scaler_type == 'robust':
-            self.scaler = RobustScaler(quantile_range=(5, 95))
-        elif fitter.scaler_type == 'standardise':
-            self.scaler = StandardScaler()
-        else:
-            self.scaler = QuantileTransformer(n_quantiles=1000, output_distribution='normal')
+        self.scaler = scalers.make_scaler(fitter.scaler_type)
 
-        self.load_data(fitter)
+        self.rows = rows
+        self.load_data(fitter, sm_sample)
 
-    def load_data(self, fitter):
+    def load_data(self, fitter, sm_sample=None):
         """
         Loads ``pandas.DataFrame`` into SM and EFT dataframes.
+
+        Only the training features of ``fitter.n_dat`` randomly sampled events are kept, optionally cast to
+        ``fitter.dtype``. With ``fitter.cuts``, the events are sampled among the ones that pass the cuts. The SM and
+        EFT samples are loaded concurrently, unless the SM sample is passed as ``sm_sample``. The positions of the
+        sampled events are kept in ``self.rows``.
         """
-        # sm
+        # one cut-flow per sample, as each records its own efficiencies
+        cuts_sm, cuts_eft = (None, None) if not fitter.cuts else (CutFlow(fitter.cuts), CutFlow(fitter.cuts))
 
-        df_sm_full = pd.read_pickle(self.path['sm'], compression="infer")
-        df_sm_wo_xsec = df_sm_full.iloc[1:, :]
+        rows = {'sm': None, 'eft': None} if self.rows is None else self.rows
 
-        # cross section before cuts
-        self.xsec_sm = df_sm_full.iloc[0, 0]
-        self.df_sm = df_sm_wo_xsec.sample(fitter.n_dat)
+        # a shared sm sample can only be used if it has the requested rows
+        if sm_sample is not None and rows['sm'] is not None and not np.array_equal(sm_sample[2], rows['sm']):
+            sm_sample = None
 
-        # eft
-        df_eft_full = pd.read_pickle(self.path['eft'], compression="infer")
-        df_eft_wo_xsec = df_eft_full.iloc[1:, :]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            if sm_sample is None:
+                sm = executor.submit(event_store.sample_events, self.path['sm'], fitter.n_dat, fitter.features,
+                                     fitter.dtype, cuts=cuts_sm, rows=rows['sm'], return_rows=True)
+            eft = executor.submit(event_store.sample_events, self.path['eft'], fitter.n_dat, fitter.features,
+                                  fitter.dtype, cuts=cuts_eft, rows=rows['eft'], return_rows=True)
 
-        # cross section before cuts
-        self.xsec_eft = df_eft_full.iloc[0, 0]
-        self.df_eft = df_eft_wo_xsec.sample(fitter.n_dat)
+            # cross sections after cuts, or before cuts if there are none
+            self.df_sm, self.xsec_sm, rows_sm = sm.result() if sm_sample is None else sm_sample
+            self.df_eft, self.xsec_eft, rows_eft = eft.result()
 
-    def feature_scaling(self, fitter, scaler_path):
+        self.rows = {'sm': rows_sm, 'eft': rows_eft}
+
+        logging.info("Loaded {} SM and EFT events, peak memory {:.1f} MB".format(
+            fitter.n_dat, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+    def feature_scaling(self, fitter, scaler_path, load_scaler=False):
         """
 
         Parameters
@@ -203,6 +280,8 @@ class PreProcessing():
             Fitter object
         scaler_path: string
             Path to where preprocessing scaler must be saved
+        load_scaler: bool, optional
+            Set to true to rescale with the scaler saved at ``scaler_path`` instead of fitting a new one
         Returns
         -------
         df_sm_scaled : pandas.DataFrame
@@ -212,10 +291,14 @@ class PreProcessing():
             Rescaled EFT events
         """
 
-        df = pd.concat([self.df_sm, self.df_eft])
-
-        # fit the scaler transformer to the eft and sm features
-        self.scaler.fit(df[fitter.features])
+        if load_scaler:
+            self.scaler = scalers.load_scaler(scaler_path)
+        else:
+            # fit the scaler transformer to the eft and sm features in chunks, without copying them into one array
+            for df in [self.df_sm, self.df_eft]:
+                features = df[fitter.features]
+                for start in range(0, len(features), fitter.scaler_chunk_size):
+                    self.scaler.partial_fit(features.iloc[start:start + fitter.scaler_chunk_size].to_numpy())
 
         # rescale the sm and eft data
         features_sm_scaled = self.scaler.transform(self.df_sm[fitter.features])
@@ -226,7 +309,8 @@ class PreProcessing():
         df_eft_scaled = pd.DataFrame(features_eft_scaled, columns=fitter.features)
 
         # save the scaler
-        joblib.dump(self.scaler, scaler_path)
+        if not load_scaler:
+            joblib.dump(self.scaler, scaler_path)
 
         return df_sm_scaled, df_eft_scaled
 
@@ -281,7 +365,8 @@ class EventDataset(data.Dataset):
         n_dat = len(self.df)
 
         self.weights = self.xsec * torch.ones(n_dat).unsqueeze(-1)
-        self.events = torch.tensor(self.df[self.features].values)
+        # stored in the precision of the network once, instead of converting every mini-batch
+        self.events = torch.tensor(self.df[self.features].values, dtype=torch.float32)
         self.labels = torch.ones(n_dat).unsqueeze(-1) if self.hypothesis else torch.zeros(n_dat).unsqueeze(-1)
 
         logging.info("Dataset loaded from {}".format(path))
@@ -293,13 +378,89 @@ class EventDataset(data.Dataset):
         data_sample, weight_sample, label_sample = self.events[idx], self.weights[idx], self.labels[idx]
         return data_sample, weight_sample, label_sample
 
+    @property
+    def tensors(self):
+        """
+        Events, weights and labels as tensors, as for ``torch.utils.data.TensorDataset``
+        """
+        return self.events, self.weights, self.labels
+
+    def subset(self, indices):
+        """
+        Returns the events at ``indices`` as a dataset of contiguous tensors
+
+        Parameters
+        ----------
+        indices: torch.Tensor
+            Indices of the events to keep
+
+        Returns
+        -------
+        torch.utils.data.TensorDataset
+            Events, weights and labels at ``indices``
+        """
+        return data.TensorDataset(self.events[indices], self.weights[indices], self.labels[indices])
+
+
+class TensorLoader:
+    """
+    In-memory minibatch iterator over a dataset of contiguous tensors
+
+    Replaces ``torch.utils.data.DataLoader`` for datasets that fit in memory: instead of indexing and collating every
+    event separately, the tensors are permuted once per epoch (when shuffling) and the minibatches are yielded as
+    slices, i.e. views, of the permuted tensors.
+    """
+
+    def __init__(self, dataset, batch_size, shuffle=False, generator=None):
+        """
+        TensorLoader constructor
+
+        Parameters
+        ----------
+        dataset: torch.utils.data.TensorDataset or EventDataset
+            Dataset whose ``tensors`` share the same first dimension
+        batch_size: int
+            Number of events per minibatch, the last minibatch may be smaller
+        shuffle: bool, optional
+            Reshuffle the events at the start of every epoch
+        generator: torch.Generator, optional
+            Random number generator used to shuffle
+
+        Examples
+        --------
+        Iterate over the SM and EFT minibatches in pairs, as in :meth:`Fitter.training_loop`
+
+        >>> loaders = [TensorLoader(dataset, batch_size=1000, shuffle=True) for dataset in data_train]
+        >>> for minibatch in zip(*loaders):
+        ...     for event, weight, label in minibatch:
+        ...         output = model(event)
+        """
+        self.tensors = tuple(tensor.contiguous() for tensor in dataset.tensors)
+        self.batch_size = max(int(batch_size), 1)
+        self.shuffle = shuffle
+        self.generator = generator
+
+        self.n_events = len(self.tensors[0])
+
+    def __len__(self):
+        return (self.n_events + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        tensors = self.tensors
+        if self.shuffle:
+            perm = torch.randperm(self.n_events, generator=self.generator)
+            tensors = tuple(tensor[perm] for tensor in tensors)
+
+        for start in range(0, self.n_events, self.batch_size):
+            yield [tensor[start:start + self.batch_size] for tensor in tensors]
+
 
 class Fitter:
     """
     Training class
     """
 
-    def __init__(self, json_path, mc_run, c_name, output_dir, print_log=False):
+    def __init__(self, json_path, mc_run, c_name, output_dir, print_log=False, sm_sample=None, resume=False):
         """
         Fitter constructor
 
@@ -316,6 +477,14 @@ class Fitter:
         print_log: bool, optional
             Set to true to print training progress to stdout, otherwise it
             prints to a log file only
+        sm_sample: tuple, optional
+            SM events, cross-section and sampled rows of replica ``mc_run`` as returned by :func:`load_sm_sample`, to
+            share one SM sample between the fits of several coefficients
+        resume: bool, optional
+            Set to true to continue from the most recent checkpoint of this replica in ``output_dir``, if any. The
+            model, optimizer, losses, early-stopping state, random number generators, event sample and data split
+            are restored, and the training continues in the directory of the checkpoint. Checkpoints are written every
+            ``resume_stride`` epochs of the run card, 10 by default.
         """
         # read the json run card
         with open(json_path) as json_data:
@@ -334,7 +503,20 @@ class Fitter:
         self.c_train = self.run_options["c_train"]
 
         self.n_dat = self.run_options['n_dat']
+        self.dtype = self.run_options.get('dtype')  # e.g. 'float32', keeps the stored precision by default
+        self.cuts = self.run_options.get('cuts')  # e.g. ['pt_l1 > 25', 'abs(eta_l1) < 2.5'], no cuts by default
         self.epochs = self.run_options['epochs']
+        # write trained_nn_<epoch>.pt every checkpoint_stride epochs, e.g. 1 for Animate. Off by default
+        self.checkpoint_stride = self.run_options.get('checkpoint_stride', 0)
+        # write the checkpoint to resume from every resume_stride epochs, 0 to only mark finished trainings
+        self.resume_stride = self.run_options.get('resume_stride', 10)
+        # compile the forward pass and loss with torch.compile, and/or train in e.g. bfloat16. Off by default
+        self.compile = self.run_options.get('compile', False)
+        self.autocast = self.run_options.get('autocast')
+        # number of events per chunk when fitting the feature scaler in one streaming pass
+        self.scaler_chunk_size = self.run_options.get('scaler_chunk_size', 100000)
+        # read the events from the event stores while training, e.g. {"buffer_size": 1000000}. In memory by default
+        self.streaming = self.run_options.get('streaming')
         self.features = self.run_options['features']
         self.network_size = [len(self.features)] + self.run_options['hidden_sizes'] + [
             self.run_options['output_size']]
@@ -348,12 +530,20 @@ class Fitter:
             self.c_train_value = self.c_train[self.c_name]
 
         self.mc_run = mc_run
+        self.sm_sample = sm_sample
 
-        output_dir = os.path.join(output_dir, time.strftime("%Y/%m/%d"))
-        os.makedirs(output_dir, exist_ok=True)
+        # continue in the directory of the latest checkpoint, which can be from an earlier day
+        mc_path = checkpoint.find_checkpoint(output_dir, self.c_name, self.mc_run) if resume else None
+        self.checkpoint = None if mc_path is None else checkpoint.load(mc_path + checkpoint.CHECKPOINT)
 
-        model_path = os.path.join(output_dir, 'model_{}'.format(self.c_name))
-        mc_path = os.path.join(model_path, 'mc_run_{}/'.format(self.mc_run))
+        if mc_path is None:
+            output_dir = os.path.join(output_dir, time.strftime("%Y/%m/%d"))
+            os.makedirs(output_dir, exist_ok=True)
+
+            model_path = os.path.join(output_dir, 'model_{}'.format(self.c_name))
+            mc_path = os.path.join(model_path, 'mc_run_{}/'.format(self.mc_run))
+        else:
+            model_path = os.path.dirname(os.path.dirname(mc_path))
         log_path = os.path.join(mc_path, 'logs')
 
         self.path_dict = {'model': model_path,
@@ -392,13 +582,20 @@ class Fitter:
         logging.basicConfig(
             level=logging.INFO,
             format="%(asctime)s [%(levelname)s] %(message)s",
-            handlers=handlers
+            handlers=handlers,
+            force=True
         )
 
+        if self.checkpoint is not None:
+            if self.checkpoint['done']:
+                logging.info("Training in {} already finished, nothing to resume".format(mc_path))
+                return
+            logging.info("Resuming from the checkpoint at epoch {} in {}".format(self.checkpoint['epoch'], mc_path))
+
         logging.info("All directories created, ready to load the data")
 
         # load the training and validation data
-        data_train, data_val = self.load_data()
+        data_train, data_val = self.load_streams() if self.streaming else self.load_data()
 
         # copy run card to the appropriate folder
         with open(mc_path + 'run_card.json', 'w') as outfile:
@@ -428,12 +625,17 @@ class Fitter:
 
         path_dict = {'sm': path_sm, 'eft': path_eft}
 
+        # when resuming, load the same events and scaler as before
+        resume = self.checkpoint is not None
+        split_path = os.path.join(self.path_dict['mc_path'], checkpoint.SPLIT)
+        split = checkpoint.load(split_path) if resume else None
+
         # preprocessing of the data
-        preproc = PreProcessing(self, path_dict)
+        preproc = PreProcessing(self, path_dict, self.sm_sample, rows=split['rows'] if resume else None)
 
         # save the scaler
         scaler_path = os.path.join(self.path_dict['mc_path'], 'scaler.gz')
-        df_sm_scaled, df_eft_scaled = preproc.feature_scaling(self, scaler_path)
+        df_sm_scaled, df_eft_scaled = preproc.feature_scaling(self, scaler_path, load_scaler=resume)
 
         self.n_dat = min(len(df_eft_scaled), len(df_sm_scaled))
 
@@ -455,11 +657,17 @@ class Fitter:
         data_all = [data_eft, data_sm]
 
         # split each data set in training and validation
-        data_split = []
-        for dataset in data_all:
+        data_split, split_indices = [], []
+        for i, dataset in enumerate(data_all):
             n_val_points = int(self.val_ratio * len(dataset))
             n_train_points = len(dataset) - n_val_points
-            data_split.append(data.random_split(dataset, [n_train_points, n_val_points]))
+            indices = split['indices'][i] if resume else torch.randperm(len(dataset))
+            data_split.append([dataset.subset(indices[:n_train_points]), dataset.subset(indices[n_train_points:])])
+            split_indices.append(indices)
+
+        # keep the sample and split, to be able to resume from a checkpoint
+        if not resume:
+            checkpoint.save({'rows': preproc.rows, 'indices': split_indices}, split_path)
 
         # collect all the training and validation sets
         data_train, data_val = [], []
@@ -469,6 +677,68 @@ class Fitter:
 
         return data_train, data_val
 
+    def load_streams(self):
+        """
+        Constructs training and validation streams over the event stores, for samples that do not fit in memory
+
+        The SM and EFT samples of replica ``mc_run`` are read from the event store ``events_<mc_run>``, or from its
+        shards ``events_<mc_run>_<k>``, see :func:`ml4eft.preproc.event_store.find_shards`. At most ``n_dat`` events
+        per sample are used, the last ``val_ratio`` of every store for validation. One pass over the events applies
+        the cuts, counts the events that pass and fits the scaler, after which the events are read, cut and scaled
+        again every epoch. The ``streaming`` entry of the run card sets the options of the streams:
+
+        * ``chunk_size``: number of events per shard, 100000 by default
+        * ``buffer_size``: number of events in the shuffle buffer, 1000000 by default
+        * ``prefetch``: number of minibatches to read ahead, 4 by default
+
+        Returns
+        -------
+        train_streams: list
+            :class:`ml4eft.core.streaming.ShardStream` objects, one for the EFT and one for the SM (training)
+        val_streams: list
+            :class:`ml4eft.core.streaming.ShardStream` objects, one for the EFT and one for the SM (validation)
+        """
+        options = self.streaming if isinstance(self.streaming, dict) else {}
+        chunk_size = options.get('chunk_size', 100000)
+
+        path_sm = os.path.join(self.event_data_path, self.process_id + '_sm/events_{}'.format(self.mc_run))
+        path_eft = os.path.join(self.event_data_path, self.process_id + '_{}/events_{}'.format(self.c_name,
+                                                                                             self.mc_run))
+
+        shards = {}
+        for name, path in [('eft', path_eft), ('sm', path_sm)]:
+            shards[name] = streaming.make_shards(event_store.find_shards(path), chunk_size, n_max=self.n_dat,
+                                                 val_ratio=self.val_ratio)
+
+        # when resuming, use the scaler and event counts of before instead of scanning the events again
+        resume = self.checkpoint is not None
+        split_path = os.path.join(self.path_dict['mc_path'], checkpoint.SPLIT)
+        scaler_path = os.path.join(self.path_dict['mc_path'], 'scaler.gz')
+        if resume:
+            n_pass = checkpoint.load(split_path)['n_pass']
+            self.scaler = scalers.load_scaler(scaler_path)
+        else:
+            self.scaler = scalers.make_scaler(self.scaler_type)
+            n_pass = {name: [streaming.scan(shards_split, self.features, self.cuts, self.scaler) for shards_split in
+                             shards[name]] for name in shards}
+            joblib.dump(self.scaler, scaler_path)
+            checkpoint.save({'n_pass': n_pass}, split_path)
+
+        train_streams, val_streams = [], []
+        for name, hypothesis in [('eft', 0), ('sm', 1)]:
+            xsec = streaming.cross_section(shards[name][0] + shards[name][1], np.concatenate(n_pass[name]))
+            for streams, shards_split, n_split, shuffle in [(train_streams, shards[name][0], n_pass[name][0], True),
+                                                            (val_streams, shards[name][1], n_pass[name][1], False)]:
+                streams.append(streaming.ShardStream(shards_split, self.features, xsec, hypothesis,
+                                                     batch_size=int(np.sum(n_split) / self.n_batches),
+                                                     scaler=self.scaler, cuts=self.cuts, shuffle=shuffle,
+                                                     buffer_size=options.get('buffer_size', 1000000),
+                                                     prefetch=options.get('prefetch', 4)))
+            logging.info("Streaming {} {} training and {} validation events from {} shards, cross-section {}".format(
+                np.sum(n_pass[name][0]), name.upper(), np.sum(n_pass[name][1]), len(shards[name][0]), xsec))
+
+        return train_streams, val_streams
+
     def train_classifier(self, data_train, data_val):
         """
         Starts the training of the binary classifier
@@ -483,15 +753,25 @@ class Fitter:
         # define the optimizer
         optimizer = optim.AdamW(self.model.parameters(), lr=self.lr)
 
-        # Use PyTorche's DataLoader to allow for mini-batches. After each epoch, the minibatches reshuffle.
-        # Create a dataloader object for each eft point + sm and put them all in one big list called train_data_loader
-        # or val_data_loader
-        train_data_loader = [
-            data.DataLoader(dataset_train, batch_size=int(dataset_train.__len__() / self.n_batches), shuffle=True) for
-            dataset_train in data_train]
-        val_data_loader = [
-            data.DataLoader(dataset_val, batch_size=int(dataset_val.__len__() / self.n_batches), shuffle=False) for
-            dataset_val in data_val]
+        # Use in-memory TensorLoaders to allow for mini-batches. After each epoch, the minibatches reshuffle.
+        # Create a loader object for each eft point + sm and put them all in one big list called train_data_loader
+        # or val_data_loader. Streams are iterated over directly
+        if self.streaming:
+            train_data_loader, val_data_loader = data_train, data_val
+        else:
+            train_data_loader = [
+                TensorLoader(dataset_train, batch_size=int(dataset_train.__len__() / self.n_batches), shuffle=True)
+                for dataset_train in data_train]
+            val_data_loader = [
+                TensorLoader(dataset_val, batch_size=int(dataset_val.__len__() / self.n_batches), shuffle=False)
+                for dataset_val in data_val]
+
+        # optional accelerated training step, with the forward pass and loss in a single module
+        self.train_step = None
+        if self.compile or self.autocast:
+            self.train_step = ClassifierLoss(self.model, self.loss_type)
+            if self.compile:
+                self.train_step = torch.compile(self.train_step)
 
         # call the training loop
         self.training_loop(optimizer=optimizer, train_loader=train_data_loader, val_loader=val_data_loader)
@@ -501,105 +781,199 @@ class Fitter:
         Optimize the classifier with `optimizer` on the training data set `train_loader`. Keeps track of potential
         overfitting through `val_loader`.
 
+        With ``compile`` or ``autocast`` in the run card, the training loss is computed by :class:`ClassifierLoss`,
+        compiled with ``torch.compile`` and/or under ``torch.autocast`` with the ``autocast`` dtype, e.g.
+        ``bfloat16``. The validation loss is always computed in full precision.
+
+        The states of the last ``patience`` epochs are kept in memory to go back to the early-stopping point. All files
+        are written on a background thread: the losses are appended to ``loss.out`` and ``loss_val.out`` after every
+        epoch, ``trained_nn.pt`` is written once at the end and ``trained_nn_<epoch>.pt`` only every
+        ``checkpoint_stride`` epochs. Every ``resume_stride`` epochs, ``checkpoint.pt`` is written with the training
+        state to resume from. It refers to the states in memory by epoch, each of which is written once to its own
+        ``state_<epoch>.pt`` file, and those files are removed once they leave the early-stopping window or the
+        training is done.
+
+        Every epoch appends a record to ``telemetry.jsonl`` with the time spent on loading minibatches, the forward
+        and backward passes, the optimizer, the validation and the checkpoints, the training events per second, the
+        peak resident memory and the number of threads, see :mod:`ml4eft.core.telemetry`.
+
         Parameters
         ----------
         optimizer: torch.optim
             Optimizer, e.g. torch.optim.AdamW
         train_loader: array_like
-            List of torch.utils.data.DataLoader objects, one for the SM and the EFT (training)
+            List of :class:`TensorLoader` objects, one for the SM and the EFT (training)
         val_loader: array_like
-            List of torch.utils.data.DataLoader objects, one for the SM and the EFT (validation)
+            List of :class:`TensorLoader` objects, one for the SM and the EFT (validation)
         """
         path = self.path_dict['mc_path']
 
         loss_list_train, loss_list_val = [], []  # stores the training loss per epoch
 
+        # model states at the start of the last patience + 1 epochs, and the writer of all files
+        states = checkpoint.StateBuffer(self.patience + 1)
+        writer = checkpoint.CheckpointWriter()
+
         # To be able to keep track of potential over-fitting, introduce a counter that gets increased
         # by one whenever the the validation loss increases during an epoch
         overfit_counter = 0
 
+        first_epoch = 1
+        if self.checkpoint is not None:
+            self.model.load_state_dict(self.checkpoint['model'])
+            optimizer.load_state_dict(self.checkpoint['optimizer'])
+            loss_list_train, loss_list_val = self.checkpoint['loss_train'], self.checkpoint['loss_val']
+            overfit_counter = self.checkpoint['overfit_counter']
+            for state_epoch in self.checkpoint['states']:
+                states.append(state_epoch, checkpoint.load(path + checkpoint.STATE.format(state_epoch)))
+            checkpoint.set_rng_state(self.checkpoint['rng'])
+            first_epoch = self.checkpoint['epoch'] + 1
+
+        # start from the losses up to the first epoch, the losses are appended after every epoch
+        np.savetxt(path + 'loss.out', loss_list_train)
+        np.savetxt(path + 'loss_val.out', loss_list_val)
+
+        # epochs of which the state has been written to state_<epoch>.pt
+        saved_states = set() if self.checkpoint is None else set(self.checkpoint['states'])
+
+        def save_checkpoint(epoch, done=False):
+            # a finished training is not resumed, so it does not need the states to go back to
+            window = [] if done else list(states.states)
+            for state_epoch in window:
+                if state_epoch not in saved_states:
+                    writer.save(states[state_epoch], path + checkpoint.STATE.format(state_epoch))
+                    saved_states.add(state_epoch)
+
+            writer.save({'epoch': epoch,
+                         'done': done,
+                         'model': checkpoint.snapshot(self.model),
+                         'optimizer': copy.deepcopy(optimizer.state_dict()),
+                         'loss_train': list(loss_list_train),
+                         'loss_val': list(loss_list_val),
+                         'overfit_counter': overfit_counter,
+                         'states': window,
+                         'rng': checkpoint.rng_state()}, path + checkpoint.CHECKPOINT)
+
+            # written in order, so the states that left the window are only removed once the checkpoint no longer
+            # refers to them
+            writer.submit(checkpoint.remove_states, path, window)
+            saved_states.intersection_update(window)
+
+        def save_telemetry(timer, epoch, writer_busy):
+            record = timer.record(epoch, time_checkpoint_io=writer.busy - writer_busy, loss_train=loss_list_train[-1],
+                                  loss_val=loss_list_val[-1])
+            writer.submit(telemetry.append_record, path + telemetry.TELEMETRY, record)
+
         # outer loop that runs over the number of epochs
         iterations = 0
-        for epoch in range(1, self.epochs + 1):
-
-            # check for plateau
-            if len(loss_list_train) > 10:
-                # if the loss after the first epoch queals the latest loss, we reset the weights
-                if loss_list_train[1] == loss_list_train[-1]:
-                    logging.info("Detected stagnant training, reset the weights")
-                    self.model.apply(self.weight_reset)
-
-            loss_train, loss_val = 0.0, 0.0
-
-            # We save the model parameters at the start of each epoch
-            torch.save(self.model.state_dict(), path + 'trained_nn_{}.pt'.format(epoch))
-
-            # compute validation loss
-            with torch.no_grad():
-                for minibatch in zip(*val_loader):
-                    val_loss = torch.zeros(1)
-                    for i, [event, weight, label] in enumerate(minibatch):
-                        if isinstance(self.model, Classifier):
-                            output = self.model(event.float())
-
-                        loss = self.loss_fn(output, label, weight)
-                        val_loss += loss
-                    assert val_loss.requires_grad is False
-
-                    loss_val += val_loss.item()
-
-            # loop over the mini-batches.
-            for j, minibatch in enumerate(zip(*train_loader)):
-                train_loss = torch.zeros(1)
-                # loop over all the datasets within the minibatch and compute their contribution to the loss
-                for i, [event, weight, label] in enumerate(minibatch):  # i=0: eft, i=1: sm
-                    if isinstance(self.model, Classifier):
-                        output = self.model(event.float())
-
-                    loss = self.loss_fn(output, label, weight)
-                    train_loss += loss
-
-                # perform gradient descent after each minibatch. Move to the next epoch when all minibatches are looped over.
-                optimizer.zero_grad()
-                train_loss.backward()
-                optimizer.step()
-
-                loss_train += train_loss.item()
-
-            loss_list_train.append(loss_train)
-            loss_list_val.append(loss_val)
-
-            training_status = "Epoch {epoch}, Training loss {train_loss}, Validation loss {val_loss}, Overfit counter = {overfit}". \
-                format(time=datetime.datetime.now(), epoch=epoch, train_loss=loss_train, val_loss=loss_val,
-                       overfit=overfit_counter)
-            logging.info(training_status)
-
-            np.savetxt(path + 'loss.out', loss_list_train)
-            np.savetxt(path + 'loss_val.out', loss_list_val)
-
-            # in case the maximum number of epochs is reached, save the final state
-            if epoch == self.epochs:
-                torch.save(self.model.state_dict(), path + 'trained_nn.pt')
-                break
-
-            # check whether the network is overfitting by increasing the overfit_counter by one if the
-            # validation loss increases during the epoch.
-            if epoch > 20:
-                if loss_val > min(loss_list_val):
-                    overfit_counter += 1
-                else:
-                    overfit_counter = 0
-
-            if overfit_counter == self.patience:
-                stopping_point = epoch - self.patience
-                logging.info("Stopping point reached! Overfit counter = {}".format(overfit_counter))
-                shutil.copyfile(path + 'trained_nn_{}.pt'.format(stopping_point), path + 'trained_nn.pt')
-                logging.info("Backwards stopping done")
-                break
-
-            loss_val_old = loss_val
-            iterations += 1
-
+        # close the writer also when training fails, such that queued files are written and its errors raised
+        try:
+            for epoch in range(first_epoch, self.epochs + 1):
+                timer = telemetry.EpochTimer()
+                # time spent by the writer thread during this epoch, in the background
+                writer_busy = writer.busy
+
+                # check for plateau
+                if len(loss_list_train) > 10:
+                    # if the loss after the first epoch queals the latest loss, we reset the weights
+                    if loss_list_train[1] == loss_list_train[-1]:
+                        logging.info("Detected stagnant training, reset the weights")
+                        self.model.apply(self.weight_reset)
+
+                loss_train, loss_val = 0.0, 0.0
+
+                # We keep the model parameters at the start of each epoch
+                with timer.section('checkpoint'):
+                    states.append(epoch, checkpoint.snapshot(self.model))
+                    if self.checkpoint_stride and epoch % self.checkpoint_stride == 0:
+                        writer.save(states[epoch], path + 'trained_nn_{}.pt'.format(epoch))
+
+                # compute validation loss
+                with timer.section('validation'), torch.no_grad():
+                    for minibatch in zip(*val_loader):
+                        val_loss = torch.zeros(1)
+                        for i, [event, weight, label] in enumerate(minibatch):
+                            if isinstance(self.model, Classifier):
+                                output = self.model(event.float())
+
+                            loss = self.loss_fn(output, label, weight)
+                            val_loss += loss
+                        assert val_loss.requires_grad is False
+
+                        loss_val += val_loss.item()
+
+                # loop over the mini-batches.
+                for j, minibatch in enumerate(timer.timed(zip(*train_loader))):
+                    train_loss = torch.zeros(1)
+                    # loop over all the datasets within the minibatch and compute their contribution to the loss
+                    with timer.section('forward'):
+                        for i, [event, weight, label] in enumerate(minibatch):  # i=0: eft, i=1: sm
+                            if self.train_step is not None:
+                                with torch.autocast('cpu', dtype=getattr(torch, self.autocast or 'bfloat16'),
+                                                    enabled=self.autocast is not None):
+                                    loss = self.train_step(event, weight, label)
+                            elif isinstance(self.model, Classifier):
+                                output = self.model(event.float())
+                                loss = self.loss_fn(output, label, weight)
+
+                            train_loss += loss
+                            timer.n_events += len(event)
+
+                    # perform gradient descent after each minibatch. Move to the next epoch when all minibatches are looped over.
+                    with timer.section('backward'):
+                        optimizer.zero_grad()
+                        train_loss.backward()
+                    with timer.section('optimizer'):
+                        optimizer.step()
+
+                    loss_train += train_loss.item()
+
+                loss_list_train.append(loss_train)
+                loss_list_val.append(loss_val)
+
+                training_status = "Epoch {epoch}, Training loss {train_loss}, Validation loss {val_loss}, Overfit counter = {overfit}". \
+                    format(time=datetime.datetime.now(), epoch=epoch, train_loss=loss_train, val_loss=loss_val,
+                           overfit=overfit_counter)
+                logging.info(training_status)
+
+                writer.append_loss(path + 'loss.out', loss_train)
+                writer.append_loss(path + 'loss_val.out', loss_val)
+
+                # in case the maximum number of epochs is reached, save the final state
+                if epoch == self.epochs:
+                    with timer.section('checkpoint'):
+                        writer.save(checkpoint.snapshot(self.model), path + 'trained_nn.pt')
+                        save_checkpoint(epoch, done=True)
+                    save_telemetry(timer, epoch, writer_busy)
+                    break
+
+                # check whether the network is overfitting by increasing the overfit_counter by one if the
+                # validation loss increases during the epoch.
+                if epoch > 20:
+                    if loss_val > min(loss_list_val):
+                        overfit_counter += 1
+                    else:
+                        overfit_counter = 0
+
+                if overfit_counter == self.patience:
+                    stopping_point = epoch - self.patience
+                    logging.info("Stopping point reached! Overfit counter = {}".format(overfit_counter))
+                    with timer.section('checkpoint'):
+                        writer.save(states[stopping_point], path + 'trained_nn.pt')
+                        save_checkpoint(epoch, done=True)
+                    save_telemetry(timer, epoch, writer_busy)
+                    logging.info("Backwards stopping done")
+                    break
+
+                if self.resume_stride and epoch % self.resume_stride == 0:
+                    with timer.section('checkpoint'):
+                        save_checkpoint(epoch)
+                save_telemetry(timer, epoch, writer_busy)
+
+                loss_val_old = loss_val
+                iterations += 1
+        finally:
+            writer.close()
         logging.info("Finished training")
 
     def weight_reset(self, m):
@@ -641,3 +1015,81 @@ class Fitter:
 
         # average over all the losses in the batch
         return torch.mean(loss, dim=0)
+
+
+def load_sm_sample(run_options, mc_run):
+    """
+    Loads the SM training sample of replica ``mc_run`` as specified in the run card
+
+    Parameters
+    ----------
+    run_options: dict
+        Run card
+    mc_run: int
+        Replica number
+
+    Returns
+    -------
+    df_sm: pandas.DataFrame
+        Sampled SM events
+    xsec_sm: float
+        SM cross-section, after cuts if the run card has any
+    rows_sm: numpy.ndarray
+        Positions of the sampled events in the SM event file
+    """
+    path_sm = os.path.join(run_options['event_data'], run_options['process_id'] + '_sm/events_{}.pkl.gz'.format(mc_run))
+    cuts = CutFlow.from_config(run_options)
+    return event_store.sample_events(path_sm, run_options['n_dat'], run_options['features'],
+                                     run_options.get('dtype'), cuts=cuts, return_rows=True)
+
+
+class MultiFitter:
+    """
+    Trains the ratio functions of several EFT coefficients in one process, sharing the SM sample of each replica
+    """
+
+    def __init__(self, json_path, mc_runs, output_dir, c_names=None, print_log=False, resume=False):
+        """
+        MultiFitter constructor
+
+        For every replica, the SM events are read and sampled once and passed to a :class:`Fitter` per coefficient,
+        which only loads its own EFT sample. The scaler is still fitted per coefficient, since it is fitted on the SM
+        and EFT events together. The models are stored in the same ``model_<c_name>/mc_run_<rep>`` layout as with
+        separate fits. With a ``streaming`` run card, every :class:`Fitter` streams its own SM and EFT shards instead.
+
+        Parameters
+        ----------
+        json_path: str
+            Path to json run card
+        mc_runs: array_like
+            Replica numbers
+        output_dir: str
+            Path to where the models should be stored
+        c_names: array_like, optional
+            EFT coefficients for which to learn the ratio function, e.g. ``['ctGRe', 'ctGRe_ctj8']``. By default all
+            linear and quadratic terms of the coefficients in ``c_train``.
+        print_log: bool, optional
+            Set to true to print training progress to stdout, otherwise it
+            prints to a log file only
+        resume: bool, optional
+            Set to true to continue every fit from its most recent checkpoint, see :class:`Fitter`
+
+        Examples
+        --------
+        Train replica 0 of the :math:`c_{tG}` and :math:`c_{tj}^{(8)}` linear, quadratic and cross terms
+
+        >>> MultiFitter('run_card.json', [0], 'models/example_models')
+        """
+        with open(json_path) as json_data:
+            self.run_options = json.load(json_data)
+
+        if c_names is None:
+            coeffs = list(self.run_options['c_train'])
+            c_names = coeffs + ['{}_{}'.format(c1, c2) for i, c1 in enumerate(coeffs) for c2 in coeffs[i:]]
+        self.c_names = list(c_names)
+
+        for mc_run in mc_runs:
+            # streaming fits read the SM shards while training, there is no sample to share
+            sm_sample = None if self.run_options.get('streaming') else load_sm_sample(self.run_options, mc_run)
+            for c_name in self.c_names:
+                Fitter(json_path, mc_run, c_name, output_dir, print_log=print_log, sm_sample=sm_sample, resume=resume)
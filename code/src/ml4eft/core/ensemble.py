@@ -0,0 +1,623 @@
+"""
+Module to train an ensemble of replicas of the binary classifier at once as a single batched network
+"""
+
+import json
+import logging
+import math
+import os
+import sys
+import time
+import numpy as np
+import torch
+import torch.optim as optim
+from torch import nn
+
+from ml4eft.core import checkpoint
+from ml4eft.core.scalers import stack as stack_scalers
+from ml4eft.core.classifier import ConstraintActivation, EventDataset, PreProcessing
+
+
+class EnsembleMLP(nn.Module):
+    """
+    ``n_replicas`` independent :class:`ml4eft.core.classifier.MLP` networks with stacked weights
+
+    The weights of layer ``k`` are stored as a ``(n_replicas, n_in, n_out)`` tensor, such that a forward pass of all
+    replicas is a single batched matrix multiplication per layer.
+    """
+
+    def __init__(self, architecture, n_replicas):
+        """
+        EnsembleMLP constructor
+
+        Parameters
+        ----------
+        architecture: array_like
+            Number of input nodes, hidden nodes per hidden layer and output units, as for
+            :class:`ml4eft.core.classifier.MLP`
+        n_replicas: int
+            Number of replicas
+        """
+        super().__init__()
+
+        self.architecture = list(architecture)
+        self.n_replicas = n_replicas
+
+        self.weights = nn.ParameterList()
+        self.biases = nn.ParameterList()
+        for n_in, n_out in zip(self.architecture[:-1], self.architecture[1:]):
+            self.weights.append(nn.Parameter(torch.empty(n_replicas, n_in, n_out)))
+            self.biases.append(nn.Parameter(torch.empty(n_replicas, 1, n_out)))
+
+        for replica in range(n_replicas):
+            self.reset_replica(replica)
+
+    @torch.no_grad()
+    def reset_replica(self, replica):
+        """
+        Re-initialises the weights of one replica with the default initialisation of ``torch.nn.Linear``
+
+        Parameters
+        ----------
+        replica: int
+            Replica index
+        """
+        for weight, bias in zip(self.weights, self.biases):
+            bound = 1 / math.sqrt(weight.shape[1])
+            weight[replica].uniform_(-bound, bound)
+            bias[replica].uniform_(-bound, bound)
+
+    def forward(self, x):
+        """
+        Performs a forward pass of all replicas
+
+        Parameters
+        ----------
+        x: torch.Tensor
+            ``(n_replicas, n_events, n_in)`` input, each replica gets its own events
+
+        Returns
+        -------
+        torch.Tensor
+            ``(n_replicas, n_events, n_out)`` output
+        """
+        n_layers = len(self.weights)
+        for i, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            x = torch.baddbmm(bias, x, weight)
+            if i < n_layers - 1:
+                x = torch.relu(x)
+        return x
+
+
+class EnsembleClassifier(nn.Module):
+    """
+    Batched counterpart of :class:`ml4eft.core.classifier.Classifier` for ``n_replicas`` replicas
+    """
+
+    def __init__(self, architecture, c, n_replicas):
+        super().__init__()
+        self.c = c
+        self.n_alpha = EnsembleMLP(architecture, n_replicas)
+        self.constraint = ConstraintActivation(self.c)
+
+    def forward(self, x):
+        """
+        Computes the decision function of all replicas
+
+        Parameters
+        ----------
+        x: torch.Tensor
+            ``(n_replicas, n_events, n_in)`` input
+
+        Returns
+        -------
+        torch.Tensor
+            ``(n_replicas, n_events, 1)`` decision function
+        """
+        NN_out = self.constraint(self.n_alpha(x))
+        g = 1 / (1 + (1 + self.c * NN_out))
+        return g
+
+    def replica_state_dict(self, replica):
+        """
+        Returns the parameters of one replica as the ``state_dict`` of a :class:`ml4eft.core.classifier.Classifier`
+
+        Parameters
+        ----------
+        replica: int
+            Replica index
+
+        Returns
+        -------
+        dict
+            State dict that can be loaded into a :class:`ml4eft.core.classifier.Classifier` with the same architecture
+        """
+        state_dict = {}
+        for k, (weight, bias) in enumerate(zip(self.n_alpha.weights, self.n_alpha.biases)):
+            # linear layers sit at every other position in the MLP, interleaved with the ReLUs
+            state_dict['n_alpha.layers.{}.weight'.format(2 * k)] = weight[replica].detach().t().clone()
+            state_dict['n_alpha.layers.{}.bias'.format(2 * k)] = bias[replica, 0].detach().clone()
+        return state_dict
+
+    @torch.no_grad()
+    def load_replica_state_dict(self, replica, state_dict):
+        """
+        Loads the ``state_dict`` of a :class:`ml4eft.core.classifier.Classifier` into one replica
+
+        Parameters
+        ----------
+        replica: int
+            Replica index
+        state_dict: dict
+            State dict as returned by :meth:`replica_state_dict`
+        """
+        for k, (weight, bias) in enumerate(zip(self.n_alpha.weights, self.n_alpha.biases)):
+            weight[replica].copy_(state_dict['n_alpha.layers.{}.weight'.format(2 * k)].t())
+            bias[replica, 0].copy_(state_dict['n_alpha.layers.{}.bias'.format(2 * k)])
+
+
+class EnsembleLoader:
+    """
+    Minibatch iterator over ``(n_replicas, n_events, ...)`` tensors, shuffling the events of every replica separately
+    """
+
+    def __init__(self, tensors, batch_size, shuffle=False):
+        """
+        EnsembleLoader constructor
+
+        Parameters
+        ----------
+        tensors: array_like
+            Events, weights and labels as ``(n_replicas, n_events, ...)`` tensors
+        batch_size: int
+            Number of events per replica per minibatch, the last minibatch may be smaller
+        shuffle: bool, optional
+            Reshuffle the events of every replica at the start of every epoch
+        """
+        self.tensors = tuple(tensor.contiguous() for tensor in tensors)
+        self.batch_size = max(int(batch_size), 1)
+        self.shuffle = shuffle
+
+        self.n_replicas, self.n_events = self.tensors[0].shape[:2]
+
+    def __len__(self):
+        return (self.n_events + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        tensors = self.tensors
+        if self.shuffle:
+            perm = torch.argsort(torch.rand(self.n_replicas, self.n_events), dim=1)
+            rows = torch.arange(self.n_replicas).unsqueeze(-1)
+            tensors = tuple(tensor[rows, perm] for tensor in tensors)
+
+        for start in range(0, self.n_events, self.batch_size):
+            yield [tensor[:, start:start + self.batch_size] for tensor in tensors]
+
+
+class EnsembleEvaluator:
+    """
+    Evaluates the trained networks of many replicas of many EFT ratio functions as batched networks
+
+    The networks with the same architecture and scaler type are stacked into one :class:`EnsembleMLP` and one
+    scaler, see :func:`ml4eft.core.scalers.stack`, such that the events are rescaled for all networks at once and
+    passed through every layer of all networks in a single batched matrix multiplication, instead of one forward pass
+    per network.
+
+    On CPU, the batched matrix multiplication is slower than one matrix multiplication per network as soon as there are
+    more than about a hundred events, see ``benchmarks/bench_evaluate.py``, so by default the layers are only batched
+    on other devices, and on CPU the stacked weights are multiplied network by network.
+    """
+
+    def __init__(self, models, scalers, max_elements=2 ** 24, device=None, batched=None):
+        """
+        EnsembleEvaluator constructor
+
+        Parameters
+        ----------
+        models: array_like
+            Nested list with the trained :class:`ml4eft.core.classifier.Classifier` replicas of every ratio function,
+            all taking the same features as input
+        scalers: array_like
+            Nested list with the fitted :class:`ml4eft.core.scalers.Scaler` of every model in ``models``
+        max_elements: int, optional
+            Number of elements of the largest intermediate tensor, which sets how many events are evaluated at once
+        device: str or torch.device, optional
+            Device to evaluate on, e.g. ``cuda``. CPU by default
+        batched: bool, optional
+            Evaluate every layer of all networks in one batched matrix multiplication, by default only when
+            ``device`` is not the CPU
+        """
+        self.device = torch.device('cpu' if device is None else device)
+        self.batched = self.device.type != 'cpu' if batched is None else batched
+
+        self.n_functions = len(models)
+        self.n_replicas = max([len(replicas) for replicas in models], default=0)
+
+        # group the networks that can be stacked, keeping their position in the output
+        groups = {}
+        for i, (replicas, replica_scalers) in enumerate(zip(models, scalers)):
+            for j, (model, scaler) in enumerate(zip(replicas, replica_scalers)):
+                layers = [layer for layer in model.n_alpha.layers if isinstance(layer, nn.Linear)]
+                architecture = tuple([layer.in_features for layer in layers] + [layers[-1].out_features])
+                # scalers can be stacked when their parameters only differ in the number of features
+                scaler_shape = tuple(tuple(buffer.shape[:-1]) for buffer in scaler.buffers())
+                groups.setdefault((architecture, type(scaler), scaler_shape), []).append((i, j, layers, model.c,
+                                                                                          scaler))
+
+        self.groups = []
+        for (architecture, _, _), members in groups.items():
+            mlp = EnsembleMLP(architecture, len(members))
+            with torch.no_grad():
+                for k, (_, _, layers, _, _) in enumerate(members):
+                    for weight, bias, layer in zip(mlp.weights, mlp.biases, layers):
+                        weight[k].copy_(layer.weight.t())
+                        bias[k, 0].copy_(layer.bias)
+            mlp.requires_grad_(False).to(self.device)
+
+            # the constraint of every network, as in ConstraintActivation
+            c = torch.tensor([float(c) for _, _, _, c, _ in members]).view(-1, 1, 1)
+            self.groups.append({'index': ([member[0] for member in members], [member[1] for member in members]),
+                                'mlp': mlp,
+                                'scaler': stack_scalers([member[4] for member in members]).to(self.device),
+                                'sign': torch.sign(c).to(self.device),
+                                'inv_c': (1 / c).to(self.device)})
+
+        # the largest tensors are the hidden layers of all networks when batched, and the rescaled events otherwise
+        n_models = sum(len(group['index'][0]) for group in self.groups)
+        if self.batched:
+            width = max([max(group['mlp'].architecture) for group in self.groups], default=1)
+        else:
+            width = max([group['mlp'].architecture[0] for group in self.groups], default=1)
+        self.chunk_size = max(1, max_elements // max(n_models * width, 1))
+
+    @staticmethod
+    def _forward_each(mlp, x):
+        # the forward pass of EnsembleMLP, with one matrix multiplication per network
+        n_layers = len(mlp.weights)
+        out = []
+        for k in range(mlp.n_replicas):
+            y = x[k]
+            for i, (weight, bias) in enumerate(zip(mlp.weights, mlp.biases)):
+                y = torch.addmm(bias[k], y, weight[k])
+                if i < n_layers - 1:
+                    y = torch.relu(y)
+            out.append(y)
+        return torch.stack(out)
+
+    def evaluate(self, events):
+        """
+        Evaluates all networks
+
+        Parameters
+        ----------
+        events: torch.Tensor
+            ``(n_events, n_features)`` events, before rescaling
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(n_functions, n_replicas, n_events)`` output of :attr:`Classifier.n_alpha` of every replica of every
+            function, as ``float32``. Functions with fewer than ``n_replicas`` replicas are padded with NaN.
+        """
+        events = torch.as_tensor(events, dtype=torch.float64)
+        n_events = len(events)
+        out = torch.full((self.n_functions, self.n_replicas, n_events), float('nan'))
+
+        with torch.no_grad():
+            for start in range(0, n_events, self.chunk_size):
+                chunk = events[start:start + self.chunk_size].to(self.device)
+                for group in self.groups:
+                    n_models = group['mlp'].n_replicas
+
+                    # rescale the events for every network at once, and move the networks to the first dimension
+                    x = group['scaler'](chunk.repeat(1, n_models)).float()
+                    x = x.view(len(chunk), n_models, -1).transpose(0, 1)
+
+                    nn_out = group['mlp'](x) if self.batched else self._forward_each(group['mlp'], x)
+                    nn_out = group['sign'] * torch.relu(nn_out) - group['inv_c'] + group['sign'] * 1e-6
+                    out[group['index'][0], group['index'][1], start:start + len(chunk)] = nn_out[..., 0].cpu()
+
+        return out.numpy()
+
+
+class EnsembleFitter:
+    """
+    Trains several replicas of the binary classifier for one EFT coefficient in a single process
+
+    Every replica has its own data sample, scaler, early-stopping counter and optimizer state, and writes the same
+    ``mc_run_<rep>/`` artifacts as :class:`ml4eft.core.classifier.Fitter`. The replicas are stacked into one
+    :class:`EnsembleClassifier` and trained together with batched matrix multiplications. As the loss is a sum of
+    per-replica losses over disjoint parameters, and AdamW acts element-wise, this is equivalent to training the
+    replicas one by one with their own optimizer.
+    """
+
+    def __init__(self, json_path, mc_runs, c_name, output_dir, print_log=False):
+        """
+        EnsembleFitter constructor
+
+        Parameters
+        ----------
+        json_path: str
+            Path to the json run card, the same run card as for :class:`ml4eft.core.classifier.Fitter`, without
+            ``streaming``
+        mc_runs: array_like
+            Replica numbers to train
+        c_name: str
+            EFT coefficient for which to learn the ratio function
+        output_dir: str
+            Path to where the models should be stored
+        print_log: bool, optional
+            Set to true to print training progress to stdout, otherwise it
+            prints to a log file only
+
+        Examples
+        --------
+        Train replicas 0 to 24 of the :math:`c_{tG}` ratio
+
+        >>> EnsembleFitter('run_card.json', range(25), 'ctGRe', 'models/example_models')
+        """
+        with open(json_path) as json_data:
+            self.run_options = json.load(json_data)
+
+        if self.run_options.get('streaming'):
+            raise ValueError("EnsembleFitter holds all replicas in memory and does not support streaming, train "
+                             "streaming run cards with Fitter or MultiFitter")
+
+        self.c_name = c_name
+        self.process_id = self.run_options["process_id"]
+        self.lr = self.run_options["lr"]
+        self.n_batches = self.run_options["n_batches"]
+
+        self.loss_type = self.run_options['loss_type']
+        self.scaler_type = self.run_options['scaler_type']
+        self.patience = self.run_options['patience']
+        self.val_ratio = self.run_options['val_ratio']
+
+        self.c_train = self.run_options["c_train"]
+
+        self.n_dat = self.run_options['n_dat']
+        self.dtype = self.run_options.get('dtype')
+        self.cuts = self.run_options.get('cuts')
+        self.epochs = self.run_options['epochs']
+        self.checkpoint_stride = self.run_options.get('checkpoint_stride', 0)
+        self.scaler_chunk_size = self.run_options.get('scaler_chunk_size', 100000)
+        self.features = self.run_options['features']
+        self.network_size = [len(self.features)] + self.run_options['hidden_sizes'] + [
+            self.run_options['output_size']]
+        self.event_data_path = self.run_options['event_data']
+
+        self.quadratic = True if '_' in self.c_name else False
+        if self.quadratic:
+            c1, c2 = self.c_name.split('_')
+            self.c_train_value = self.c_train[c1] * self.c_train[c2]
+        else:
+            self.c_train_value = self.c_train[self.c_name]
+
+        self.mc_runs = list(mc_runs)
+        self.n_replicas = len(self.mc_runs)
+
+        output_dir = os.path.join(output_dir, time.strftime("%Y/%m/%d"))
+        self.model_path = os.path.join(output_dir, 'model_{}'.format(self.c_name))
+        self.mc_paths = [os.path.join(self.model_path, 'mc_run_{}/'.format(mc_run)) for mc_run in self.mc_runs]
+
+        for mc_path in self.mc_paths:
+            os.makedirs(mc_path, exist_ok=True)
+
+        self.model = EnsembleClassifier(self.network_size, self.c_train_value, self.n_replicas)
+
+        # one log file for the ensemble, next to the replica directories
+        log_path = os.path.join(self.model_path, 'logs')
+        os.makedirs(log_path, exist_ok=True)
+        log_file = os.path.join(log_path, 'training_ensemble_{}.log'.format(time.strftime("%H_%M_%S")))
+        handlers = [logging.FileHandler(log_file)]
+        if print_log:
+            handlers.append(logging.StreamHandler(sys.stdout))
+
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s [%(levelname)s] %(message)s",
+            handlers=handlers,
+            force=True
+        )
+
+        logging.info("Training {} replicas of {} in one ensemble".format(self.n_replicas, self.c_name))
+
+        data_train, data_val = self.load_data()
+
+        for mc_path in self.mc_paths:
+            with open(mc_path + 'run_card.json', 'w') as outfile:
+                json.dump(self.run_options, outfile)
+
+        self.train_classifier(data_train, data_val)
+
+    def load_data(self):
+        """
+        Loads, rescales and splits the data of every replica and stacks the replicas
+
+        Returns
+        -------
+        data_train: list
+            EFT and SM training sets, each as a tuple of ``(n_replicas, n_train, ...)`` events, weights and labels
+        data_val: list
+            EFT and SM validation sets, each as a tuple of ``(n_replicas, n_val, ...)`` events, weights and labels
+        """
+        datasets = []
+        for mc_run, mc_path in zip(self.mc_runs, self.mc_paths):
+            path_sm = os.path.join(self.event_data_path, self.process_id + '_sm/events_{}.pkl.gz'.format(mc_run))
+            path_eft = os.path.join(self.event_data_path,
+                                    self.process_id + '_{}/events_{}.pkl.gz'.format(self.c_name, mc_run))
+
+            preproc = PreProcessing(self, {'sm': path_sm, 'eft': path_eft})
+            df_sm_scaled, df_eft_scaled = preproc.feature_scaling(self, os.path.join(mc_path, 'scaler.gz'))
+
+            datasets.append([EventDataset(df_eft_scaled, xsec=preproc.xsec_eft, path=path_eft, n_dat=self.n_dat,
+                                          features=self.features, hypothesis=0),
+                             EventDataset(df_sm_scaled, xsec=preproc.xsec_sm, path=path_sm, n_dat=self.n_dat,
+                                          features=self.features, hypothesis=1)])
+
+        # the replicas are stacked, so they need the same number of events. This only drops events when a sample
+        # has fewer than n_dat events, e.g. after cuts
+        self.n_dat = min(len(dataset) for replica in datasets for dataset in replica)
+        n_val_points = int(self.val_ratio * self.n_dat)
+        n_train_points = self.n_dat - n_val_points
+
+        split = {'train': [[], []], 'val': [[], []]}
+        for replica in datasets:
+            for i, dataset in enumerate(replica):  # i=0: eft, i=1: sm
+                indices = torch.randperm(len(dataset))[:self.n_dat]
+                split['train'][i].append(dataset.subset(indices[:n_train_points]).tensors)
+                split['val'][i].append(dataset.subset(indices[n_train_points:]).tensors)
+
+        def stack(replicas):
+            return tuple(torch.stack([tensors[i] for tensors in replicas]) for i in range(3))
+
+        data_train = [stack(replicas) for replicas in split['train']]
+        data_val = [stack(replicas) for replicas in split['val']]
+        return data_train, data_val
+
+    def train_classifier(self, data_train, data_val):
+        """
+        Starts the training of the ensemble
+
+        Parameters
+        ----------
+        data_train: list
+            EFT and SM training sets as returned by :meth:`load_data`
+        data_val: list
+            EFT and SM validation sets as returned by :meth:`load_data`
+        """
+        optimizer = optim.AdamW(self.model.parameters(), lr=self.lr)
+
+        train_loader = [EnsembleLoader(tensors, batch_size=int(tensors[0].shape[1] / self.n_batches), shuffle=True)
+                        for tensors in data_train]
+        val_loader = [EnsembleLoader(tensors, batch_size=int(tensors[0].shape[1] / self.n_batches), shuffle=False)
+                      for tensors in data_val]
+
+        self.training_loop(optimizer, train_loader, val_loader)
+
+    def loss_fn(self, outputs, labels, w_e):
+        """
+        Loss function per replica
+
+        Parameters
+        ----------
+        outputs: torch.Tensor
+            ``(n_replicas, n_events, 1)`` output of the decision function
+        labels: torch.Tensor
+            ``(n_replicas, n_events, 1)`` classification labels
+        w_e: torch.Tensor
+            ``(n_replicas, n_events, 1)`` event weights
+
+        Returns
+        -------
+        torch.Tensor
+            ``(n_replicas,)`` average loss of the mini-batch of every replica
+        """
+        if self.loss_type == 'CE':
+            loss = - (1 - labels) * w_e * torch.log(1 - outputs) - labels * w_e * torch.log(outputs)
+        elif self.loss_type == 'QC':
+            loss = (1 - labels) * w_e * outputs ** 2 + labels * w_e * (1 - outputs) ** 2
+
+        return torch.mean(loss, dim=(1, 2))
+
+    def training_loop(self, optimizer, train_loader, val_loader):
+        """
+        Optimizes all replicas at once, with early stopping per replica
+
+        Replicas that have stopped keep being updated along with the others, which leaves the remaining replicas
+        unaffected, but their artifacts are no longer written. Checkpoints are handled as in
+        :meth:`ml4eft.core.classifier.Fitter.training_loop`.
+
+        Parameters
+        ----------
+        optimizer: torch.optim
+            Optimizer, e.g. torch.optim.AdamW
+        train_loader: array_like
+            EFT and SM :class:`EnsembleLoader` objects (training)
+        val_loader: array_like
+            EFT and SM :class:`EnsembleLoader` objects (validation)
+        """
+        loss_list_train = np.zeros((0, self.n_replicas))
+        loss_list_val = np.zeros((0, self.n_replicas))
+
+        overfit_counter = np.zeros(self.n_replicas, dtype=int)
+        active = np.ones(self.n_replicas, dtype=bool)
+
+        for mc_path in self.mc_paths:
+            for loss_file in ['loss.out', 'loss_val.out']:
+                open(mc_path + loss_file, 'w').close()
+
+        # replica states at the start of the last patience + 1 epochs, and the writer of all files
+        states = [checkpoint.StateBuffer(self.patience + 1) for _ in range(self.n_replicas)]
+        writer = checkpoint.CheckpointWriter()
+
+        # close the writer also when training fails, such that queued files are written and its errors raised
+        try:
+            for epoch in range(1, self.epochs + 1):
+
+                # check for plateau per replica
+                if len(loss_list_train) > 10:
+                    for replica in np.flatnonzero(active & (loss_list_train[1] == loss_list_train[-1])):
+                        logging.info("Detected stagnant training of replica {}, reset the weights".format(
+                            self.mc_runs[replica]))
+                        self.model.n_alpha.reset_replica(replica)
+
+                loss_train = np.zeros(self.n_replicas)
+                loss_val = np.zeros(self.n_replicas)
+
+                # keep the model parameters at the start of each epoch
+                for replica in np.flatnonzero(active):
+                    states[replica].append(epoch, self.model.replica_state_dict(replica))
+                    if self.checkpoint_stride and epoch % self.checkpoint_stride == 0:
+                        writer.save(states[replica][epoch], self.mc_paths[replica] + 'trained_nn_{}.pt'.format(epoch))
+
+                with torch.no_grad():
+                    for minibatch in zip(*val_loader):
+                        for event, weight, label in minibatch:
+                            output = self.model(event.float())
+                            loss_val += self.loss_fn(output, label, weight).numpy()
+
+                for minibatch in zip(*train_loader):
+                    train_loss = torch.zeros(self.n_replicas)
+                    for event, weight, label in minibatch:  # eft, sm
+                        output = self.model(event.float())
+                        train_loss = train_loss + self.loss_fn(output, label, weight)
+
+                    optimizer.zero_grad()
+                    train_loss.sum().backward()
+                    optimizer.step()
+
+                    loss_train += train_loss.detach().numpy()
+
+                loss_list_train = np.vstack([loss_list_train, loss_train])
+                loss_list_val = np.vstack([loss_list_val, loss_val])
+
+                logging.info("Epoch {}, {} active replicas, median training loss {}, median validation loss {}".format(
+                    epoch, np.count_nonzero(active), np.median(loss_list_train[-1, active]),
+                    np.median(loss_list_val[-1, active])))
+
+                for replica in np.flatnonzero(active):
+                    writer.append_loss(self.mc_paths[replica] + 'loss.out', loss_train[replica])
+                    writer.append_loss(self.mc_paths[replica] + 'loss_val.out', loss_val[replica])
+
+                if epoch == self.epochs:
+                    for replica in np.flatnonzero(active):
+                        writer.save(self.model.replica_state_dict(replica), self.mc_paths[replica] + 'trained_nn.pt')
+                    break
+
+                if epoch > 20:
+                    increased = loss_list_val[-1] > loss_list_val.min(axis=0)
+                    overfit_counter = np.where(increased, overfit_counter + 1, 0)
+
+                for replica in np.flatnonzero(active & (overfit_counter == self.patience)):
+                    stopping_point = epoch - self.patience
+                    logging.info("Replica {}: stopping point reached at epoch {}".format(self.mc_runs[replica],
+                                                                                       stopping_point))
+                    writer.save(states[replica][stopping_point], self.mc_paths[replica] + 'trained_nn.pt')
+                    active[replica] = False
+
+                if not active.any():
+                    break
+        finally:
+            writer.close()
+        logging.info("Finished training")
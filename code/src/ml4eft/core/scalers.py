@@ -0,0 +1,530 @@
+"""
+Module with torch implementations of the feature scalers, to rescale the inputs as the first layer of the network
+"""
+
+import copy
+import joblib
+import numpy as np
+import torch
+from sklearn import preprocessing
+from torch import nn
+
+# as in sklearn.preprocessing.QuantileTransformer
+BOUNDS_THRESHOLD = 1e-7
+CLIP_MIN = float(torch.special.ndtri(torch.tensor(BOUNDS_THRESHOLD - np.spacing(1), dtype=torch.float64)))
+CLIP_MAX = float(torch.special.ndtri(torch.tensor(1 - (BOUNDS_THRESHOLD - np.spacing(1)), dtype=torch.float64)))
+
+
+def _as_tensor(x):
+    if isinstance(x, torch.Tensor):
+        return x
+    return torch.tensor(np.asarray(x))
+
+
+def quantiles(x, q):
+    """
+    Returns the quantiles of every column of ``x`` with linear interpolation, as ``numpy.percentile``
+
+    Parameters
+    ----------
+    x: torch.Tensor
+        ``(N, n_features)`` data
+    q: torch.Tensor
+        ``(n_q,)`` quantiles in [0, 1]
+
+    Returns
+    -------
+    torch.Tensor
+        ``(n_q, n_features)`` quantiles
+    """
+    x_sorted, _ = torch.sort(x.double(), dim=0)
+    pos = q.double() * (len(x) - 1)
+    lower = pos.floor().long()
+    upper = torch.clamp(lower + 1, max=len(x) - 1)
+    frac = (pos - lower).unsqueeze(-1)
+    return x_sorted[lower] + frac * (x_sorted[upper] - x_sorted[lower])
+
+
+def interp(x, xp, fp):
+    """
+    Piecewise-linear interpolation of every row of ``x``, as ``numpy.interp`` per feature
+
+    Parameters
+    ----------
+    x: torch.Tensor
+        ``(n_features, N)`` points to evaluate
+    xp: torch.Tensor
+        ``(n_features, n_q)`` increasing x-coordinates of the nodes
+    fp: torch.Tensor
+        ``(n_q,)`` or ``(n_features, n_q)`` y-coordinates of the nodes
+
+    Returns
+    -------
+    torch.Tensor
+        ``(n_features, N)`` interpolated values, constant beyond the first and last node
+    """
+    fp = fp.expand_as(xp)
+    idx = torch.clamp(torch.searchsorted(xp, x.contiguous(), right=True), 1, xp.shape[-1] - 1)
+    x0, x1 = torch.gather(xp, 1, idx - 1), torch.gather(xp, 1, idx)
+    f0, f1 = torch.gather(fp, 1, idx - 1), torch.gather(fp, 1, idx)
+
+    dx = x1 - x0
+    slope = torch.where(dx > 0, (f1 - f0) / torch.where(dx > 0, dx, torch.ones_like(dx)), torch.zeros_like(dx))
+    y = f0 + slope * (x - x0)
+    y = torch.where(x < xp[:, :1], fp[:, :1], y)
+    return torch.where(x >= xp[:, -1:], fp[:, -1:], y)
+
+
+class QuantileSketch:
+    """
+    Streaming estimator of the quantiles of every feature, with memory bounded independently of the number of events
+
+    A KLL-style sketch: events enter a buffer at level 0, and whenever the buffer of level ``h`` is full it is sorted
+    and every other event, from a random offset, moves on to level ``h + 1`` with twice the weight. The capacities
+    shrink by a factor 2/3 per level below the top one, so the sketch holds at most about ``3 k`` events per feature.
+    All features share the compaction schedule and are processed at once.
+
+    The minimum and maximum are tracked exactly, and while fewer than ``k`` events have been seen all quantiles are
+    exact. Beyond that the error in the rank of an estimated quantile, as a fraction of all events, is of order
+    ``1 / k``. For ``k = 2048`` it is about :math:`10^{-3}` at :math:`10^6` to :math:`10^7` events, see
+    ``benchmarks/bench_scaler_fit.py``. This is more accurate than the 10k-event subsample of the sklearn
+    ``QuantileTransformer``, which has a rank error of order :math:`10^{-2}`.
+    """
+
+    def __init__(self, k=2048, random_state=None):
+        """
+        QuantileSketch constructor
+
+        Parameters
+        ----------
+        k: int, optional
+            Capacity of the top level, sets the accuracy
+        random_state: int or numpy.random.Generator, optional
+            Seed or generator for the compaction offsets
+        """
+        self.k = k
+        self.rng = np.random.default_rng(random_state)
+        self.levels = []
+        self.n = 0
+        self.min = None
+        self.max = None
+
+    def _capacity(self, level):
+        depth = len(self.levels) - 1 - level
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, x):
+        """
+        Adds a chunk of events to the sketch
+
+        Parameters
+        ----------
+        x: numpy.ndarray
+            ``(N, n_features)`` events
+        """
+        x = np.asarray(x, dtype=np.float64)
+        x = x.reshape(len(x), -1)
+        if not len(x):
+            return
+        self.n += len(x)
+        self.min = x.min(axis=0) if self.min is None else np.minimum(self.min, x.min(axis=0))
+        self.max = x.max(axis=0) if self.max is None else np.maximum(self.max, x.max(axis=0))
+
+        if not self.levels:
+            self.levels.append(x.copy())
+        else:
+            self.levels[0] = np.concatenate([self.levels[0], x])
+
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty((0, items.shape[1])))
+                items = np.sort(items, axis=0)
+
+                # an odd event out stays at its level, the others are halved
+                n_even = len(items) - len(items) % 2
+                offset = self.rng.integers(2)
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[offset:n_even:2]])
+                self.levels[level] = items[n_even:]
+            level += 1
+
+    def quantiles(self, q):
+        """
+        Returns the estimated quantiles of every feature, with linear interpolation as ``numpy.percentile``
+
+        Parameters
+        ----------
+        q: array_like
+            ``(n_q,)`` quantiles in [0, 1]
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(n_q, n_features)`` quantiles
+        """
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level) for level, items in enumerate(self.levels)])
+
+        order = np.argsort(items, axis=0)
+        items = np.take_along_axis(items, order, axis=0)
+        cum_weights = np.cumsum(weights[order], axis=0)
+
+        # an event of weight w stands for w events, centred at this rank, and the extremes are known exactly
+        ranks = cum_weights - (weights[order] + 1) / 2
+        ranks = np.concatenate([np.zeros((1, ranks.shape[1])), ranks, np.full((1, ranks.shape[1]), self.n - 1)])
+        items = np.concatenate([self.min[None], items, self.max[None]])
+        target = np.asarray(q, dtype=np.float64) * (self.n - 1)
+        return np.column_stack([np.interp(target, ranks[:, i], items[:, i]) for i in range(items.shape[1])])
+
+
+def _new_sketch():
+    # seeded from torch, like the subsample of the exact fit, so that torch.manual_seed makes fits reproducible
+    return QuantileSketch(random_state=torch.randint(2 ** 31, ()).item())
+
+
+class Scaler(nn.Module):
+    """
+    Base class of the feature scalers
+
+    The fitted parameters are buffers, so they are part of the ``state_dict`` and are saved along with a network the
+    scaler is part of, e.g. ``nn.Sequential(scaler, model.n_alpha)``. Like the sklearn scalers, a scaler can be
+    fitted and applied to DataFrames or arrays through :meth:`fit` and :meth:`transform`.
+    """
+
+    def fit(self, x):
+        """
+        Fits the scaler
+
+        Parameters
+        ----------
+        x: torch.Tensor, numpy.ndarray or pandas.DataFrame
+            ``(N, n_features)`` data
+
+        Returns
+        -------
+        self
+        """
+        self._stream = None
+        self._stale = False
+        with torch.no_grad():
+            self._fit(_as_tensor(x))
+        return self
+
+    def _fit(self, x):
+        raise NotImplementedError
+
+    def partial_fit(self, x):
+        """
+        Updates the fit with a chunk of the data, such that the scaler can be fitted in one pass over chunks with
+        bounded memory
+
+        The fitted parameters are only computed from the accumulated chunks when they are next used, e.g. by the
+        forward pass or the ``state_dict``, rather than after every chunk.
+
+        Parameters
+        ----------
+        x: torch.Tensor, numpy.ndarray or pandas.DataFrame
+            ``(N, n_features)`` chunk of the data
+
+        Returns
+        -------
+        self
+        """
+        self._partial_fit(np.asarray(x, dtype=np.float64))
+        self._stale = True
+        return self
+
+    def _partial_fit(self, x):
+        raise NotImplementedError
+
+    def _update_from_stream(self):
+        raise NotImplementedError
+
+    def _sync(self):
+        # computes the fitted parameters from the chunks passed to partial_fit since they were last computed
+        if getattr(self, '_stale', False):
+            with torch.no_grad():
+                self._update_from_stream()
+            self._stale = False
+
+    def __getstate__(self):
+        # the streaming state is only needed during the fit
+        self._sync()
+        state = super().__getstate__().copy()
+        state.pop('_stream', None)
+        state.pop('_stale', None)
+        return state
+
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        self._sync()
+        super()._save_to_state_dict(destination, prefix, keep_vars)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # the fitted parameters depend on the number of features, so take their shape from the state dict
+        for name, _ in self.named_buffers(recurse=False):
+            if prefix + name in state_dict:
+                setattr(self, name, torch.empty_like(state_dict[prefix + name]))
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def transform(self, x):
+        """
+        Rescales the features, as the ``transform`` method of the sklearn scalers
+
+        Parameters
+        ----------
+        x: torch.Tensor, numpy.ndarray or pandas.DataFrame
+            ``(N, n_features)`` data
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(N, n_features)`` rescaled data
+        """
+        with torch.no_grad():
+            return self(_as_tensor(x).double()).numpy()
+
+    def fit_transform(self, x):
+        return self.fit(x).transform(x)
+
+    @staticmethod
+    def from_sklearn(scaler):
+        """
+        Converts a fitted ``RobustScaler``, ``StandardScaler`` or ``QuantileTransformer`` from sklearn
+
+        Parameters
+        ----------
+        scaler: sklearn.base.TransformerMixin
+            Fitted sklearn scaler
+
+        Returns
+        -------
+        :class:`Scaler`
+            Equivalent torch scaler
+        """
+        if isinstance(scaler, preprocessing.RobustScaler):
+            torch_scaler = RobustScaler(scaler.quantile_range)
+            torch_scaler.center = _as_tensor(scaler.center_).double()
+            torch_scaler.scale = _as_tensor(scaler.scale_).double()
+        elif isinstance(scaler, preprocessing.StandardScaler):
+            torch_scaler = StandardScaler()
+            torch_scaler.mean = _as_tensor(scaler.mean_).double()
+            torch_scaler.scale = _as_tensor(scaler.scale_).double()
+        elif isinstance(scaler, preprocessing.QuantileTransformer):
+            if scaler.output_distribution != 'normal':
+                raise ValueError("Only quantile transformers to a normal distribution are supported")
+            torch_scaler = QuantileTransformer(scaler.n_quantiles_)
+            torch_scaler.quantiles = _as_tensor(scaler.quantiles_).double()
+        else:
+            raise TypeError("Cannot convert scaler of type {}".format(type(scaler).__name__))
+        return torch_scaler
+
+
+class RobustScaler(Scaler):
+    """
+    Subtracts the median and divides by the range between two percentiles, as ``sklearn.preprocessing.RobustScaler``
+    """
+
+    def __init__(self, quantile_range=(5, 95)):
+        """
+        RobustScaler constructor
+
+        Parameters
+        ----------
+        quantile_range: tuple, optional
+            Lower and upper percentile of the range to divide by
+        """
+        super().__init__()
+        self.quantile_range = tuple(quantile_range)
+        self.register_buffer('center', torch.zeros(0, dtype=torch.float64))
+        self.register_buffer('scale', torch.ones(0, dtype=torch.float64))
+
+    def _fit(self, x):
+        q_min, q_max = self.quantile_range
+        self._set_quantiles(*quantiles(x, torch.tensor([0.5, q_min / 100, q_max / 100])))
+
+    def _partial_fit(self, x):
+        if getattr(self, '_stream', None) is None:
+            self._stream = _new_sketch()
+        self._stream.update(x)
+
+    def _update_from_stream(self):
+        q_min, q_max = self.quantile_range
+        self._set_quantiles(*torch.from_numpy(self._stream.quantiles([0.5, q_min / 100, q_max / 100])))
+
+    def _set_quantiles(self, center, lower, upper):
+        scale = upper - lower
+        self.center = center
+        self.scale = torch.where(scale == 0, torch.ones_like(scale), scale)
+
+    def forward(self, x):
+        self._sync()
+        return (x - self.center.to(x.dtype)) / self.scale.to(x.dtype)
+
+
+class StandardScaler(Scaler):
+    """
+    Subtracts the mean and divides by the standard deviation, as ``sklearn.preprocessing.StandardScaler``
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.register_buffer('mean', torch.zeros(0, dtype=torch.float64))
+        self.register_buffer('scale', torch.ones(0, dtype=torch.float64))
+
+    def _fit(self, x):
+        x = x.double()
+        self.mean = x.mean(dim=0)
+        scale = x.std(dim=0, correction=0)
+        self.scale = torch.where(scale == 0, torch.ones_like(scale), scale)
+
+    def _partial_fit(self, x):
+        # exact running mean and variance, combined chunk by chunk
+        n, mean, m2 = getattr(self, '_stream', None) or (0, 0.0, 0.0)
+        n_x, mean_x = len(x), x.mean(axis=0)
+        m2_x = ((x - mean_x) ** 2).sum(axis=0)
+
+        delta = mean_x - mean
+        n_tot = n + n_x
+        mean = mean + delta * n_x / n_tot
+        m2 = m2 + m2_x + delta ** 2 * n * n_x / n_tot
+        self._stream = (n_tot, mean, m2)
+
+    def _update_from_stream(self):
+        n_tot, mean, m2 = self._stream
+        scale = torch.from_numpy(np.sqrt(m2 / n_tot))
+        self.mean = torch.from_numpy(np.asarray(mean, dtype=np.float64))
+        self.scale = torch.where(scale == 0, torch.ones_like(scale), scale)
+
+    def forward(self, x):
+        self._sync()
+        return (x - self.mean.to(x.dtype)) / self.scale.to(x.dtype)
+
+
+class QuantileTransformer(Scaler):
+    """
+    Maps every feature onto a standard normal distribution through its empirical quantiles, as
+    ``sklearn.preprocessing.QuantileTransformer(output_distribution='normal')``
+
+    The cumulative distribution is interpolated linearly between ``n_quantiles`` quantiles and mapped to the normal
+    distribution with the inverse normal CDF. The map is evaluated in double precision.
+    """
+
+    def __init__(self, n_quantiles=1000, subsample=10000):
+        """
+        QuantileTransformer constructor
+
+        Parameters
+        ----------
+        n_quantiles: int, optional
+            Number of quantiles
+        subsample: int, optional
+            Maximum number of events to estimate the quantiles from, as in sklearn. Set to ``None`` to use all events.
+        """
+        super().__init__()
+        self.n_quantiles = n_quantiles
+        self.subsample = subsample
+        self.register_buffer('quantiles', torch.zeros(n_quantiles, 0, dtype=torch.float64))
+
+    @property
+    def references(self):
+        self._sync()
+        return torch.linspace(0, 1, len(self.quantiles), dtype=torch.float64, device=self.quantiles.device)
+
+    def _fit(self, x):
+        if self.subsample is not None and len(x) > self.subsample:
+            x = x[torch.randperm(len(x))[:self.subsample]]
+        n_quantiles = min(self.n_quantiles, len(x))
+        q = torch.linspace(0, 1, n_quantiles, dtype=torch.float64)
+        # enforce monotonicity against rounding, as sklearn does
+        self.quantiles = torch.cummax(quantiles(x, q), dim=0).values
+
+    def _partial_fit(self, x):
+        # all events enter the sketch, there is no need to subsample
+        if getattr(self, '_stream', None) is None:
+            self._stream = _new_sketch()
+        self._stream.update(x)
+
+    def _update_from_stream(self):
+        q = np.linspace(0, 1, min(self.n_quantiles, self._stream.n))
+        self.quantiles = torch.cummax(torch.from_numpy(self._stream.quantiles(q)), dim=0).values
+
+    def forward(self, x):
+        self._sync()
+        dtype = x.dtype
+        x = x.double().t()
+        xp = self.quantiles.t().contiguous()
+        ref = self.references
+
+        # average of the interpolation from both sides, to handle repeated quantiles as sklearn does
+        cdf = 0.5 * (interp(x, xp, ref) - interp(-x, -xp.flip(1), -ref.flip(0)))
+        cdf = torch.where(x + BOUNDS_THRESHOLD > xp[:, -1:], torch.ones_like(cdf), cdf)
+        cdf = torch.where(x - BOUNDS_THRESHOLD < xp[:, :1], torch.zeros_like(cdf), cdf)
+
+        y = torch.clamp(torch.special.ndtri(cdf), CLIP_MIN, CLIP_MAX)
+        return y.t().to(dtype)
+
+
+def make_scaler(scaler_type):
+    """
+    Returns an unfitted scaler of the type given in the ``scaler_type`` entry of a run card
+
+    Parameters
+    ----------
+    scaler_type: str
+        ``robust``, ``standardise`` or anything else for a quantile transformer
+
+    Returns
+    -------
+    :class:`Scaler`
+        Scaler
+    """
+    if scaler_type == 'robust':
+        return RobustScaler(quantile_range=(5, 95))
+    elif scaler_type == 'standardise':
+        return StandardScaler()
+    return QuantileTransformer(n_quantiles=1000)
+
+
+def load_scaler(path):
+    """
+    Loads a scaler saved with ``joblib``, converting sklearn scalers from earlier trainings to torch
+
+    Parameters
+    ----------
+    path: str
+        Path to the scaler, e.g. ``mc_run_0/scaler.gz``
+
+    Returns
+    -------
+    :class:`Scaler`
+        Torch scaler
+    """
+    scaler = joblib.load(path)
+    return scaler if isinstance(scaler, Scaler) else Scaler.from_sklearn(scaler)
+
+
+def stack(scalers):
+    """
+    Combines scalers of the same type into one scaler for the concatenated features of all of them
+
+    The fitted parameters are concatenated along the feature dimension, such that the returned scaler applies
+    ``scalers[m]`` to the ``m``-th block of features of ``x.repeat(1, len(scalers))``.
+
+    Parameters
+    ----------
+    scalers: array_like
+        Fitted scalers of the same type, and for quantile transformers with the same number of quantiles
+
+    Returns
+    -------
+    :class:`Scaler`
+        Stacked scaler
+    """
+    for scaler in scalers:
+        scaler._sync()
+    stacked = copy.deepcopy(scalers[0])
+    for name, _ in stacked.named_buffers(recurse=False):
+        setattr(stacked, name, torch.cat([getattr(scaler, name) for scaler in scalers], dim=-1))
+    return stacked
@@ -0,0 +1,265 @@
+"""
+Module to stream minibatches from event stores that do not fit in memory
+"""
+
+import collections
+import queue
+import threading
+import numpy as np
+import torch
+
+from ml4eft.preproc import event_store
+from ml4eft.preproc.cuts import CutFlow
+
+# a range of rows of an event store, the unit in which events are read and shuffled
+Shard = collections.namedtuple('Shard', ['path', 'start', 'stop'])
+
+
+def make_shards(paths, chunk_size, n_max=None, val_ratio=0.0):
+    """
+    Splits event stores into shards of at most ``chunk_size`` rows, for training and validation
+
+    The first ``1 - val_ratio`` of the rows of every store are used for training, the rest for validation. The events
+    in a store are not ordered, so this is a random split.
+
+    Parameters
+    ----------
+    paths: array_like
+        Paths to the event stores, e.g. as returned by :func:`ml4eft.preproc.event_store.find_shards`
+    chunk_size: int
+        Number of rows per shard
+    n_max: int, optional
+        Maximum number of rows, taken from the stores in order. All rows by default
+    val_ratio: float, optional
+        Fraction of the rows of every store that is used for validation
+
+    Returns
+    -------
+    shards_train: list
+        :class:`Shard` objects with the training rows
+    shards_val: list
+        :class:`Shard` objects with the validation rows
+    """
+    shards_train, shards_val = [], []
+    n_left = np.inf if n_max is None else n_max
+    for path in paths:
+        n_events = int(min(event_store.EventStore(path).n_events, n_left))
+        n_left -= n_events
+        n_train = n_events - int(val_ratio * n_events)
+
+        for shards, start, stop in [(shards_train, 0, n_train), (shards_val, n_train, n_events)]:
+            shards.extend(Shard(path, first, min(first + chunk_size, stop)) for first in range(start, stop, chunk_size))
+
+    return shards_train, shards_val
+
+
+def read_shard(shard, features, cuts=None):
+    """
+    Reads the events of a shard that pass the cuts
+
+    Parameters
+    ----------
+    shard: :class:`Shard`
+        Rows to read
+    features: array_like
+        Features to return
+    cuts: :class:`ml4eft.preproc.cuts.CutFlow`, optional
+        Event selection
+
+    Returns
+    -------
+    torch.Tensor
+        ``(N, n_features)`` events in double precision
+    """
+    columns = list(features) if cuts is None else list(features) + [c for c in cuts.columns if c not in features]
+    events = event_store.EventStore(shard.path).read(columns, rows=np.arange(shard.start, shard.stop))
+    if cuts is not None:
+        events = events[cuts.mask(events)]
+    return torch.from_numpy(events[list(features)].to_numpy(dtype=np.float64, copy=True))
+
+
+def scan(shards, features, cuts=None, scaler=None):
+    """
+    Counts the events of every shard that pass the cuts in one pass, optionally fitting a scaler on them
+
+    Parameters
+    ----------
+    shards: array_like
+        :class:`Shard` objects
+    features: array_like
+        Features to fit the scaler on
+    cuts: array_like, optional
+        Selection strings, see :class:`ml4eft.preproc.cuts.CutFlow`
+    scaler: :class:`ml4eft.core.scalers.Scaler`, optional
+        Scaler to update with :meth:`ml4eft.core.scalers.Scaler.partial_fit`
+
+    Returns
+    -------
+    numpy.ndarray
+        Number of events per shard after cuts
+    """
+    cuts = CutFlow(cuts) if cuts else None
+    n_pass = []
+    for shard in shards:
+        events = read_shard(shard, features, cuts)
+        if scaler is not None and len(events):
+            scaler.partial_fit(events.numpy())
+        n_pass.append(len(events))
+    return np.array(n_pass)
+
+
+def cross_section(shards, n_pass):
+    """
+    Returns the cross-section after cuts of the events in ``shards``
+
+    Parameters
+    ----------
+    shards: array_like
+        :class:`Shard` objects
+    n_pass: array_like
+        Number of events per shard after cuts, as returned by :func:`scan`
+
+    Returns
+    -------
+    float
+        Average of the cross-sections of the stores, weighted by their number of rows, times the cut efficiency
+    """
+    xsec = {path: event_store.EventStore(path).xsec for path in set(shard.path for shard in shards)}
+    n_rows = sum(shard.stop - shard.start for shard in shards)
+    return sum(xsec[shard.path] * n for shard, n in zip(shards, n_pass)) / n_rows
+
+
+class ShardStream:
+    """
+    Minibatch iterator over events that are read from event stores while iterating, in place of
+    :class:`ml4eft.core.classifier.TensorLoader` for samples that do not fit in memory
+
+    A background thread reads the shards, in a new random order every epoch when shuffling, applies the cuts and the
+    fitted scaler and fills a queue of ``prefetch`` minibatches. Shuffling across shards is approximated with a shuffle
+    buffer: events are drawn at random from a buffer of ``buffer_size`` events that is refilled shard by shard. At
+    most about ``buffer_size + chunk_size + prefetch * batch_size`` events are held in memory, whatever the number of
+    events in the stores.
+    """
+
+    def __init__(self, shards, features, xsec, hypothesis, batch_size, scaler=None, cuts=None, shuffle=False,
+                 buffer_size=1000000, prefetch=4):
+        """
+        ShardStream constructor
+
+        Parameters
+        ----------
+        shards: array_like
+            :class:`Shard` objects to read, see :func:`make_shards`
+        features: array_like
+            Features to train on
+        xsec: float
+            Cross-section after cuts, the weight of every event, see :func:`cross_section`
+        hypothesis: int
+            0 for EFT and 1 for SM
+        batch_size: int
+            Number of events per minibatch, the last minibatch may be smaller
+        scaler: :class:`ml4eft.core.scalers.Scaler`, optional
+            Fitted scaler applied to the events
+        cuts: array_like, optional
+            Selection strings, see :class:`ml4eft.preproc.cuts.CutFlow`
+        shuffle: bool, optional
+            Reshuffle the shards and events at the start of every epoch
+        buffer_size: int, optional
+            Number of events in the shuffle buffer
+        prefetch: int, optional
+            Number of minibatches to read ahead
+
+        Examples
+        --------
+        Iterate over the SM and EFT minibatches in pairs, as with :class:`ml4eft.core.classifier.TensorLoader`
+
+        >>> shards_train, shards_val = make_shards(event_store.find_shards('tt_sm/events_0'), chunk_size=100000)
+        >>> stream_sm = ShardStream(shards_train, features, xsec_sm, 1, batch_size=10000, scaler=scaler, shuffle=True)
+        >>> for minibatch in zip(stream_eft, stream_sm):
+        ...     for event, weight, label in minibatch:
+        ...         output = model(event)
+        """
+        self.shards = list(shards)
+        self.features = list(features)
+        self.xsec = xsec
+        self.hypothesis = hypothesis
+        self.batch_size = max(int(batch_size), 1)
+        self.scaler = scaler
+        self.cuts = cuts
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.prefetch = prefetch
+
+    def __iter__(self):
+        # drawn on the calling thread, such that torch.manual_seed and checkpoint.set_rng_state fix the order
+        seed = torch.randint(2 ** 62, ()).item() if self.shuffle else 0
+
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(batches, stop, seed), daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                item = batches.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # also reached when the consumer stops early, e.g. when zip runs out of the other stream
+            stop.set()
+            thread.join()
+
+    def _produce(self, batches, stop, seed):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for events in self._batches(torch.Generator().manual_seed(seed)):
+                weights = torch.full((len(events), 1), float(self.xsec))
+                labels = torch.full((len(events), 1), float(self.hypothesis))
+                if not put([events, weights, labels]):
+                    return
+            put(None)
+        except Exception as error:
+            put(error)
+
+    def _chunks(self, generator):
+        cuts = CutFlow(self.cuts) if self.cuts else None
+        order = torch.randperm(len(self.shards), generator=generator).tolist() if self.shuffle else range(
+            len(self.shards))
+
+        for i in order:
+            events = read_shard(self.shards[i], self.features, cuts)
+            with torch.no_grad():
+                events = self.scaler(events) if self.scaler is not None else events
+            yield events.float()
+
+    def _batches(self, generator):
+        buffer = torch.empty((0, len(self.features)))
+        for chunk in self._chunks(generator):
+            buffer = torch.cat([buffer, chunk])
+            if self.shuffle and len(buffer) < self.buffer_size:
+                continue
+
+            # draw whole minibatches at random, keeping half of the buffer to mix with the next shards
+            n_keep = self.buffer_size // 2 if self.shuffle else 0
+            n_out = (len(buffer) - n_keep) // self.batch_size * self.batch_size
+            if self.shuffle:
+                buffer = buffer[torch.randperm(len(buffer), generator=generator)]
+            for start in range(0, n_out, self.batch_size):
+                yield buffer[start:start + self.batch_size]
+            buffer = buffer[n_out:]
+
+        if self.shuffle:
+            buffer = buffer[torch.randperm(len(buffer), generator=generator)]
+        for start in range(0, len(buffer), self.batch_size):
+            yield buffer[start:start + self.batch_size]
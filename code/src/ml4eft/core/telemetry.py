@@ -0,0 +1,166 @@
+"""
+Module to record per-epoch timings, throughput and memory of the training, and to summarise them over many replicas
+"""
+
+import collections
+import contextlib
+import glob
+import json
+import os
+import resource
+import threading
+import time
+import pandas as pd
+import torch
+
+TELEMETRY = 'telemetry.jsonl'
+
+# time spent per epoch, in the order in which an epoch goes through them
+SECTIONS = ['data', 'forward', 'backward', 'optimizer', 'validation', 'checkpoint']
+
+
+class EpochTimer:
+    """
+    Accumulates the wall time spent in each section of an epoch
+    """
+
+    def __init__(self):
+        self.times = collections.defaultdict(float)
+        self.n_events = 0
+        self.t_start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def section(self, name):
+        """
+        Context manager that adds the time spent inside it to section ``name``
+        """
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - t_start
+
+    def timed(self, iterable, name='data'):
+        """
+        Iterates over ``iterable``, adding the time spent to fetch each item to section ``name``
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.section(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record(self, epoch, **kwargs):
+        """
+        Returns the record of the epoch so far
+
+        Parameters
+        ----------
+        epoch: int
+            Epoch number
+        kwargs: dict
+            Additional entries, e.g. the losses
+
+        Returns
+        -------
+        dict
+            Times per section in seconds, the total epoch time, the training events per second, the peak resident
+            memory in MB and the number of threads
+        """
+        t_epoch = time.perf_counter() - self.t_start
+        t_train = sum(self.times[name] for name in ['data', 'forward', 'backward', 'optimizer'])
+        record = {'epoch': epoch, 'time': t_epoch}
+        record.update({'time_' + name: self.times[name] for name in SECTIONS})
+        record.update({'events': self.n_events,
+                       'events_per_s': self.n_events / t_train if t_train > 0 else 0.0,
+                       'peak_rss_mb': peak_rss(),
+                       'torch_threads': torch.get_num_threads(),
+                       'threads': threading.active_count()})
+        record.update(kwargs)
+        return record
+
+
+def peak_rss():
+    """
+    Returns the peak resident memory of the process in MB
+    """
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def append_record(path, record):
+    """
+    Appends ``record`` as one JSON line to the file at ``path``
+    """
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def read_records(path):
+    """
+    Reads the records of a telemetry file
+
+    Epochs that are recorded more than once, when training was resumed from an earlier checkpoint, keep their last
+    record.
+
+    Parameters
+    ----------
+    path: str
+        Path to ``telemetry.jsonl``
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per epoch
+    """
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    df = pd.DataFrame(records)
+    if df.empty:
+        return df
+    return df.drop_duplicates('epoch', keep='last').sort_values('epoch').reset_index(drop=True)
+
+
+def summarize(model_path):
+    """
+    Summarises the telemetry of all replicas in a ``model_*/mc_run_*`` tree
+
+    Parameters
+    ----------
+    model_path: str
+        Directory containing the ``model_*`` directories, e.g. ``output_dir/YYYY/MM/DD``
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per model with the number of replicas and epochs, the total core-hours, the fraction of time spent in
+        each section and on writing files in the background, the mean training throughput and the largest peak
+        resident memory
+    """
+    rows = []
+    for model_dir in sorted(glob.glob(os.path.join(model_path, 'model_*'))):
+        runs = [read_records(path) for path in sorted(glob.glob(os.path.join(model_dir, 'mc_run_*', TELEMETRY)))]
+        runs = [run for run in runs if not run.empty]
+        if not runs:
+            continue
+        df = pd.concat(runs)
+
+        t_total = df['time'].sum()
+        row = {'model': os.path.basename(model_dir)[len('model_'):],
+               'replicas': len(runs),
+               'epochs': len(df),
+               'epochs_per_replica': len(df) / len(runs),
+               # every replica keeps torch_threads cores busy
+               'core_hours': (df['time'] * df['torch_threads']).sum() / 3600,
+               'time_per_epoch': t_total / len(df)}
+        row.update({'frac_' + name: df['time_' + name].sum() / t_total for name in SECTIONS})
+        # written on a background thread, so this overlaps with the other sections
+        row['frac_checkpoint_io'] = df['time_checkpoint_io'].sum() / t_total
+        row.update({'events_per_s': df['events_per_s'].mean(),
+                    'peak_rss_mb': df['peak_rss_mb'].max()})
+        rows.append(row)
+
+    return pd.DataFrame(rows)
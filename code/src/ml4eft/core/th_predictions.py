@@ -4,9 +4,11 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import re
-import os
 import ml4eft.analyse.analyse as analyse
 from ml4eft.core.truth import tt_prod
+from ml4eft.core import binning
+from ml4eft.preproc.cuts import CutFlow
+from ml4eft.preproc import event_store
 from collections import defaultdict
 
 
@@ -15,7 +17,7 @@ class TheoryPred:
     SMEFT theory calculator
     """
 
-    def __init__(self, path_to_theory_pred, bins=None):
+    def __init__(self, path_to_theory_pred, bins=None, cuts=None):
         """
         TheoryPred Constructor
 
@@ -26,7 +28,11 @@ class TheoryPred:
             must be of the form {'sm': ``<path_to_sm_data>``, 'lin': {'c1': ``<path_to_c1_data>``, 'c2': ``<path_to_c2_data>`` },
             'quad': {'c1_c1': ``<path_to_c1_c1_data>``, 'c1_c2': ``<path_to_c1_c1_data>``, 'c2_c2': ``<path_to_c1_c1_data>``}}
         bins: dict, optional
-            Dictionary that specifies the binning per kinematic (keys)
+            Dictionary that specifies the binning per kinematic (keys). With more than two kinematics, the predictions
+            are stored as :class:`ml4eft.core.binning.SparseHistogram` that only keep the occupied bins.
+        cuts: array_like or :class:`ml4eft.preproc.cuts.CutFlow`, optional
+            Event selection, e.g. ``['pt_l1 > 25', 'abs(eta_l1) < 2.5']``. Predictions are then cross-sections after
+            cuts and the cut-flow of every replica is kept in `cut_tables`.
 
         Examples
         --------
@@ -48,8 +54,12 @@ class TheoryPred:
 
         self.path_to_theory_pred = path_to_theory_pred
         self.bins = bins
+        self.sparse = self.is_sparse(bins)
+        self.cuts = cuts if cuts is None or isinstance(cuts, CutFlow) else CutFlow(cuts)
         self.c_names = []
         self.th_dict = defaultdict(dict)
+        self.bin_indices = {}
+        self.cut_tables = {}
 
         self.build_theory_pred_df()
         self.c_names_unique = self.get_c_names_unique()
@@ -69,8 +79,7 @@ class TheoryPred:
                     xsec_eft = self.compute_th_pred(path_to_events)
 
                     # read EFT value at which the events have been generated
-                    with open(os.path.join(path_to_events, 'info.txt')) as f:
-                        c_value = np.array([int(c) for c in f.read().split()])
+                    c_value = event_store.read_c_value(path_to_events)
 
                     if order == 'lin':
                         self.th_dict[order][c_name] = (xsec_eft - self.th_dict['sm']) / c_value[0]
@@ -103,10 +112,67 @@ class TheoryPred:
         c_names = np.array(c_names)
         return np.unique(c_names)
 
+    @staticmethod
+    def is_sparse(bins):
+        """
+        Returns ``True`` when the binning has more than two kinematics, in which case the theory predictions are
+        stored sparsely
+        """
+        return bins is not None and len(bins) > 2
+
+    def load_bin_index(self, event_path, columns):
+        """
+        Returns the bin index of a replica if it exists and covers all ``columns``. Indices are kept in memory, such
+        that :meth:`rebin` does not touch the disk.
+
+        Parameters
+        ----------
+        event_path: str
+            Path to the replica event file
+        columns: array_like
+            Features the index must cover, i.e. the kinematics in `bins` and the features the cuts depend on
+
+        Returns
+        -------
+        :class:`ml4eft.core.binning.BinIndex` or None
+            Index of the replica, ``None`` when there is no usable index
+        """
+        if event_path not in self.bin_indices:
+            self.bin_indices[event_path] = binning.load_bin_index(event_path)
+
+        index = self.bin_indices[event_path]
+        if index is None or not all(kin in index.features for kin in columns):
+            return None
+        return index
+
+    def rebin(self, bins):
+        """
+        Recomputes the theory predictions for a new binning
+
+        Parameters
+        ----------
+        bins: dict
+            Dictionary that specifies the binning per kinematic (keys)
+
+        Examples
+        --------
+        With bin indices built by :func:`ml4eft.core.binning.build_tree`, scanning binnings does not reload the events
+
+        >>> for edges in [[0, 100, 200, 500], [0, 50, 100, 150, 200, 300, 500]]:
+        ...     th_predictor.rebin({'pt_ll': edges})
+        ...     th_predictor.th_dict['sm']
+        """
+        self.bins = bins
+        self.sparse = self.is_sparse(bins)
+        self.c_names = []
+        self.th_dict = defaultdict(dict)
+        self.build_theory_pred_df()
+
     def compute_th_pred(self, path_to_events):
         """
         Computes cross-section in the SMEFT for a given binning if specified in `bins`. Otherwise it returns an
-        average of the total cross section averaged over the available replicas.
+        average of the total cross section averaged over the available replicas. Replicas with a bin index, see
+        :func:`ml4eft.core.binning.build_bin_index`, are binned from the index without loading the events.
 
         Parameters
         ----------
@@ -115,33 +181,46 @@ class TheoryPred:
 
         Returns
         -------
-        array_like
+        array_like or :class:`ml4eft.core.binning.SparseHistogram`
             Cross section per bin averaged over the available replicas
         """
         # path to events
         events_paths = analyse.Analyse.get_event_paths(path_to_events)
 
+        # features needed for the binning and the event selection
+        columns = [] if self.bins is None else list(self.bins.keys())
+        columns += [] if self.cuts is None else self.cuts.columns
+
         # store the xsec per bin for all the replicas
         xsec_collected = []
         for path in events_paths:
-            events, tot_xsec = analyse.Analyse.load_events(event_path=path)
+
+            # bin and select from the sorted-column index of the replica when it covers the features
+            index = self.load_bin_index(path, columns) if columns else None
+            if index is not None:
+                events, tot_xsec = index, index.xsec
+            else:
+                events, tot_xsec = analyse.Analyse.load_events(event_path=path)
+
+            mask = None
+            if self.cuts is not None:
+                mask = self.cuts.mask(events)
+                self.cut_tables[path] = self.cuts.table(tot_xsec)
 
             if self.bins is None:
-                xsec_i = tot_xsec
+                xsec_i = tot_xsec if mask is None else self.cuts.xsec(tot_xsec)
+            elif index is not None:
+                xsec_i = index.xsec_per_bin(self.bins, self.sparse, mask)
             else:
                 n_tot = len(events)
-                if len(self.bins) == 1:
-                    kin, = self.bins.keys()
-                    x = events[kin].values
-                    n_i, _, = np.histogram(x, self.bins[kin])
-                elif len(self.bins) == 2:
-                    kin_1, kin_2 = self.bins.keys()
-                    x = events[kin_1].values
-                    y = events[kin_2].values
-                    n_i, _, _ = np.histogram2d(x, y, bins=(self.bins[kin_1], self.bins[kin_2]))
+                n_i = binning.histogram(events, self.bins, sparse=self.sparse, mask=mask)
                 xsec_i = (n_i / n_tot) * tot_xsec
 
             xsec_collected.append(xsec_i)
+
+        if self.sparse:
+            return sum(xsec_collected) / len(xsec_collected)
+
         xsec_collected = np.array(xsec_collected)
 
         # average over the replicas
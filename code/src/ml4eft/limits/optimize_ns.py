@@ -16,6 +16,8 @@ import itertools
 
 import ml4eft.analyse.analyse as analyse
 import ml4eft.core.th_predictions as theory_pred
+from ml4eft.core import binning
+from ml4eft.preproc.cuts import CutFlow
 
 # fix randomness
 np.random.seed(0)
@@ -110,8 +112,12 @@ class Optimize:
             )
             sys.exit()
 
+        # event selection applied to both the theory predictions and the observed data
+        self.cuts = CutFlow.from_config(self.config)
+
         self.th_pred = theory_pred.TheoryPred(self.path_to_theory_pred,
-                                              bins=self.bins)
+                                              bins=self.bins,
+                                              cuts=self.cuts)
 
         if self.coeff is None:
             self.glob = True
@@ -155,32 +161,42 @@ class Optimize:
         nu_tot_sm = xsec_sm_tot * config['lumi']
         n_tot_sm = np.random.poisson(nu_tot_sm, 1)
 
-        self.observed_data = sm_data.sample(int(n_tot_sm), random_state=1)
+        if self.cuts is None:
+            self.observed_data = sm_data.sample(int(n_tot_sm), random_state=1)
+        else:
+            passed = np.flatnonzero(self.cuts.mask(sm_data))
+            print("Observed data: {} out of {} events pass the cuts".format(len(passed), len(sm_data)))
+            rows = np.random.RandomState(1).choice(passed, int(n_tot_sm), replace=False)
+            self.observed_data = sm_data.iloc[np.sort(rows)]
 
         if self.mode == "nn":
 
-            # evaluated nn models on pseudo dataset
-            self.nn_analyser.evaluate_models(self.observed_data, rep=self.rep)
-            models_evaluated = self.nn_analyser.models_evaluated_df['models']
-
-            if self.rep is None:
-                # take median over models
-                self.nn_analyser.models_evaluated_df['models'] = models_evaluated.apply(
-                    lambda row: np.median(row, axis=0))
+            # evaluated nn models on pseudo dataset, taking the median over models on the fly when using all replicas
+            self.nn_analyser.evaluate_models(self.observed_data, rep=self.rep,
+                                             reduction='median' if self.rep is None else None)
 
         if self.mode == "truth":
             self.dsigma_dx = self.th_pred.compute_diff_coefficients(self)
 
         elif self.mode == "binned":
-            if len(self.bins) == 1:
-                kin, = self.bins.keys()
-                x = self.observed_data[kin].values
-                self.n_i, _, = np.histogram(x, self.bins[kin])
-            elif len(self.bins) == 2:
-                kin_1, kin_2 = self.bins.keys()
-                x = self.observed_data[kin_1].values
-                y = self.observed_data[kin_2].values
-                self.n_i, _, _ = np.histogram2d(x, y, bins=(self.bins[kin_1], self.bins[kin_2]))
+            # same bin conventions as the (indexed) theory predictions
+            self.n_i = binning.histogram(self.observed_data, self.bins, sparse=self.th_pred.sparse)
+            self.th_binned = self.th_pred.th_dict
+
+            if self.th_pred.sparse:
+                # restrict the likelihood to the bins that are occupied in the data or in any prediction, all other
+                # bins have nu_i = n_i = 0 and do not contribute
+                th_dict = self.th_pred.th_dict
+                hists = [self.n_i, th_dict['sm']] + list(th_dict['lin'].values())
+                hists += list(th_dict.get('quad', {}).values())
+                keys = binning.union_keys(hists)
+
+                self.n_i = self.n_i.align(keys)
+                self.th_binned = {order: th.align(keys) if order == 'sm' else
+                                  {c_name: th_c.align(keys) for c_name, th_c in th.items()}
+                                  for order, th in th_dict.items()}
+                print("Binned likelihood with {} occupied out of {} bins".format(len(keys),
+                                                                                 int(np.prod(th_dict['sm'].shape))))
 
     def my_prior(self, cube):
         """
@@ -326,17 +342,17 @@ class Optimize:
         # compute inclusive xsec at cube
 
         sigma = 0
-        sigma += self.th_pred.th_dict['sm']
+        sigma += self.th_binned['sm']
 
-        lin_pred = self.th_pred.th_dict['lin']
+        lin_pred = self.th_binned['lin']
 
         for c_name, c_val in self.param_names.items():
             if c_name in lin_pred:
                 sigma += c_val * lin_pred[c_name]
 
-        if 'quad' in self.th_pred.th_dict:
+        if 'quad' in self.th_binned:
 
-            quad_pred = self.th_pred.th_dict['quad']
+            quad_pred = self.th_binned['quad']
             for (c1, c2) in itertools.product(self.param_names.keys(), repeat=2):
                 c_name = '{}_{}'.format(c1, c2)
                 if c_name in quad_pred:
@@ -9,20 +9,22 @@ rc('font', **{'family': 'sans-serif', 'sans-serif': ['Helvetica'], 'size': 22})
 rc('text', usetex=True)
 
 
-def plot_features(df_sm, dfs_eft, features, legend_labels):
+def plot_features(df_sm, dfs_eft, features, legend_labels, engine=None):
     """
     Produces a plot showing the distribution of the training features
 
     Parameters
     ----------
-    df_sm: pd.DataFrame
-        Standard Model events
+    df_sm: pd.DataFrame or str
+        Standard Model events, or the path to a LHE file when ``engine`` is given
     dfs_eft: list
-        List of panda dataframes with EFT events
+        List of panda dataframes with EFT events, or of paths to LHE files when ``engine`` is given
     features: dict
         Of the form {'kinematic_feature': 'latex_string' }
     legend_labels: list
         List of legend elements
+    engine: :class:`ml4eft.preproc.feature_engine.FeatureEngine`, optional
+        Feature engine to compute the features in ``features`` from LHE files directly
 
 
     Returns
@@ -30,6 +32,11 @@ def plot_features(df_sm, dfs_eft, features, legend_labels):
     matplotlib.figure.Figure
         Figure showing the distribution of the kinematic features under the SM and the EFT
     """
+    if engine is not None:
+        df_sm = engine.read_lhe(df_sm, features.keys()) if isinstance(df_sm, str) else df_sm
+        dfs_eft = [engine.read_lhe(df_eft, features.keys()) if isinstance(df_eft, str) else df_eft
+                   for df_eft in dfs_eft]
+
     n_cols = 5
     n_rows = int(np.ceil(len(features) / n_cols))
     fig = plt.figure(figsize=(n_cols * 4, n_rows * 5))
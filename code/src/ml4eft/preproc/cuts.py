@@ -0,0 +1,242 @@
+"""
+Module to apply event selections as boolean masks over columnar events and to keep track of the cut-flow
+"""
+
+import logging
+import operator
+import re
+import numpy as np
+import pandas as pd
+
+_OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq,
+              '!=': operator.ne}
+
+# comparison with the operands swapped, e.g. 20 < pt_ll is evaluated as pt_ll > 20
+_SWAPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '==', '!=': '!='}
+
+_TERM = re.compile(r'^(abs\(\s*)?([A-Za-z_][A-Za-z0-9_]*)(?(1)\s*\))$')
+
+
+class Cut:
+    """
+    Single event selection on one or more feature columns
+    """
+
+    def __init__(self, name, columns, func):
+        """
+        Cut constructor, see :meth:`from_string` for the selections that can be specified in a run card
+
+        Parameters
+        ----------
+        name: str
+            Name of the cut as shown in the cut-flow
+        columns: array_like
+            Features the cut depends on
+        func: callable
+            Maps the ``(N,)`` arrays of ``columns`` to a ``(N,)`` boolean mask of the events that pass
+
+        Examples
+        --------
+        The physical region of the :math:`t\\bar{t}` rapidity at :math:`\\sqrt{s} = 14` TeV
+
+        >>> Cut('physical', ['y', 'm_tt'], lambda y, m_tt: np.abs(y) < np.log(np.sqrt(14e3 ** 2) / m_tt))
+        """
+        self.name = name
+        self.columns = list(columns)
+        self.func = func
+
+    @classmethod
+    def from_string(cls, expr):
+        """
+        Builds a cut from a (chained) comparison of a feature, or its absolute value, with numbers
+
+        Parameters
+        ----------
+        expr: str
+            Selection, e.g. ``pt_ll > 20``, ``abs(eta_l1) < 2.5`` or ``300 <= m_ll < 1000``
+
+        Returns
+        -------
+        :class:`ml4eft.preproc.cuts.Cut`
+            Cut object
+        """
+        parts = [part.strip() for part in re.split(r'(<=|>=|==|!=|<|>)', expr)]
+        operands, ops = parts[::2], parts[1::2]
+
+        terms = [i for i, operand in enumerate(operands) if _TERM.match(operand)]
+        if not ops or len(terms) != 1:
+            raise ValueError("Cut {} must compare exactly one feature with numbers".format(expr))
+
+        i_term = terms[0]
+        use_abs, column = _TERM.match(operands[i_term]).groups()
+
+        # rewrite every comparison as <feature> <op> <value>
+        comparisons = []
+        for i, op in enumerate(ops):
+            if i == i_term:
+                comparisons.append((op, float(operands[i + 1])))
+            elif i + 1 == i_term:
+                comparisons.append((_SWAPPED[op], float(operands[i])))
+            else:
+                raise ValueError("Cut {} must compare the feature directly".format(expr))
+
+        def func(x):
+            x = np.abs(x) if use_abs else np.asarray(x)
+            mask = np.ones(len(x), dtype=bool)
+            for op, value in comparisons:
+                mask &= _OPERATORS[op](x, value)
+            return mask
+
+        return cls(expr, [column], func)
+
+    def __call__(self, events):
+        """
+        Evaluates the cut
+
+        Parameters
+        ----------
+        events: pandas.DataFrame or mapping
+            Events, or any object that returns a feature column by name, e.g.
+            :class:`ml4eft.preproc.event_store.EventStore`
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(N,)`` boolean mask of the events that pass
+        """
+        return np.asarray(self.func(*(np.asarray(events[column]) for column in self.columns)), dtype=bool)
+
+
+class CutFlow:
+    """
+    Ordered sequence of cuts, evaluated lazily as boolean masks without copying the events
+
+    The masks only need the columns the cuts depend on, so with a
+    :class:`ml4eft.preproc.event_store.EventStore` nothing else is read from disk. The events that pass are selected
+    by the consumer, e.g. through ``events[mask]`` or by sampling among ``np.flatnonzero(mask)``.
+    """
+
+    def __init__(self, cuts):
+        """
+        CutFlow constructor
+
+        Parameters
+        ----------
+        cuts: array_like
+            List of :class:`Cut` objects and/or selection strings understood by :meth:`Cut.from_string`, as in the
+            ``cuts`` entry of a run card
+
+        Examples
+        --------
+        >>> cutflow = CutFlow(['pt_l1 > 25', 'abs(eta_l1) < 2.5', 'm_ll > 20'])
+        >>> mask = cutflow.mask(events)
+        >>> xsec_cut = cutflow.xsec(xsec)  # cross-section after cuts
+        >>> cutflow.table(xsec)
+                         cut  n_events  efficiency  cumulative efficiency    xsec
+        0          no cuts   1000000      1.0000                 1.0000  0.5570
+        1       pt_l1 > 25    912340      0.9123                 0.9123  0.5082
+        ...
+        """
+        self.cuts = [cut if isinstance(cut, Cut) else Cut.from_string(cut) for cut in cuts]
+        self.n_tot = None
+        self.n_pass = None
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Returns the cut-flow specified in the ``cuts`` entry of a run card, or ``None`` when there are no cuts
+        """
+        cuts = config.get('cuts')
+        return cls(cuts) if cuts else None
+
+    @property
+    def columns(self):
+        """
+        Features that the cuts depend on
+        """
+        columns = []
+        for cut in self.cuts:
+            columns.extend(c for c in cut.columns if c not in columns)
+        return columns
+
+    def masks(self, events):
+        """
+        Yields the cumulative mask after each cut, a cut is only evaluated when the previous masks are consumed
+
+        Parameters
+        ----------
+        events: pandas.DataFrame or mapping
+            Events, or any object that returns a feature column by name
+
+        Yields
+        ------
+        numpy.ndarray
+            ``(N,)`` boolean mask of the events that pass all cuts so far
+        """
+        mask = None
+        for cut in self.cuts:
+            mask = cut(events) if mask is None else mask & cut(events)
+            yield mask
+
+    def mask(self, events):
+        """
+        Returns the mask of the events that pass all cuts and records the cut-flow
+
+        Parameters
+        ----------
+        events: pandas.DataFrame or mapping
+            Events, or any object that returns a feature column by name and has a length
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(N,)`` boolean mask of the events that pass all cuts
+        """
+        self.n_tot = len(events)
+        self.n_pass = []
+
+        mask = np.ones(self.n_tot, dtype=bool)
+        for mask in self.masks(events):
+            self.n_pass.append(int(np.count_nonzero(mask)))
+        return mask
+
+    @property
+    def efficiency(self):
+        """
+        Fraction of the events that pass all cuts in the last call to :meth:`mask`
+        """
+        return self.n_pass[-1] / self.n_tot if self.n_pass else 1.0
+
+    def xsec(self, xsec):
+        """
+        Returns the cross-section after cuts, i.e. ``xsec`` times the efficiency of the last call to :meth:`mask`
+        """
+        return xsec * self.efficiency
+
+    def table(self, xsec=None):
+        """
+        Returns the cut-flow of the last call to :meth:`mask`
+
+        Parameters
+        ----------
+        xsec: float, optional
+            Cross-section before cuts, adds the cross-section after every cut to the table
+
+        Returns
+        -------
+        pandas.DataFrame
+            Number of events, efficiency of each cut and cumulative efficiency after every cut
+        """
+        n_events = [self.n_tot] + self.n_pass
+        table = pd.DataFrame({'cut': ['no cuts'] + [cut.name for cut in self.cuts], 'n_events': n_events})
+        table['efficiency'] = table['n_events'] / table['n_events'].shift(1, fill_value=self.n_tot)
+        table['cumulative efficiency'] = table['n_events'] / self.n_tot
+        if xsec is not None:
+            table['xsec'] = table['cumulative efficiency'] * xsec
+        return table
+
+    def log(self, xsec=None, source=''):
+        """
+        Logs the cut-flow of the last call to :meth:`mask`
+        """
+        logging.info("Cut-flow {}\n{}".format(source, self.table(xsec).to_string(index=False)))
@@ -0,0 +1,201 @@
+"""
+Module with a process-wide, size-bounded cache of loaded events
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from . import event_store
+
+
+class EventCache:
+    """
+    Least-recently-used cache of event DataFrames, bounded by their size in memory
+
+    Entries are keyed on the path, the modification time of the file and the requested columns, so a file that is
+    rewritten is reloaded automatically. Optionally, pickled DataFrames are mirrored as decompressed
+    :class:`ml4eft.preproc.event_store.EventStore` directories in ``mirror_dir``, such that later processes that
+    share the mirror only pay the gzip + unpickle cost once.
+    """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3, mirror_dir=None):
+        """
+        EventCache constructor
+
+        Parameters
+        ----------
+        max_bytes: int, optional
+            Memory budget of the cache in bytes, 2 GB by default. Set to 0 to disable in-memory caching.
+        mirror_dir: str, optional
+            Directory to store decompressed mirrors of pickled event files. No mirrors are written by default.
+
+        Examples
+        --------
+        The default cache is shared by all loads through :meth:`ml4eft.analyse.analyse.Analyse.load_events`
+
+        >>> from ml4eft.preproc.event_cache import event_cache
+        >>> event_cache.configure(max_bytes=8 * 1024 ** 3, mirror_dir='/scratch/ml4eft_mirror')
+        >>> events, xsec = Analyse.load_events('.../events_0.pkl.gz')  # miss
+        >>> events, xsec = Analyse.load_events('.../events_0.pkl.gz')  # hit
+        >>> event_cache.stats()
+        {'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 1, 'bytes': 167772160, 'max_bytes': 8589934592}
+        """
+        self.max_bytes = max_bytes
+        self.mirror_dir = mirror_dir
+
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.lock = threading.Lock()
+
+    def configure(self, max_bytes=None, mirror_dir=None):
+        """
+        Updates the memory budget and/or the mirror directory
+
+        Parameters
+        ----------
+        max_bytes: int, optional
+            New memory budget in bytes, entries are evicted when the cache exceeds it
+        mirror_dir: str, optional
+            Directory to store decompressed mirrors of pickled event files
+        """
+        with self.lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+                self._evict()
+            if mirror_dir is not None:
+                self.mirror_dir = mirror_dir
+
+    def clear(self):
+        """
+        Removes all entries and resets the counters
+        """
+        with self.lock:
+            self.entries.clear()
+            self.n_bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Returns the cache counters
+
+        Returns
+        -------
+        dict
+            Number of hits, misses and evictions, the number of entries and their total size in bytes
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': len(self.entries),
+                'bytes': self.n_bytes, 'max_bytes': self.max_bytes}
+
+    @staticmethod
+    def _mtime(path):
+        if event_store.is_event_store(path):
+            path = os.path.join(path, event_store.HEADER)
+        return os.stat(path).st_mtime_ns
+
+    def _evict(self):
+        while self.n_bytes > self.max_bytes and self.entries:
+            _, (_, _, n_bytes) = self.entries.popitem(last=False)
+            self.n_bytes -= n_bytes
+            self.evictions += 1
+
+    def _mirror(self, path, mtime):
+        """
+        Returns the path to the decompressed mirror of a pickled event file, writing it if needed
+        """
+        key = hashlib.sha1('{}:{}'.format(os.path.realpath(path), mtime).encode()).hexdigest()
+        mirror_path = os.path.join(self.mirror_dir, key)
+
+        if not event_store.is_event_store(mirror_path):
+            events, xsec = event_store.load_events(path)
+
+            # written next to the mirror and renamed into place, such that concurrent jobs never see, or truncate,
+            # a partially written mirror that another job may have memory-mapped
+            os.makedirs(self.mirror_dir, exist_ok=True)
+            tmp_path = tempfile.mkdtemp(prefix='.{}.'.format(key), dir=self.mirror_dir)
+            try:
+                event_store.write_event_store(tmp_path, events, xsec)
+                os.rename(tmp_path, mirror_path)
+                logging.info("Mirrored {} to {}".format(path, mirror_path))
+            except OSError:
+                # another job renamed its mirror into place first
+                if not event_store.is_event_store(mirror_path):
+                    raise
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+        return mirror_path
+
+    def load(self, event_path, columns=None):
+        """
+        Loads events through the cache
+
+        The returned DataFrame is a shallow copy of the cached one: adding or dropping columns does not affect the
+        cache, but values should only be modified on a deep copy.
+
+        Parameters
+        ----------
+        event_path: str
+            Path to the event store or the pickled DataFrame
+        columns: array_like, optional
+            Features to load, all features by default
+
+        Returns
+        -------
+        events: pandas.DataFrame
+            DataFrame with events
+        xsec: float
+            Inclusive cross-section of the events
+        """
+        path = event_store.resolve_event_path(event_path)
+        mtime = self._mtime(path)
+        columns = None if columns is None else tuple(columns)
+
+        key = (os.path.realpath(path), mtime, columns)
+        key_all = (os.path.realpath(path), mtime, None)
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                events, xsec, _ = self.entries[key]
+                return events.copy(deep=False), xsec
+
+            # a projection of a cached file with all its columns needs no I/O
+            if key_all in self.entries:
+                self.entries.move_to_end(key_all)
+                self.hits += 1
+                events, xsec, _ = self.entries[key_all]
+                return events[list(columns)], xsec
+
+            self.misses += 1
+
+        if self.mirror_dir is not None and not event_store.is_event_store(path):
+            path = self._mirror(path, mtime)
+
+        events, xsec = event_store.load_events(path, columns)
+        n_bytes = int(events.memory_usage(index=True, deep=False).sum())
+
+        with self.lock:
+            if n_bytes <= self.max_bytes and key not in self.entries:
+                self.entries[key] = (events, xsec, n_bytes)
+                self.n_bytes += n_bytes
+                self._evict()
+
+        return events.copy(deep=False), xsec
+
+
+def _default_max_bytes():
+    return int(os.environ.get('ML4EFT_EVENT_CACHE_BYTES', 2 * 1024 ** 3))
+
+
+# process-wide cache, configurable through the environment or event_cache.configure
+event_cache = EventCache(max_bytes=_default_max_bytes(), mirror_dir=os.environ.get('ML4EFT_EVENT_CACHE_DIR'))
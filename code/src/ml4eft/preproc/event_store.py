@@ -0,0 +1,394 @@
+"""
+Module to store events column by column with their cross-section as metadata
+"""
+
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+HEADER = 'header.json'
+FORMAT = 'ml4eft-event-store'
+VERSION = 1
+
+_PICKLE_SUFFIXES = ('.pkl.gz', '.pkl')
+
+
+def store_path(event_path):
+    """
+    Returns the path of the event store that corresponds to a pickled event DataFrame
+
+    Parameters
+    ----------
+    event_path: str
+        Path to an event file, e.g. ``tt_sm/events_0.pkl.gz``
+
+    Returns
+    -------
+    str
+        Path to the event store, e.g. ``tt_sm/events_0``
+    """
+    for suffix in _PICKLE_SUFFIXES:
+        if event_path.endswith(suffix):
+            return event_path[:-len(suffix)]
+    return event_path
+
+
+def is_event_store(path):
+    """
+    Returns ``True`` when ``path`` is an event store directory
+    """
+    return os.path.isfile(os.path.join(path, HEADER))
+
+
+def resolve_event_path(event_path):
+    """
+    Returns the event store that corresponds to ``event_path`` when it exists, and ``event_path`` otherwise
+
+    Parameters
+    ----------
+    event_path: str
+        Path to a pickled event DataFrame or to an event store
+
+    Returns
+    -------
+    str
+        Path to read the events from
+    """
+    path = store_path(event_path)
+    return path if is_event_store(path) else event_path
+
+
+def find_shards(event_path):
+    """
+    Returns the event stores of a sample, which is stored either in one store or in several numbered shards
+
+    Parameters
+    ----------
+    event_path: str
+        Path to a pickled event DataFrame or to an event store, e.g. ``tt_sm/events_0.pkl.gz``
+
+    Returns
+    -------
+    list
+        ``[tt_sm/events_0]`` when that store exists, and the shards ``tt_sm/events_0_<k>`` in the order of ``k``
+        otherwise
+    """
+    path = store_path(event_path)
+    if is_event_store(path):
+        return [path]
+
+    directory, name = os.path.split(path)
+    prefix = name + '_'
+    numbers = sorted(int(shard[len(prefix):]) for shard in os.listdir(directory or '.')
+                     if shard.startswith(prefix) and shard[len(prefix):].isdigit())
+    shards = [shard for shard in ('{}_{}'.format(path, k) for k in numbers) if is_event_store(shard)]
+    if not shards:
+        raise FileNotFoundError("No event store found for {}, convert pickled events with convert_tree".format(
+            event_path))
+    return shards
+
+
+class EventStore:
+    """
+    Columnar on-disk event format: a directory with one ``.npy`` file per feature and a JSON header
+
+    The header holds the number of events, the inclusive cross-section ``xsec``, the EFT point ``c_value`` at which
+    the events are generated and the feature names. Columns are memory-mapped, so only the columns (and rows) that are
+    actually used are read from disk.
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        """
+        EventStore constructor
+
+        Parameters
+        ----------
+        path: str
+            Path to the event store directory
+        mmap_mode: str, optional
+            Memory-map mode passed to ``numpy.load``, set to ``None`` to read columns into memory
+
+        Examples
+        --------
+        >>> store = EventStore('training_data/tt_llvlvlbb/tt_sm/events_0')
+        >>> store.xsec, store.n_events, store.columns
+        (0.557, 1000000, ['sqrts_hat', 'pt_l1', ...])
+        >>> df = store.read(columns=['pt_ll', 'eta_l1'])
+        """
+        self.path = path
+        self.mmap_mode = mmap_mode
+
+        with open(os.path.join(path, HEADER)) as json_data:
+            self.header = json.load(json_data)
+
+        if self.header.get('format') != FORMAT:
+            raise ValueError("{} is not an event store".format(path))
+
+        self.columns = self.header['columns']
+        self.n_events = self.header['n_events']
+        self.xsec = self.header['xsec']
+        self.c_value = self.header.get('c_value')
+
+    def __len__(self):
+        return self.n_events
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def column(self, name):
+        """
+        Returns a single feature column
+
+        Parameters
+        ----------
+        name: str
+            Feature name
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(n_events,)`` (memory-mapped) array
+        """
+        if name not in self.columns:
+            raise KeyError("Feature {} not found in {}, available features are {}".format(name, self.path,
+                                                                                          self.columns))
+        return np.load(os.path.join(self.path, '{}.npy'.format(name)), mmap_mode=self.mmap_mode)
+
+    def read(self, columns=None, rows=None):
+        """
+        Reads (a subset of) the events into a DataFrame
+
+        Parameters
+        ----------
+        columns: array_like, optional
+            Features to read, all features by default
+        rows: array_like, optional
+            Indices or boolean mask of the events to read, all events by default
+
+        Returns
+        -------
+        pandas.DataFrame
+            Events, indexed from 1 like the events returned by :meth:`ml4eft.analyse.analyse.Analyse.load_events`
+        """
+        columns = self.columns if columns is None else list(columns)
+
+        if rows is None:
+            index = pd.RangeIndex(1, self.n_events + 1)
+            data = {name: np.asarray(self.column(name)) for name in columns}
+        else:
+            rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows)
+            index = rows + 1
+            data = {name: self.column(name)[rows] for name in columns}
+
+        return pd.DataFrame(data, index=index, columns=columns)
+
+
+def write_event_store(path, events, xsec, c_value=None):
+    """
+    Writes events to an event store
+
+    Parameters
+    ----------
+    path: str
+        Path to the event store directory, created if needed
+    events: pandas.DataFrame
+        Events, one column per feature
+    xsec: float
+        Inclusive cross-section of the events
+    c_value: array_like, optional
+        EFT point at which the events are generated
+    """
+    os.makedirs(path, exist_ok=True)
+
+    columns = [str(name) for name in events.columns]
+    for name in columns:
+        np.save(os.path.join(path, '{}.npy'.format(name)), np.ascontiguousarray(events[name].values))
+
+    header = {'format': FORMAT,
+              'version': VERSION,
+              'n_events': len(events),
+              'xsec': float(xsec),
+              'c_value': None if c_value is None else np.atleast_1d(c_value).tolist(),
+              'columns': columns}
+
+    # write the header last, so an interrupted write is never mistaken for a valid store
+    with open(os.path.join(path, HEADER), 'w') as json_data:
+        json.dump(header, json_data)
+
+
+def load_events(event_path, columns=None):
+    """
+    Loads events and their inclusive cross-section from either an event store or a pickled DataFrame with the
+    cross-section in the first row
+
+    Parameters
+    ----------
+    event_path: str
+        Path to the event store or the pickled DataFrame. When an event store exists next to a pickled DataFrame,
+        e.g. ``events_0`` next to ``events_0.pkl.gz``, the event store is read.
+    columns: array_like, optional
+        Features to read, all features by default
+
+    Returns
+    -------
+    events: pandas.DataFrame
+        DataFrame with events
+    xsec: float
+        Inclusive cross-section of the events
+    """
+    path = resolve_event_path(event_path)
+
+    if is_event_store(path):
+        store = EventStore(path)
+        return store.read(columns), store.xsec
+
+    event_df = pd.read_pickle(path)
+    xsec = event_df.iloc[0, 0]
+    events = event_df.iloc[1:, :] if columns is None else event_df.iloc[1:][list(columns)]
+
+    return events, xsec
+
+
+def sample_events(event_path, n_dat, columns=None, dtype=None, random_state=None, cuts=None, rows=None,
+                  return_rows=False):
+    """
+    Loads a random sample of ``n_dat`` events without replacement, reading only the requested columns
+
+    The sample is drawn by index before any rows are materialised. For event stores only the sampled rows of the
+    requested columns (and the columns the cuts depend on) are read from disk; pickled DataFrames must be unpickled in
+    full, but are reduced to the requested columns and rows before being returned.
+
+    Parameters
+    ----------
+    event_path: str
+        Path to the event store or the pickled DataFrame
+    n_dat: int
+        Number of events to sample
+    columns: array_like, optional
+        Features to read, all features by default
+    dtype: str or numpy.dtype, optional
+        Cast the sampled events to ``dtype``, e.g. ``float32``
+    random_state: int or numpy.random.Generator, optional
+        Seed or generator used to draw the sample
+    cuts: :class:`ml4eft.preproc.cuts.CutFlow`, optional
+        Event selection, the sample is drawn among the events that pass
+    rows: array_like, optional
+        Positions of the events to read instead of drawing a new sample, e.g. to read the same sample again
+    return_rows: bool, optional
+        Set to true to also return the positions of the sampled events in the file
+
+    Returns
+    -------
+    events: pandas.DataFrame
+        Sampled events
+    xsec: float
+        Inclusive cross-section of all the events in the file, after cuts if ``cuts`` is given
+    rows: numpy.ndarray
+        Positions of the sampled events, only returned when ``return_rows`` is true
+    """
+    rng = np.random.default_rng(random_state)
+    path = resolve_event_path(event_path)
+
+    if is_event_store(path):
+        store = EventStore(path)
+        candidates = store.n_events if cuts is None else np.flatnonzero(cuts.mask(store))
+        if rows is None:
+            rows = np.sort(rng.choice(candidates, n_dat, replace=False))
+        events, xsec = store.read(columns, rows=rows), store.xsec
+    else:
+        events, xsec = load_events(path)
+        candidates = len(events) if cuts is None else np.flatnonzero(cuts.mask(events))
+        if rows is None:
+            rows = rng.choice(candidates, n_dat, replace=False)
+        events = events.iloc[rows]
+        events = events if columns is None else events[list(columns)]
+
+    if cuts is not None:
+        cuts.log(xsec, path)
+        xsec = cuts.xsec(xsec)
+
+    if dtype is not None:
+        events = events.astype(dtype, copy=False)
+
+    if return_rows:
+        return events, xsec, np.asarray(rows)
+    return events, xsec
+
+
+def read_c_value(event_dir):
+    """
+    Returns the EFT point at which the events in ``event_dir`` are generated
+
+    Reads ``info.txt`` when present, and the header of the first event store otherwise.
+
+    Parameters
+    ----------
+    event_dir: str
+        Directory with the replica event files, e.g. ``tt_llvlvlbb/tt_ctGRe``
+
+    Returns
+    -------
+    numpy.ndarray
+        EFT point
+    """
+    path_to_info = os.path.join(event_dir, 'info.txt')
+    if os.path.isfile(path_to_info):
+        with open(path_to_info) as f:
+            return np.array([int(c) for c in f.read().split()])
+
+    for name in sorted(os.listdir(event_dir)):
+        path = os.path.join(event_dir, name)
+        if is_event_store(path):
+            c_value = EventStore(path).c_value
+            if c_value is not None:
+                return np.array(c_value)
+
+    raise FileNotFoundError("No info.txt or event store with c_value found in {}".format(event_dir))
+
+
+def convert_tree(root, remove_pickles=False):
+    """
+    Converts all pickled event DataFrames below ``root`` into event stores
+
+    Each ``events_<mc_run>.pkl.gz`` is converted into an ``events_<mc_run>`` store in the same directory. The EFT point
+    in ``info.txt``, if present, is copied into the header of the stores.
+
+    Parameters
+    ----------
+    root: str
+        Root directory, e.g. ``training_data/tt_llvlvlbb``
+    remove_pickles: bool, optional
+        Remove the pickled DataFrames after a successful conversion
+
+    Returns
+    -------
+    list
+        Paths to the written event stores
+
+    Examples
+    --------
+    >>> convert_tree('training_data/tt_llvlvlbb')
+    """
+    converted = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        c_value = None
+        if 'info.txt' in filenames:
+            c_value = read_c_value(dirpath)
+
+        for filename in sorted(filenames):
+            if not (filename.startswith('events_') and filename.endswith(_PICKLE_SUFFIXES)):
+                continue
+
+            event_path = os.path.join(dirpath, filename)
+            events, xsec = load_events(event_path)
+            path = store_path(event_path)
+            write_event_store(path, events, xsec, c_value)
+            converted.append(path)
+            logging.info("Converted {} to {}".format(event_path, path))
+
+            if remove_pickles:
+                os.remove(event_path)
+
+    return converted
@@ -0,0 +1,338 @@
+"""
+Module to compute kinematic features declared as expressions over particle systems, vectorised over batches of events
+"""
+
+import re
+import numpy as np
+import pandas as pd
+
+from . import lhe_stream
+from .lhe_reader import FourVectorArray, get_deta, get_dphi
+
+# functions of one particle system, mapped to the FourVectorArray method that computes them
+SYSTEM_FUNCTIONS = {'pt': 'get_pt',
+                    'eta': 'get_pseudorapidity',
+                    'y': 'get_rapidity',
+                    'phi': 'get_phi',
+                    'theta': 'get_theta',
+                    'm': 'get_inv_mass',
+                    'p': 'get_p',
+                    'e': 'e',
+                    'px': 'px',
+                    'py': 'py',
+                    'pz': 'pz'}
+
+# functions of two particle systems, given as the functions applied to each system (or pair) and their combination
+PAIR_FUNCTIONS = {'deta': (('eta', 'eta'), get_deta),
+                  'dphi': (('phi', 'phi'), get_dphi),
+                  'dy': (('y', 'y'), lambda y1, y2: np.abs(y1 - y2)),
+                  'dr': (('deta', 'dphi'), np.hypot)}
+
+# element-wise functions of other features
+VALUE_FUNCTIONS = {'abs': np.abs,
+                   'max': lambda *x: np.maximum.reduce(x),
+                   'min': lambda *x: np.minimum.reduce(x)}
+
+_TOKEN = re.compile(r'\s*([A-Za-z_][A-Za-z0-9_]*|[(),+])')
+
+
+class FeatureEngine:
+    """
+    Registry of kinematic features, defined as expressions over particle systems selected by PDG id
+
+    Each expression is parsed into a node of a dependency graph with three kinds of nodes: selected particles, systems
+    (sums of particles or other systems) and functions. Identical sub-expressions map onto the same node, such that
+    every particle selection and intermediate system, e.g. the dilepton system ``l1 + l2``, is computed once per batch
+    however many features use it. All nodes are evaluated on whole batches with
+    :class:`ml4eft.preproc.lhe_reader.FourVectorArray`.
+
+    Expressions are of the form ``func(args)`` with
+
+    * ``pt``, ``eta``, ``y``, ``phi``, ``theta``, ``m``, ``p``, ``e``, ``px``, ``py``, ``pz`` of one system
+    * ``deta``, ``dphi``, ``dy``, ``dr`` of two systems
+    * ``abs``, ``max``, ``min`` of other expressions
+
+    A system is a particle name, a name from ``systems`` or a sum of those, e.g. ``l1+l2``.
+    """
+
+    def __init__(self, particles, features, systems=None):
+        """
+        FeatureEngine constructor
+
+        Parameters
+        ----------
+        particles: dict
+            Particle selections by name. A selection is a PDG id, a list of PDG ids, or a dict with keys ``pid``
+            (id or list of ids), ``status`` (LHE status code, any by default), ``rank`` (select the n-th matching
+            particle in the event, 0 by default) and ``all`` (sum all matching particles instead). Events without a
+            matching particle get ``NaN`` features.
+        features: dict
+            Feature expressions by column name
+        systems: dict, optional
+            Named systems, given as a list of particle and/or system names to add
+
+        Examples
+        --------
+        We consider :math:`pp \\rightarrow t\\bar{t} \\rightarrow \\ell^+\\ell^-\\nu_\\ell\\bar{\\nu}_\\ell b\\bar{b}`
+
+        >>> engine = FeatureEngine(
+        ...     particles={'l1': [11, 13], 'l2': [-11, -13], 'b': 5, 'bbar': -5, 't': 6, 'tbar': -6,
+        ...                'partons': {'pid': [21, 1, 2, 3, 4, -1, -2, -3, -4], 'status': -1, 'all': True}},
+        ...     systems={'ll': ['l1', 'l2'], 'tt': ['t', 'tbar']},
+        ...     features={'pt_ll': 'pt(ll)', 'm_ll': 'm(ll)', 'eta_l1': 'eta(l1)', 'dphi_ll': 'dphi(l1, l2)',
+        ...               'm_tt': 'm(tt)', 'y': 'y(tt)', 'sqrts_hat': 'm(partons)', 'pt_b_max': 'max(pt(b), pt(bbar))'})
+
+        The engine maps a :class:`ml4eft.preproc.lhe_stream.LHEBatch` to a DataFrame with all features at once
+
+        >>> for batch in lhe_stream.read_lhe_batches(path_to_lhe):
+        ...     df = engine(batch)
+
+        and can be passed as the (picklable) ``features`` argument of
+        :func:`ml4eft.preproc.ingest.ingest_lhe_dir`, or read a whole file with :meth:`read_lhe`.
+        """
+        self.particles = {name: self._selection(sel) for name, sel in particles.items()}
+        self.systems = {} if systems is None else {name: list(parts) for name, parts in systems.items()}
+        self.features = dict(features)
+
+        clash = set(self.particles) & set(self.systems)
+        if clash:
+            raise ValueError("Names {} are defined both as particle and as system".format(sorted(clash)))
+
+        self.nodes = {name: self.parse(expr) for name, expr in self.features.items()}
+
+    @staticmethod
+    def _selection(sel):
+        if not isinstance(sel, dict):
+            sel = {'pid': sel}
+        return {'pid': tuple(np.atleast_1d(sel['pid']).tolist()),
+                'status': sel.get('status'),
+                'rank': sel.get('rank', 0),
+                'all': sel.get('all', False)}
+
+    def _system_node(self, name, stack=()):
+        """
+        Returns the graph node of a particle or of a named system
+        """
+        if name in self.particles:
+            return 'particle', name
+        if name in self.systems:
+            if name in stack:
+                raise ValueError("System {} is defined in terms of itself".format(name))
+            children = [self._system_node(part, stack + (name,)) for part in self.systems[name]]
+            return self._sum_node(children)
+        raise KeyError("Unknown particle or system {}".format(name))
+
+    @staticmethod
+    def _sum_node(children):
+        if len(children) == 1:
+            return children[0]
+
+        # sort, such that l1+l2 and l2+l1 are one and the same node. Named sub-systems stay nodes of their own, so
+        # e.g. the top quark systems are computed once for both m(t) and m(t+tbar)
+        return 'system', tuple(sorted(children))
+
+    def parse(self, expr):
+        """
+        Parses a feature expression into a node of the dependency graph
+
+        Parameters
+        ----------
+        expr: str
+            Feature expression, e.g. ``pt(l1+l2)``
+
+        Returns
+        -------
+        tuple
+            Graph node
+        """
+        tokens = _TOKEN.findall(expr)
+        if ''.join(tokens) != re.sub(r'\s', '', expr):
+            raise ValueError("Cannot parse feature expression {}".format(expr))
+
+        node, pos = self._parse_expr(tokens, 0, expr)
+        if pos != len(tokens):
+            raise ValueError("Unexpected {} in feature expression {}".format(tokens[pos], expr))
+        return node
+
+    def _parse_expr(self, tokens, pos, expr):
+        if pos >= len(tokens):
+            raise ValueError("Unexpected end of feature expression {}".format(expr))
+
+        name = tokens[pos]
+        if pos + 1 < len(tokens) and tokens[pos + 1] == '(':
+            args, pos = [], pos + 2
+            while True:
+                arg, pos = self._parse_expr(tokens, pos, expr)
+                args.append(arg)
+                if pos < len(tokens) and tokens[pos] == ',':
+                    pos += 1
+                elif pos < len(tokens) and tokens[pos] == ')':
+                    pos += 1
+                    break
+                else:
+                    raise ValueError("Expected , or ) in feature expression {}".format(expr))
+            return self._function_node(name, args, expr), pos
+
+        # a system: names joined by +
+        children = [self._system_node(name)]
+        pos += 1
+        while pos < len(tokens) and tokens[pos] == '+':
+            if pos + 1 >= len(tokens) or tokens[pos + 1] in '(),+':
+                raise ValueError("Expected a particle or system after + in feature expression {}".format(expr))
+            children.append(self._system_node(tokens[pos + 1]))
+            pos += 2
+        return self._sum_node(children), pos
+
+    @classmethod
+    def _function_node(cls, name, args, expr):
+        is_system = [arg[0] in ('particle', 'system') for arg in args]
+        if name in SYSTEM_FUNCTIONS:
+            n_args, systems = 1, True
+        elif name in PAIR_FUNCTIONS:
+            n_args, systems = 2, True
+        elif name in VALUE_FUNCTIONS:
+            n_args, systems = None, False
+        else:
+            raise ValueError("Unknown function {} in feature expression {}".format(name, expr))
+
+        if n_args is not None and len(args) != n_args:
+            raise ValueError("{} takes {} argument(s) in feature expression {}".format(name, n_args, expr))
+        if any(s != systems for s in is_system):
+            kind = 'particle systems' if systems else 'features'
+            raise ValueError("{} takes {} as arguments in feature expression {}".format(name, kind, expr))
+
+        if name in PAIR_FUNCTIONS:
+            # depend on the per-system features, e.g. eta(l1) and eta(l2) for deta(l1, l2), so they are shared
+            bases, _ = PAIR_FUNCTIONS[name]
+            args = [cls._function_node(base, [arg] if base in SYSTEM_FUNCTIONS else args, expr)
+                    for base, arg in zip(bases, args)]
+        return 'function', name, tuple(args)
+
+    @staticmethod
+    def _dependencies(node):
+        if node[0] == 'particle':
+            return ()
+        if node[0] == 'system':
+            return node[1]
+        return node[2]
+
+    def graph(self, features=None):
+        """
+        Returns the nodes needed for ``features`` in evaluation order, each node after its dependencies
+
+        Parameters
+        ----------
+        features: array_like, optional
+            Feature names, all registered features by default
+
+        Returns
+        -------
+        list
+            Topologically sorted graph nodes
+        """
+        features = self.features.keys() if features is None else features
+
+        order, seen = [], set()
+
+        def visit(node):
+            if node in seen:
+                return
+            seen.add(node)
+            for dep in self._dependencies(node):
+                visit(dep)
+            order.append(node)
+
+        for name in features:
+            visit(self.nodes[name])
+        return order
+
+    def _select(self, batch, sel):
+        """
+        Returns the four-momenta of the selected particle in every event, ``NaN`` when there is none
+        """
+        mask = np.isin(batch.pid, sel['pid'])
+        if sel['status'] is not None:
+            mask &= batch.status == sel['status']
+
+        p = batch.momenta
+        if sel['all']:
+            found = mask.any(axis=1)
+            return FourVectorArray(*(np.where(found, np.where(mask, getattr(p, mu), 0).sum(axis=1), np.nan)
+                                     for mu in ['e', 'px', 'py', 'pz']))
+
+        # column of the rank-th matching particle in each event
+        hits = np.cumsum(mask, axis=1)
+        found = hits[:, -1] > sel['rank']
+        cols = np.argmax(hits > sel['rank'], axis=1)
+        rows = np.arange(len(batch))
+
+        selected = p[rows, cols]
+        if not found.all():
+            selected = FourVectorArray(*(np.where(found, getattr(selected, mu), np.nan)
+                                         for mu in ['e', 'px', 'py', 'pz']))
+        return selected
+
+    def _evaluate(self, node, values, batch):
+        kind = node[0]
+        if kind == 'particle':
+            return self._select(batch, self.particles[node[1]])
+        if kind == 'system':
+            system = values[node[1][0]]
+            for child in node[1][1:]:
+                system = system + values[child]
+            return system
+
+        _, name, args = node
+        args = [values[arg] for arg in args]
+        if name in SYSTEM_FUNCTIONS:
+            attr = getattr(args[0], SYSTEM_FUNCTIONS[name])
+            return attr() if callable(attr) else attr
+        if name in PAIR_FUNCTIONS:
+            return PAIR_FUNCTIONS[name][1](*args)
+        return VALUE_FUNCTIONS[name](*args)
+
+    def __call__(self, batch, features=None):
+        """
+        Computes features for a batch of events
+
+        Parameters
+        ----------
+        batch: :class:`ml4eft.preproc.lhe_stream.LHEBatch`
+            Batch of events
+        features: array_like, optional
+            Feature names, all registered features by default
+
+        Returns
+        -------
+        pandas.DataFrame
+            One column per feature and one row per event
+        """
+        features = list(self.features.keys()) if features is None else list(features)
+
+        values = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for node in self.graph(features):
+                values[node] = self._evaluate(node, values, batch)
+
+        return pd.DataFrame({name: values[self.nodes[name]] for name in features}, columns=features)
+
+    def read_lhe(self, path, features=None, batch_size=100000):
+        """
+        Computes features for all events in a LHE file
+
+        Parameters
+        ----------
+        path: str
+            Path to the (gzipped) LHE file
+        features: array_like, optional
+            Feature names, all registered features by default
+        batch_size: int, optional
+            Number of events to process at once
+
+        Returns
+        -------
+        pandas.DataFrame
+            One column per feature and one row per event
+        """
+        dfs = [self(batch, features) for batch in lhe_stream.read_lhe_batches(path, batch_size)]
+        return pd.concat(dfs, ignore_index=True)
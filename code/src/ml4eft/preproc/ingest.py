@@ -0,0 +1,168 @@
+"""
+Module to convert directories of LHE files into event DataFrames in parallel
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+from . import event_store
+from . import lhe_stream
+
+
+def lhe_to_events(lhe_path, features, batch_size=100000):
+    """
+    Computes the kinematic features of all events in a LHE file
+
+    Parameters
+    ----------
+    lhe_path: str
+        Path to the (gzipped) LHE file
+    features: callable
+        Feature definition that maps a :class:`ml4eft.preproc.lhe_stream.LHEBatch` to a ``pandas.DataFrame``
+        (or a dict of arrays) with one row per event. Must be picklable, e.g. a module level function.
+    batch_size: int, optional
+        Number of events to process at once
+
+    Returns
+    -------
+    events: pandas.DataFrame
+        Kinematic features of the events
+    xsec: float
+        Inclusive cross-section in pb as stored in the LHE file
+    """
+    xsec = lhe_stream.read_lhe_xsec(lhe_path)
+    events = [pd.DataFrame(features(batch)) for batch in lhe_stream.read_lhe_batches(lhe_path, batch_size)]
+    return pd.concat(events, ignore_index=True), xsec
+
+
+def save_events(events, xsec, event_path):
+    """
+    Saves events in the format read by :meth:`ml4eft.analyse.analyse.Analyse.load_events`, i.e. as a pickled
+    DataFrame with the inclusive cross-section in the first row
+
+    Parameters
+    ----------
+    events: pandas.DataFrame
+        Kinematic features of the events
+    xsec: float
+        Inclusive cross-section
+    event_path: str
+        Output path, e.g. ``<process_id>_<coeff>/events_<mc_run>.pkl.gz``
+    """
+    xsec_row = pd.DataFrame([[xsec] + [np.nan] * (events.shape[1] - 1)], columns=events.columns)
+    pd.concat([xsec_row, events], ignore_index=True).to_pickle(event_path)
+
+
+def _ingest_file(lhe_path, event_path, features, batch_size, c_value):
+    """
+    Worker task: converts one LHE file into one replica event file
+    """
+    t_start = time.perf_counter()
+    events, xsec = lhe_to_events(lhe_path, features, batch_size)
+    if event_store.store_path(event_path) == event_path:
+        event_store.write_event_store(event_path, events, xsec, c_value)
+    else:
+        save_events(events, xsec, event_path)
+    return len(events), time.perf_counter() - t_start
+
+
+def ingest_lhe_dir(lhe_dir, output_dir, process_id, coeff, features, n_workers=None, c_value=None, first_rep=0,
+                   batch_size=100000, fmt='pkl'):
+    """
+    Converts every LHE file in ``lhe_dir`` into a replica event file, one file per task on a process pool
+
+    The files are written to ``<output_dir>/<process_id>_<coeff>/events_<mc_run>.pkl.gz`` (or to an
+    ``events_<mc_run>`` :class:`ml4eft.preproc.event_store.EventStore`), the layout expected by
+    :meth:`ml4eft.core.classifier.Fitter.load_data` and :meth:`ml4eft.analyse.analyse.Analyse.get_event_paths`.
+    Replica numbers are assigned in alphabetical order of the LHE file names, starting at ``first_rep``.
+
+    Parameters
+    ----------
+    lhe_dir: str
+        Directory with ``.lhe`` or ``.lhe.gz`` files, one per replica
+    output_dir: str
+        Root directory of the event files, e.g. ``training_data/tt_llvlvlbb``
+    process_id: str
+        Process identifier, e.g. ``tt``
+    coeff: str
+        EFT coefficient(s) at which the events are generated, e.g. ``ctGRe`` or ``ctGRe_ctGRe``, or ``sm``
+    features: callable
+        Feature definition that maps a :class:`ml4eft.preproc.lhe_stream.LHEBatch` to a ``pandas.DataFrame``
+        (or a dict of arrays). Must be picklable, e.g. a module level function.
+    n_workers: int, optional
+        Number of worker processes, set to the number of CPUs by default
+    c_value: array_like, optional
+        Integer values of the EFT coefficients at which the events are generated, written to ``info.txt`` as read by
+        :class:`ml4eft.core.th_predictions.TheoryPred`
+    first_rep: int, optional
+        Replica number of the first LHE file
+    batch_size: int, optional
+        Number of events each worker processes at once
+    fmt: str, optional
+        Output format, choose between ``pkl`` (pickled DataFrame with the cross-section in the first row) and
+        ``store`` (:class:`ml4eft.preproc.event_store.EventStore`)
+
+    Returns
+    -------
+    event_paths: list
+        Paths to the written event files
+
+    Examples
+    --------
+    >>> def features(batch):
+    ...     rows = np.arange(len(batch))
+    ...     l1 = batch.momenta[rows, np.argmax(np.isin(batch.pid, [11, 13]), axis=1)]
+    ...     l2 = batch.momenta[rows, np.argmax(np.isin(batch.pid, [-11, -13]), axis=1)]
+    ...     return {'pt_l1': l1.get_pt(), 'm_ll': (l1 + l2).get_inv_mass()}
+    >>> ingest_lhe_dir('lhe/tt_ctGRe', 'training_data/tt_llvlvlbb', 'tt', 'ctGRe', features, c_value=[10])
+
+    or, equivalently, with a declarative :class:`ml4eft.preproc.feature_engine.FeatureEngine`
+
+    >>> engine = FeatureEngine(particles={'l1': [11, 13], 'l2': [-11, -13]},
+    ...                        features={'pt_l1': 'pt(l1)', 'm_ll': 'm(l1+l2)'})
+    >>> ingest_lhe_dir('lhe/tt_ctGRe', 'training_data/tt_llvlvlbb', 'tt', 'ctGRe', engine, c_value=[10])
+    """
+    if fmt not in ('pkl', 'store'):
+        raise ValueError("Unknown output format {}, choose between pkl and store".format(fmt))
+
+    if c_value is not None:
+        # info.txt is parsed as integers by TheoryPred and event_store.read_c_value
+        c_array = np.atleast_1d(np.asarray(c_value, dtype=np.float64))
+        if not np.array_equal(c_array, np.round(c_array)):
+            raise ValueError("The EFT coefficient values must be integers, got {}".format(c_value))
+        c_value = [int(c) for c in c_array]
+
+    lhe_paths = sorted(os.path.join(lhe_dir, f) for f in os.listdir(lhe_dir) if f.endswith(('.lhe', '.lhe.gz')))
+
+    event_dir = os.path.join(output_dir, '{}_{}'.format(process_id, coeff))
+    os.makedirs(event_dir, exist_ok=True)
+
+    if c_value is not None:
+        with open(os.path.join(event_dir, 'info.txt'), 'w') as f:
+            f.write(' '.join(str(c) for c in c_value))
+
+    suffix = '.pkl.gz' if fmt == 'pkl' else ''
+    event_paths = [os.path.join(event_dir, 'events_{}{}'.format(first_rep + i, suffix)) for i in range(len(lhe_paths))]
+
+    logging.info("Ingesting {} LHE files from {} into {}".format(len(lhe_paths), lhe_dir, event_dir))
+
+    t_start = time.perf_counter()
+    n_events_tot = 0
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {executor.submit(_ingest_file, lhe_path, event_path, features, batch_size, c_value): lhe_path
+                   for lhe_path, event_path in zip(lhe_paths, event_paths)}
+
+        for n_done, future in enumerate(as_completed(futures), start=1):
+            n_events, t_file = future.result()
+            n_events_tot += n_events
+            t_elapsed = time.perf_counter() - t_start
+
+            logging.info("[{}/{}] {}: {} events in {:.1f} s, total throughput {:.0f} events/s".format(
+                n_done, len(futures), os.path.basename(futures[future]), n_events, t_file,
+                n_events_tot / t_elapsed))
+
+    return event_paths
@@ -193,20 +193,222 @@ class Kinematics(pylhe.LHEParticle):
         return y
 
 
+class FourVectorArray:
+    """
+    Columnar (structure-of-arrays) batch of four-momenta
+    """
+
+    def __init__(self, e, px, py, pz):
+        """
+        Stores the four-momentum components of many particles as contiguous arrays
+
+        Parameters
+        ----------
+        e: array_like
+            Energies in GeV, of any shape, e.g. ``(n_events, n_particles)``
+        px: array_like
+            x-components of the 3-momenta in GeV, same shape as ``e``
+        py: array_like
+            y-components of the 3-momenta in GeV, same shape as ``e``
+        pz: array_like
+            z-components of the 3-momenta in GeV, same shape as ``e``
+
+        Examples
+        --------
+        The vectorised counterpart of the :class:`Kinematics` example builds the dilepton system for all events at
+        once. With ``p`` an ``(n_events, n_particles)`` :class:`FourVectorArray` and ``idx_l1``, ``idx_l2`` the
+        column of the lepton and anti-lepton in each event
+
+        >>> rows = np.arange(len(p))
+        >>> l1, l2 = p[rows, idx_l1], p[rows, idx_l2]
+        >>> ll = l1 + l2  # dilepton system
+        >>> events = np.stack([l1.get_pt(), l2.get_pt(), ll.get_inv_mass()], axis=-1)
+
+        The results agree with the scalar :class:`Kinematics` methods event by event up to floating point round-off.
+        """
+        self.e = np.ascontiguousarray(e, dtype=np.float64)
+        self.px = np.ascontiguousarray(px, dtype=np.float64)
+        self.py = np.ascontiguousarray(py, dtype=np.float64)
+        self.pz = np.ascontiguousarray(pz, dtype=np.float64)
+
+        if not (self.e.shape == self.px.shape == self.py.shape == self.pz.shape):
+            raise ValueError("Four-momentum components must have identical shapes, got {}, {}, {}, {}".format(
+                self.e.shape, self.px.shape, self.py.shape, self.pz.shape))
+
+    @classmethod
+    def from_particles(cls, particles):
+        """
+        Builds a :class:`FourVectorArray` from lists of :class:`pylhe.LHEParticle` objects
+
+        Parameters
+        ----------
+        particles: array_like
+            List of events, each given as a list of particles. All events must have the same number of particles.
+
+        Returns
+        -------
+        :class:`ml4eft.preproc.lhe_reader.FourVectorArray`
+            ``(n_events, n_particles)`` four-momenta
+        """
+        p = np.array([[[part.e, part.px, part.py, part.pz] for part in event] for event in particles],
+                     dtype=np.float64).reshape(len(particles), -1, 4)
+        return cls(p[..., 0], p[..., 1], p[..., 2], p[..., 3])
+
+    @property
+    def shape(self):
+        """
+        Shape of the batch
+        """
+        return self.e.shape
+
+    def __len__(self):
+        return len(self.e)
+
+    def __getitem__(self, idx):
+        """
+        Selects a subset of four-momenta with NumPy indexing
+
+        Parameters
+        ----------
+        idx: int, slice, array_like or tuple
+            Any valid NumPy index, e.g. ``(rows, cols)`` to pick one particle per event
+
+        Returns
+        -------
+        :class:`ml4eft.preproc.lhe_reader.FourVectorArray`
+            Selected four-momenta
+        """
+        return FourVectorArray(self.e[idx], self.px[idx], self.py[idx], self.pz[idx])
+
+    def __add__(self, other):
+        """
+        Returns the systems obtained by adding the four-momenta element-wise
+
+        Parameters
+        ----------
+        other: :class:`ml4eft.preproc.lhe_reader.FourVectorArray`
+            Four-momenta to combine, broadcastable against ``self``
+
+        Returns
+        -------
+        :class:`ml4eft.preproc.lhe_reader.FourVectorArray`
+            Four-momenta of the combined systems
+        """
+        return FourVectorArray(self.e + other.e, self.px + other.px, self.py + other.py, self.pz + other.pz)
+
+    def sum(self, axis=-1):
+        """
+        Returns the system of all particles along ``axis``, e.g. the sum over the particles in each event
+
+        Parameters
+        ----------
+        axis: int, optional
+            Axis to sum over, the last axis by default
+
+        Returns
+        -------
+        :class:`ml4eft.preproc.lhe_reader.FourVectorArray`
+            Four-momenta of the combined systems
+        """
+        return FourVectorArray(self.e.sum(axis=axis), self.px.sum(axis=axis), self.py.sum(axis=axis),
+                               self.pz.sum(axis=axis))
+
+    def get_inv_mass(self):
+        """
+        Returns the invariant masses in GeV
+
+        Returns
+        -------
+        numpy.ndarray
+            Invariant masses in GeV
+        """
+        return np.sqrt(self.e ** 2 - self.px ** 2 - self.py ** 2 - self.pz ** 2)
+
+    def get_pt(self):
+        """
+        Returns the transverse momenta in GeV
+
+        Returns
+        -------
+        numpy.ndarray
+            Transverse momenta in GeV
+        """
+        return np.sqrt(self.px ** 2 + self.py ** 2)
+
+    def get_p(self):
+        """
+        Returns the magnitudes of the 3-momenta
+
+        Returns
+        -------
+        numpy.ndarray
+            Magnitudes of the 3-momenta
+        """
+        return np.sqrt(self.px ** 2 + self.py ** 2 + self.pz ** 2)
+
+    def get_phi(self):
+        """
+        Returns the azimuthal angles in radians, following the same convention as :meth:`Kinematics.get_phi`
+
+        Returns
+        -------
+        numpy.ndarray
+            Azimuthal angles in the transverse plane
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            phi = np.arctan(self.px / self.py)
+        return np.where((self.px > 0) & (self.py > 0), phi, np.where(self.py < 0, phi + np.pi, 2 * np.pi + phi))
+
+    def get_theta(self):
+        """
+        Returns the scattering angles in radians with respect to the beam-axis
+
+        Returns
+        -------
+        numpy.ndarray
+            Scattering angles with respect to the beam-axis
+        """
+        cos_theta = self.pz / self.get_p()
+        return np.arccos(cos_theta)
+
+    def get_pseudorapidity(self):
+        """
+        Returns the pseudorapidities :math:`\eta`
+
+        Returns
+        -------
+        numpy.ndarray
+            Pseudorapidities
+        """
+        theta = self.get_theta()
+        return - np.log(np.tan(theta / 2))
+
+    def get_rapidity(self):
+        """
+        Returns the rapidities :math:`Y`
+
+        Returns
+        -------
+        numpy.ndarray
+            Rapidities
+        """
+        return 0.5 * np.log((self.e + self.pz) / (self.e - self.pz))
+
+
 def get_deta(eta1, eta2):
     """
     Returns the absolute difference in pseudorapidity
 
     Parameters
     ----------
-    eta1: float
+    eta1: float or array_like
         Pseudorapidity of particle 1
-    eta2: float
+    eta2: float or array_like
         Pseudorapidity of particle 2
 
     Returns
     -------
-    float
+    float or numpy.ndarray
         Absolute difference in pseudorapidity
     """
     return np.abs(eta1 - eta2)
@@ -218,15 +420,15 @@ def get_dphi(phi1, phi2):
 
     Parameters
     ----------
-    phi1: float
+    phi1: float or array_like
         Azimuthal angle of particle 1
-    phi2: float
+    phi2: float or array_like
         Azimuthal angle of particle 2
 
     Returns
     -------
-    float
+    float or numpy.ndarray
         Absolute difference in azimuthal angle (shortest)
     """
     dphi = np.abs(phi1 - phi2)
-    return dphi if dphi <= np.pi else 2 * np.pi - dphi
+    return np.where(dphi <= np.pi, dphi, 2 * np.pi - dphi)[()]